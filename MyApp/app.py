@@ -1,21 +1,49 @@
-from flask import Flask, render_template, request, jsonify, g, session, redirect, url_for, send_file
+from flask import Flask, render_template, request, jsonify, g, session, redirect, url_for, send_file, Response, stream_with_context
 import os
 import sqlite3
 from werkzeug.utils import secure_filename
 from io import BytesIO
 from PIL import Image, ImageDraw, ImageFont
 import mimetypes
+import json
+import threading
+import multiprocessing
+import tempfile
 import hashlib
-import binascii
-import secrets
-import shutil
+from concurrent.futures import TimeoutError as FuturesTimeout
 from datetime import datetime
 import sys
+import click
+import importlib.util
+from model_loader import ModelLoader
+from jobs import JobQueue, QueueFull
+from image_index import ImageIndex
+from derivative_cache import DerivativeCache, VARIANTS
+from prediction_cache import PredictionCache
+import migrations
+import backups
+import dashboard_stats
+from query_cache import QueryCache, normalize_sql
+from pagination import CursorError, decode_cursor, encode_cursor, fetch_page, page_size, skip_rows, stream_rows
+from db_pool import ConnectionPool, configure_connection
+import query_plans
+from query_guard import QueryBudget, SlowQueryLog
+import passwords
+from passwords import HasherBusy, PasswordHasher
+import bulk_ingest
+import scan_loader
 
 # Optional ML dependencies (graceful fallback if unavailable)
 try:
     import numpy as np
     import cv2
+    from batching import MicroBatcher
+    from preprocessing import load_image_tensor, preprocess_input, prepare_upload
+    from tensor_cache import TensorCache
+    from tflite_backend import TFLITE_BACKENDS, TFLiteModel, backend_path
+    import bulk_predict
+    import tensor_shards
+    import perceptual_hash
     CV2_AVAILABLE = True
     print("✓ OpenCV loaded successfully")
 except Exception as e:
@@ -24,111 +52,304 @@ except Exception as e:
     CV2_AVAILABLE = False
     np = None
     cv2 = None
+    MicroBatcher = None
+    load_image_tensor = None
+    TensorCache = None
+    bulk_predict = None
+
+# TensorFlow is only located here; it is imported by the background model loader
+# so that importing this module (and every route that doesn't predict) stays fast.
+TF_AVAILABLE = importlib.util.find_spec('tensorflow') is not None
+if not TF_AVAILABLE:
+    print("⚠️  TensorFlow not available")
+    print("   Model prediction disabled.")
 
-try:
-    from tensorflow.keras.models import load_model
-    from tensorflow.keras.applications.xception import preprocess_input
+MODEL_PATH = os.environ.get('MODEL_PATH', 'models/optimized_best.h5')
+MODEL_NAME = 'xception_optimized_86val_70test'
+TUMOR_CLASSES = ['glioma_tumor', 'meningioma_tumor', 'no_tumor', 'pituitary_tumor']
+
+# Concurrent /predict_scan requests are stacked into one model call.
+PREDICT_MAX_BATCH = int(os.environ.get('PREDICT_MAX_BATCH', 16))
+PREDICT_MAX_WAIT_MS = float(os.environ.get('PREDICT_MAX_WAIT_MS', 10))
+
+# /predict_scans and the backfill-predictions command
+BULK_PREDICT_BATCH = int(os.environ.get('BULK_PREDICT_BATCH', 32))
+BULK_PREDICT_WORKERS = int(os.environ.get('BULK_PREDICT_WORKERS', os.cpu_count() or 1))
+# longer scan_ids lists (and every filter) are queued as a job instead of run in the request
+PREDICT_SCANS_INLINE_MAX = int(os.environ.get('PREDICT_SCANS_INLINE_MAX', 64))
+# scans packed by tensor_shards.py are read from these shards instead of being decoded
+TENSOR_SHARD_DIR = os.environ.get('TENSOR_SHARD_DIR') or os.path.join(os.path.dirname(__file__), 'processed_training', 'shards')
+
+# /bulk_ingest and the bulk-ingest command
+BULK_INGEST_WORKERS = int(os.environ.get('BULK_INGEST_WORKERS', os.cpu_count() or 1))
+BULK_INGEST_CHUNK = int(os.environ.get('BULK_INGEST_CHUNK', 500))
+BULK_INGEST_MAX_MB = int(os.environ.get('BULK_INGEST_MAX_MB', 512))
+BULK_INGEST_MAX_FILES = int(os.environ.get('BULK_INGEST_MAX_FILES', 10000))
+
+# asynchronous /predict_jobs queue
+INFERENCE_WORKERS = int(os.environ.get('INFERENCE_WORKERS', 2))
+PREDICT_QUEUE_SIZE = int(os.environ.get('PREDICT_QUEUE_SIZE', 64))
+
+# background: load in a thread at startup | lazy: load on first prediction | eager: load at import
+MODEL_LOAD_MODE = os.environ.get('MODEL_LOAD_MODE', 'background')
+MODEL_WARMUP_RUNS = int(os.environ.get('MODEL_WARMUP_RUNS', 2))
+MODEL_LOAD_TIMEOUT = float(os.environ.get('MODEL_LOAD_TIMEOUT', 120))
+
+# keras (full precision) | tflite_fp16 | tflite_dynamic | tflite_int8 (built by export_model.py)
+MODEL_BACKEND = os.environ.get('MODEL_BACKEND', 'keras')
+
+
+def _backend_within_budget(backend):
+    """Check models/export_report.json: a quantized build is only served once export_model.py passed it."""
+    report_path = os.path.join(os.path.dirname(MODEL_PATH), 'export_report.json')
+    try:
+        with open(report_path) as f:
+            entry = json.load(f)['backends'][backend]
+    except (OSError, ValueError, KeyError):
+        return False, f"no export report entry for {backend} (run export_model.py)"
+    if not entry.get('within_budget'):
+        return False, '; '.join(entry.get('budget_violations') or ['outside the accuracy budget'])
+    return True, None
+
+
+def _load_tumor_model():
     import tensorflow as tf
     print("TensorFlow version:", tf.__version__)
 
-    TF_AVAILABLE = True
-    print("✓ TensorFlow loaded successfully")
-except Exception as e:
-    print(f"⚠️  TensorFlow not available: {e}")
-    print("   Model prediction disabled.")
-    TF_AVAILABLE = False
-    load_model = None
-    preprocess_input = None
+    model_file = MODEL_PATH
+    if MODEL_BACKEND != 'keras':
+        if MODEL_BACKEND not in TFLITE_BACKENDS:
+            raise ValueError(f"unknown MODEL_BACKEND {MODEL_BACKEND!r}")
+        promoted, reason = _backend_within_budget(MODEL_BACKEND)
+        if promoted:
+            model_file = backend_path(MODEL_PATH, MODEL_BACKEND)
+        else:
+            print(f"⚠️  Not serving {MODEL_BACKEND}: {reason}; falling back to keras")
+
+    if model_file == MODEL_PATH:
+        from tensorflow.keras.models import load_model
+        model = load_model(MODEL_PATH, compile=False)
+        served_backend = 'keras'
+    else:
+        model = TFLiteModel(model_file, num_threads=os.cpu_count(), max_batch=max(PREDICT_MAX_BATCH, BULK_PREDICT_BATCH))
+        served_backend = MODEL_BACKEND
+    model_loader.backend = served_backend
+    print(f"✓ Loaded tumor detection model from {model_file} ({served_backend})")
+    print("Input shape:", model.input_shape)
+    print("Output shape:", model.output_shape)
+
+    # cached predictions are only valid for this exact set of weights
+    prediction_cache.set_model_version(_model_version(model_file, served_backend))
+    return model
+
+
+def _model_version(path, backend='keras'):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return f"{MODEL_NAME}:{backend}:{h.hexdigest()[:16]}"
+
+
+def _warm_up_tumor_model(model):
+    if isinstance(model, TFLiteModel):
+        # allocate every batch-size bucket now rather than under load
+        model.warm_up()
+        return
+    # trace both the single-image and the full micro-batch shapes
+    for batch_size in {1, PREDICT_MAX_BATCH}:
+        model.predict(np.zeros((batch_size, 299, 299, 3), dtype='float32'), verbose=0)
 
-MODEL_PATH = 'models/optimized_best.h5'
-TUMOR_CLASSES = ['glioma_tumor', 'meningioma_tumor', 'no_tumor', 'pituitary_tumor']
 
-tumor_model = None
-if TF_AVAILABLE:
-    try:
-        # tumor_model = tf.keras.models.load_model(MODEL_PATH, compile=False)
-        tumor_model = load_model(MODEL_PATH, compile=False)
-        print(f"✓ Loaded tumor detection model from {MODEL_PATH}")
-        print("Input shape:", tumor_model.input_shape)
-        print("Output shape:", tumor_model.output_shape)
+_batcher = None
+prediction_cache = PredictionCache(max_entries=int(os.environ.get('PREDICTION_CACHE_SIZE', 4096)))
 
-    except Exception as e:
-        print(f"⚠️  Could not load model: {e}")
+model_loader = ModelLoader(_load_tumor_model, _warm_up_tumor_model if CV2_AVAILABLE else None, MODEL_WARMUP_RUNS)
+if not TF_AVAILABLE:
+    model_loader.disable('TensorFlow not available')
+
+
+def _predict_batch(img_batch):
+    return model_loader.model.predict(img_batch, verbose=0)
+
+
+def get_batcher():
+    global _batcher
+    if _batcher is None:
+        _batcher = MicroBatcher(_predict_batch, max_batch_size=PREDICT_MAX_BATCH, max_wait_ms=PREDICT_MAX_WAIT_MS)
+    return _batcher
+
+
+def predict_tumor(image_path, db=None, prepared=None):
+    """Run actual model prediction on MRI image.
+
+    Returns a dict with predicted_label, confidence, image_sha256, model_version and
+    `cached`. When `db` is given, previously classified images are answered from the
+    prediction cache without running the model. `prepared` is an already decoded
+    (uint8 model-size pixels, image_sha256) pair from the tensor cache; with it the
+    image file is not read at all.
+    """
+    result = {'predicted_label': 'no_tumor', 'confidence': 0.0, 'image_sha256': None,
+              'model_version': None, 'cached': None}
 
-def predict_tumor(image_path):
-    """Run actual model prediction on MRI image"""
     if not CV2_AVAILABLE or not TF_AVAILABLE:
         print("⚠️ ML dependencies unavailable, returning default")
-        return 'no_tumor', 0.0
+        return result
     
-    if tumor_model is None:
+    if model_loader.get(timeout=MODEL_LOAD_TIMEOUT) is None:
         print("⚠️ Model not loaded, returning default")
-        return 'no_tumor', 0.0
+        return result
     
     try:
         # Preprocess image
-        img = cv2.imread(image_path)
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        img = cv2.resize(img, (299, 299))
-        img = preprocess_input(img)
-        img_batch = np.expand_dims(img, axis=0)
-        
-        # Run prediction
-        predictions = tumor_model.predict(img_batch, verbose=0)
-        class_idx = np.argmax(predictions[0])
-        confidence = float(predictions[0][class_idx])
+        if prepared is not None:
+            pixels, image_sha256 = prepared
+            img = preprocess_input(pixels.astype('float32'))
+        else:
+            img, image_sha256 = load_image_tensor(image_path)
+        result['image_sha256'] = image_sha256
+        result['model_version'] = prediction_cache.model_version
+
+        if db is not None:
+            cached = prediction_cache.get(db, image_sha256)
+            if cached is not None:
+                result.update(predicted_label=cached['predicted_label'], confidence=cached['confidence'], cached=cached)
+                return result
+
+        # Run prediction (batched with any concurrent requests)
+        predictions = get_batcher().predict(img)
+        class_idx = int(np.argmax(predictions))
+        confidence = float(predictions[class_idx])
         predicted_class = TUMOR_CLASSES[class_idx]
         
         print(f"✓ Predicted: {predicted_class} with {confidence:.2%} confidence")
-        return predicted_class, confidence
+        result.update(predicted_label=predicted_class, confidence=confidence)
+        return result
         
     except Exception as e:
         print(f"⚠️  Prediction error: {e}")
-        return 'no_tumor', 0.0
+        result.update(image_sha256=None, model_version=None)
+        return result
     
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 app.config['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg', 'gif'}
-app.config["DATABASE"] = os.path.join(os.path.dirname(__file__), "brain_etl.db")
+app.config["DATABASE"] = os.environ.get('DATABASE_PATH') or os.path.join(os.path.dirname(__file__), "brain_etl.db")
+# let the front-end server (nginx/Apache) stream full-size files instead of Python
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE', '').lower() in ('1', 'true', 'yes')
 app.secret_key = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')  # Use env var in production
 
 # NOTE: we will use a `users` table in the database for authentication.
 # The script `create_users_table.py` can be used to populate patient users.
 DEFAULT_ADMIN_PASSWORD = 'password123'
+DEFAULT_PATIENT_PASSWORD = 'changeme'
+
+# PBKDF2 runs on a small bounded executor instead of request threads (see passwords.py)
+password_hasher = PasswordHasher(iterations=int(os.environ.get('PASSWORD_ITERATIONS', 100_000)),
+                                 workers=int(os.environ.get('PASSWORD_HASH_WORKERS', 2)),
+                                 max_pending=int(os.environ.get('PASSWORD_HASH_QUEUE', 64)),
+                                 timeout=float(os.environ.get('PASSWORD_HASH_TIMEOUT', 10)))
+# deferred: new patient accounts get their password hashed in background batches; inline: during upload
+PATIENT_CREDENTIALS = os.environ.get('PATIENT_CREDENTIALS', 'deferred').lower()
     
+# Long-lived connections shared by request and worker threads (WAL, see db_pool.py)
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+DB_BUSY_TIMEOUT_MS = int(os.environ.get('DB_BUSY_TIMEOUT_MS', 5000))
+DB_CACHE_SIZE_KB = int(os.environ.get('DB_CACHE_SIZE_KB', 16384))
+DB_MMAP_SIZE_MB = int(os.environ.get('DB_MMAP_SIZE_MB', 256))
+DB_STATEMENT_CACHE = int(os.environ.get('DB_STATEMENT_CACHE', 256))
+
+db_pool = ConnectionPool(app.config["DATABASE"], size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT,
+                         busy_timeout_ms=DB_BUSY_TIMEOUT_MS, cache_size_kb=DB_CACHE_SIZE_KB,
+                         mmap_size_mb=DB_MMAP_SIZE_MB, cached_statements=DB_STATEMENT_CACHE)
+
+
+# Console SELECT results, invalidated whenever anything commits to the database
+query_cache = QueryCache(app.config["DATABASE"],
+                         max_entries=int(os.environ.get('QUERY_CACHE_SIZE', 256)),
+                         max_rows=int(os.environ.get('QUERY_CACHE_MAX_ROWS', 200000)))
+
+
+# Online snapshots of the database, taken off the request path (BACKUP_INTERVAL_HOURS=0 disables)
+BACKUP_DIR = os.environ.get('BACKUP_DIR') or os.path.join(os.path.dirname(__file__), 'backups')
+backup_scheduler = backups.BackupScheduler(
+    app.config["DATABASE"], BACKUP_DIR,
+    interval_hours=float(os.environ.get('BACKUP_INTERVAL_HOURS', 24)),
+    keep_daily=int(os.environ.get('BACKUP_KEEP_DAILY', 7)),
+    keep_weekly=int(os.environ.get('BACKUP_KEEP_WEEKLY', 4)),
+    compress=os.environ.get('BACKUP_COMPRESS', 'true').lower() in ('1', 'true', 'yes'),
+    pages_per_step=int(os.environ.get('BACKUP_PAGES_PER_STEP', 1024)),
+    step_sleep=float(os.environ.get('BACKUP_STEP_SLEEP_MS', 10)) / 1000.0,
+    initial_delay=float(os.environ.get('BACKUP_INITIAL_DELAY', 60)))
+
+
+def connect_db(db_path=None, **kwargs):
+    """Open a one-off connection (CLI commands) with the same pragmas as the pool."""
+    conn = sqlite3.connect(db_path or app.config["DATABASE"], **kwargs)
+    return configure_connection(conn, DB_BUSY_TIMEOUT_MS, DB_CACHE_SIZE_KB, DB_MMAP_SIZE_MB)
+
+
 def get_db():
     if "db" not in g:
-        g.db = sqlite3.connect(app.config["DATABASE"])
-        g.db.row_factory = sqlite3.Row
-        print("Connected to the database")
+        g.db = db_pool.acquire()
     return g.db
 
 
-def _hash_password(password: str, salt=None, iterations: int = 100_000):
-    if salt is None:
-        salt = secrets.token_bytes(16)
-    dk = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations)
-    return binascii.hexlify(dk).decode('ascii'), binascii.hexlify(salt).decode('ascii'), iterations
+def _store_rehashed_password(username, old_hash):
+    """Callback for password_hasher.rehash_later: replace the credential unless it changed meanwhile."""
+    def store(pwd_hash, salt_hex, iterations):
+        with db_pool.connection() as conn:
+            conn.execute('UPDATE users SET password_hash = ?, password_salt = ?, iterations = ? '
+                         'WHERE username = ? AND password_hash = ?',
+                         (pwd_hash, salt_hex, iterations, username, old_hash))
+            conn.commit()
+    return store
 
 
-def _verify_password(stored_hash_hex: str, stored_salt_hex: str, iterations: int, candidate_password: str) -> bool:
-    try:
-        salt = binascii.unhexlify(stored_salt_hex)
-        dk = hashlib.pbkdf2_hmac('sha256', candidate_password.encode('utf-8'), salt, iterations)
-        return binascii.hexlify(dk).decode('ascii') == stored_hash_hex
-    except Exception:
+def _check_credentials(username, row, password):
+    """Verify `password` against a users row on the hasher; schedules a rehash when the
+    stored parameters are outdated. Raises HasherBusy / FuturesTimeout when overloaded."""
+    stored_hash, stored_salt, iterations, role, _ = row
+    pending_password = DEFAULT_PATIENT_PASSWORD if role == 'patient' else None
+    if not password_hasher.verify(stored_hash, stored_salt, iterations, password, pending_password):
         return False
+    if password_hasher.needs_rehash(iterations):
+        password_hasher.rehash_later(username, password, _store_rehashed_password(username, stored_hash))
+    return True
 
 
-def _backup_db(db_path: str) -> str:
-    ts = datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
-    backup = f"{db_path}.bak.{ts}"
+_credential_fill_lock = threading.Lock()
+_credential_fill_scheduled = False
+
+
+def _fill_credentials_batch():
+    global _credential_fill_scheduled
     try:
-        shutil.copy2(db_path, backup)
-    except Exception:
-        return ''
-    return backup
+        with db_pool.connection() as conn:
+            filled = passwords.fill_pending_credentials(conn, DEFAULT_PATIENT_PASSWORD, password_hasher.iterations)
+    finally:
+        # a failed batch (locked database, pool timeout) must not block every later fill
+        with _credential_fill_lock:
+            _credential_fill_scheduled = False
+    if filled:
+        # one batch per job; queue the next one behind any logins that arrived meanwhile
+        schedule_credential_fill()
+
+
+def schedule_credential_fill():
+    """Hash pending patient credentials on the hasher's executor (at most one batch queued at a time)."""
+    global _credential_fill_scheduled
+    with _credential_fill_lock:
+        if _credential_fill_scheduled:
+            return
+        _credential_fill_scheduled = True
+    try:
+        password_hasher.submit(_fill_credentials_batch)
+    except HasherBusy:
+        with _credential_fill_lock:
+            _credential_fill_scheduled = False
 
 
 def ensure_users_table_and_defaults():
@@ -137,9 +358,6 @@ def ensure_users_table_and_defaults():
     if not db_path or not os.path.exists(db_path):
         return
 
-    # backup db
-    _backup_db(db_path)
-
     conn = sqlite3.connect(db_path)
     cur = conn.cursor()
     cur.execute('''
@@ -157,7 +375,7 @@ def ensure_users_table_and_defaults():
     # ensure admin user exists
     cur.execute('SELECT 1 FROM users WHERE username = ?', ('admin',))
     if not cur.fetchone():
-        pwd_hash, salt_hex, iters = _hash_password(DEFAULT_ADMIN_PASSWORD)
+        pwd_hash, salt_hex, iters = passwords.hash_password(DEFAULT_ADMIN_PASSWORD, None, password_hasher.iterations)
         cur.execute('INSERT INTO users (username, password_hash, password_salt, iterations, role, patient_id, created_on) VALUES (?, ?, ?, ?, ?, ?, ?)',
                     ('admin', pwd_hash, salt_hex, iters, 'admin', None, datetime.utcnow().isoformat()))
 
@@ -166,17 +384,23 @@ def ensure_users_table_and_defaults():
         uname = f'rad{i}'
         cur.execute('SELECT 1 FROM users WHERE username = ?', (uname,))
         if not cur.fetchone():
-            pwd_hash, salt_hex, iters = _hash_password('password123')
+            pwd_hash, salt_hex, iters = passwords.hash_password('password123', None, password_hasher.iterations)
             cur.execute('INSERT INTO users (username, password_hash, password_salt, iterations, role, patient_id, created_on) VALUES (?, ?, ?, ?, ?, ?, ?)',
                         (uname, pwd_hash, salt_hex, iters, 'radiologist', None, datetime.utcnow().isoformat()))
 
     conn.commit()
+
+    # versioned schema changes (prediction cache keys, indexes, ...)
+    migrations.migrate(conn)
     conn.close()
 
+    # patient accounts created before a restart may still be waiting for their hash
+    schedule_credential_fill()
+
 
 # Ensure users table exists before first request / before serving.
 # Flask 3.0+ may not provide `before_first_request`; prefer `before_serving`
-# when available. Fall back to calling the initializer immediately.
+# when available. Otherwise start_services() runs the initializer at import.
 if hasattr(app, 'before_first_request'):
     @app.before_first_request
     def _ensure_users_table_on_start():
@@ -185,18 +409,54 @@ elif hasattr(app, 'before_serving'):
     @app.before_serving
     def _ensure_users_table_on_start():
         ensure_users_table_and_defaults()
-else:
-    # Final fallback: call at import time (safe and idempotent)
-    ensure_users_table_and_defaults()
+
+_serving_lock = None
+
+
+@app.before_request
+def _hold_serving_lock():
+    # taken on the first request, so CLI commands (restore-db among them) never hold it
+    global _serving_lock
+    if _serving_lock is None:
+        _serving_lock = backups.hold_serving_lock(app.config["DATABASE"]) or False
+
 
 @app.teardown_appcontext
 def close_db(exception):
     db = g.pop("db", None)
     if db is not None:
-        db.close()
+        db_pool.release(db)
         
-# Create upload folder if it doesn't exist
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+
+# Resized variants served by /image/<scan_id>?size=thumb|preview|full
+derivative_cache = DerivativeCache(
+    os.environ.get('DERIVATIVE_CACHE_DIR', os.path.join(os.path.dirname(__file__), 'derivative_cache')),
+    max_bytes=int(os.environ.get('DERIVATIVE_CACHE_MB', 512)) * 2 ** 20)
+IMAGE_MAX_AGE = int(os.environ.get('IMAGE_MAX_AGE', 86400))
+
+
+def cache_upload_thumbnail(path, width, height, thumbnail):
+    """Keep the thumbnail encoded while decoding an upload as its 'thumb' variant (best-effort)."""
+    if not thumbnail or not width or not height or max(width, height) <= VARIANTS['thumb']:
+        return  # small images are served as they are
+    try:
+        derivative_cache.store(path, 'thumb', thumbnail)
+    except OSError:
+        pass
+
+PLACEHOLDER_MAX_AGE = 300
+
+# Model-ready tensors prepared at upload time, reused by predict_scan
+tensor_cache = TensorCache(max_bytes=int(os.environ.get('TENSOR_CACHE_MB', 256)) * 2 ** 20,
+                           cache_dir=os.environ.get('TENSOR_CACHE_DIR') or None) if CV2_AVAILABLE else None
+
+# Perceptual-hash index over scans: flags re-uploads; with NEAR_DUPLICATE_REUSE, predict_scan may reuse
+# the result of a near duplicate from the same patient
+near_duplicates = perceptual_hash.NearDuplicateIndex(
+    phash_radius=int(os.environ.get('NEAR_DUPLICATE_PHASH_RADIUS', 4)),
+    dhash_radius=int(os.environ.get('NEAR_DUPLICATE_DHASH_RADIUS', 8)),
+    check_interval=float(os.environ.get('NEAR_DUPLICATE_CHECK_SECONDS', 5))) if CV2_AVAILABLE else None
+NEAR_DUPLICATE_REUSE = os.environ.get('NEAR_DUPLICATE_REUSE', 'false').lower() in ('1', 'true', 'yes')
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
@@ -238,7 +498,7 @@ def upload_file():
 @app.route('/submit_patient_scan', methods=['POST'])
 def submit_patient_scan():
     """Accepts multipart form with patient attributes and an MRI image file.
-    Creates a patient user (username auto-generated), saves the image, inserts a mri_scans row,
+    Creates a patient user (username auto-generated), saves the image, inserts patients/scans rows,
     and returns patient_id and scan_id. The actual ML prediction is a separate step.
     """
     try:
@@ -255,64 +515,205 @@ def submit_patient_scan():
         gender = request.form.get('gender') or None
         hospital_unit = request.form.get('hospital_unit') or None
 
-        # Save file
+        # Save file; everything else is derived from the in-memory bytes
         filename = secure_filename(file.filename)
         ts = datetime.utcnow().strftime('%Y%m%dT%H%M%S')
         filename_on_disk = f"{ts}_{filename}"
         save_path = os.path.join(app.config['UPLOAD_FOLDER'], filename_on_disk)
-        file.save(save_path)
+        data = file.read()
+        with open(save_path, 'wb') as f:
+            f.write(data)
 
-        # Compute simple image stats
+        # Decode once: dimensions, mean/std, thumbnail and the model input tensor
+        prepared = None
         try:
-            img = Image.open(save_path).convert('RGB')
-            orig_w, orig_h = img.size
-            # basic mean/std across channels
-            from PIL import ImageStat
-            stat = ImageStat.Stat(img)
-            mean_pixel = float(sum(stat.mean) / len(stat.mean))
-            std_pixel = float(sum(stat.stddev) / len(stat.stddev))
+            if CV2_AVAILABLE:
+                prepared = prepare_upload(data)
+                orig_w, orig_h = prepared.width, prepared.height
+                mean_pixel, std_pixel = prepared.mean_pixel, prepared.std_pixel
+                cache_upload_thumbnail(save_path, orig_w, orig_h, prepared.thumbnail)
+            else:
+                img = Image.open(BytesIO(data)).convert('RGB')
+                orig_w, orig_h = img.size
+                # basic mean/std across channels
+                from PIL import ImageStat
+                stat = ImageStat.Stat(img)
+                mean_pixel = float(sum(stat.mean) / len(stat.mean))
+                std_pixel = float(sum(stat.stddev) / len(stat.stddev))
         except Exception:
             orig_w = None
             orig_h = None
             mean_pixel = None
             std_pixel = None
 
-        # Create a new patient user record in `users` with auto-generated id
-        db = get_db()
-        cur = db.cursor()
-
-        patient_id = int(datetime.utcnow().timestamp() * 1000)
-        username = f"patient_{patient_id}"
-        pwd_hash, salt_hex, iters = _hash_password('changeme')
+        if PATIENT_CREDENTIALS == 'inline':
+            pwd_hash, salt_hex, iters = password_hasher.hash(DEFAULT_PATIENT_PASSWORD)
+        else:
+            # hashed in the background by schedule_credential_fill; the default password works meanwhile
+            pwd_hash, salt_hex, iters = '', '', passwords.PENDING_ITERATIONS
         created_on = datetime.utcnow().isoformat()
+        ingest_ts = created_on
+        scan_date = ingest_ts
+        original_path = save_path
+        processed_path = save_path
+        label = None
+
+        phash = prepared.phash if prepared is not None else None
+        dhash = prepared.dhash if prepared is not None else None
 
+        # Create the patient user, the patient and the scan. The patient id is allocated under
+        # the write lock like bulk ingest's, so the two paths never hand out the same id.
+        db = get_db()
+        cur = db.cursor()
+        cur.execute('BEGIN IMMEDIATE')
         try:
+            patient_id = bulk_ingest.allocate_patient_ids(db, 1)[0]
+            username = f"patient_{patient_id}"
             cur.execute('INSERT INTO users (username, password_hash, password_salt, iterations, role, patient_id, created_on) VALUES (?, ?, ?, ?, ?, ?, ?)',
                         (username, pwd_hash, salt_hex, iters, 'patient', patient_id, created_on))
-        except sqlite3.IntegrityError:
-            # fallback: if username exists, append random suffix
-            username = f"patient_{patient_id}_{secrets.token_hex(4)}"
-            cur.execute('INSERT INTO users (username, password_hash, password_salt, iterations, role, patient_id, created_on) VALUES (?, ?, ?, ?, ?, ?, ?)',
-                        (username, pwd_hash, salt_hex, iters, 'patient', patient_id, created_on))
+            cur.execute('INSERT INTO patients (patient_id, gender, created_on) VALUES (?, ?, ?)',
+                        (patient_id, gender, created_on))
+            cur.execute('''INSERT INTO scans (patient_id, original_path, processed_path, label, orig_width, orig_height, proc_width, proc_height, mean_pixel, std_pixel, age, gender, hospital_unit, scan_date, ingest_timestamp, phash, dhash)
+                           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                        (patient_id, original_path, processed_path, label, orig_w, orig_h, orig_w, orig_h, mean_pixel, std_pixel, age, gender, hospital_unit, scan_date, ingest_ts, phash, dhash))
+            scan_id = cur.lastrowid
+            db.commit()
+        except BaseException:
+            db.rollback()
+            raise
+
+        if iters == passwords.PENDING_ITERATIONS:
+            schedule_credential_fill()
+        if prepared is not None:
+            tensor_cache.put(scan_id, prepared.pixels, prepared.image_sha256)
+        duplicates = []
+        if near_duplicates is not None and phash is not None:
+            near_duplicates.refresh(db)
+            duplicates = near_duplicates.lookup(phash, dhash, exclude=scan_id, limit=5)
+            near_duplicates.add(scan_id, phash, dhash)
+
+        return jsonify({'success': True, 'patient_id': patient_id, 'username': username, 'scan_id': scan_id,
+                        'filepath': f'/static/uploads/{filename_on_disk}',
+                        'thumbnail_url': url_for('get_image', scan_id=scan_id, size='thumb'),
+                        'near_duplicates': duplicates})
+    except (HasherBusy, FuturesTimeout):
+        return jsonify({'success': False, 'error': 'Server busy, please retry'}), 503
+    except sqlite3.IntegrityError as e:
+        # e.g. a `patient_<id>` account left over without its patient_id; never share the id
+        return jsonify({'success': False, 'error': f'could not create the patient account: {e}'}), 409
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
 
-        # Insert into mri_scans table
-        ingest_ts = datetime.utcnow().isoformat()
-        scan_date = ingest_ts
-        original_path = save_path
-        processed_path = save_path
-        label = None
 
-        cur.execute('''INSERT INTO mri_scans (original_path, processed_path, label, orig_width, orig_height, proc_width, proc_height, mean_pixel, std_pixel, ingest_timestamp, patient_id, age, gender, hospital_unit, scan_date)
-                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                    (original_path, processed_path, label, orig_w, orig_h, orig_w, orig_h, mean_pixel, std_pixel, ingest_ts, patient_id, age, gender, hospital_unit, scan_date))
+def reuse_near_duplicate(db, scan_id, phash, dhash):
+    """Record the current model's prediction of a near-duplicate scan for `scan_id`.
 
+    Only scans of the same patient count: a close hash across patients is not
+    evidence of the same finding. The new row keeps the source's id in
+    `source_classification_id`, so accuracy reports can leave reused results out.
+    Returns the classify_scan response dict, or None when no such near duplicate
+    has been classified by the current model (or the scan itself has, which
+    the prediction cache answers).
+    """
+    model_version = prediction_cache.model_version
+    if near_duplicates is None or phash is None or model_version is None:
+        return None
+    if db.execute('SELECT 1 FROM tumor_classification WHERE scan_id = ? AND model_version = ? LIMIT 1',
+                  (scan_id, model_version)).fetchone():
+        return None
+    cur = db.cursor()
+    patient_id, processed_path = cur.execute('SELECT patient_id, processed_path FROM scans WHERE scan_id = ?',
+                                             (scan_id,)).fetchone()
+    if patient_id is None:
+        return None
+    near_duplicates.refresh(db)
+    for match in near_duplicates.lookup(phash, dhash, exclude=int(scan_id), limit=5):
+        source = db.execute('SELECT c.classification_id, c.predicted_label, c.confidence, '
+                            'COALESCE(c.source_classification_id, c.classification_id) '
+                            'FROM tumor_classification c JOIN scans s ON s.scan_id = c.scan_id '
+                            'WHERE c.scan_id = ? AND c.model_version = ? AND s.patient_id = ? '
+                            'ORDER BY c.classification_id DESC LIMIT 1',
+                            (match['scan_id'], model_version, patient_id)).fetchone()
+        if source is None:
+            continue
+        cur.execute('INSERT INTO tumor_classification (scan_id, processed_path, predicted_label, confidence, model_name, classified_on, image_sha256, model_version, source_classification_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (scan_id, processed_path, source[1], source[2], MODEL_NAME, datetime.utcnow().isoformat(), None, model_version, source[3]))
+        class_id = cur.lastrowid
+        cur.execute('UPDATE scans SET label = ? WHERE scan_id = ?', (source[1], scan_id))
         db.commit()
+        cache_stats = prediction_cache.stats()
+        return {
+            'success': True,
+            'classification_id': class_id,
+            'predicted_label': source[1],
+            'confidence': source[2],
+            'cache': {'hit': False, 'hits': cache_stats['hits'], 'misses': cache_stats['misses']},
+            'near_duplicate_of': dict(match, classification_id=source[3]),
+        }
+    return None
 
-        scan_id = cur.lastrowid
 
-        return jsonify({'success': True, 'patient_id': patient_id, 'username': username, 'scan_id': scan_id, 'filepath': f'/static/uploads/{filename_on_disk}'})
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+def classify_scan(db, scan_id, reuse_duplicates=None):
+    """Classify one stored scan and record the result; returns the response dict or None if not found.
+
+    When `reuse_duplicates` is True (default: NEAR_DUPLICATE_REUSE), a scan
+    that is a near duplicate of one of the same patient's scans the current
+    model already classified takes that result without running the model.
+    """
+    cur = db.cursor()
+    row = cur.execute('SELECT processed_path, original_path, phash, dhash FROM scans WHERE scan_id = ?', (scan_id,)).fetchone()
+    if not row:
+        return None
+
+    if NEAR_DUPLICATE_REUSE if reuse_duplicates is None else reuse_duplicates:
+        reused = reuse_near_duplicate(db, scan_id, row[2], row[3])
+        if reused is not None:
+            return reused
+
+    processed_path = row[0]
+    prepared = tensor_cache.get(scan_id) if tensor_cache is not None else None
+    image_path = processed_path if prepared is not None else (find_local_image(row[1], processed_path) or processed_path)
+
+    prediction = predict_tumor(image_path, db, prepared=prepared)
+    predicted_label = prediction['predicted_label']
+    confidence = prediction['confidence']
+    cached = prediction['cached']
+    classified_on = datetime.utcnow().isoformat()
+
+    if cached is not None and cached.get('scan_id') == int(scan_id):
+        # this exact scan was already classified by the current model
+        class_id = cached['classification_id']
+    else:
+        cur.execute('INSERT INTO tumor_classification (scan_id, processed_path, predicted_label, confidence, model_name, classified_on, image_sha256, model_version) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (scan_id, processed_path, predicted_label, confidence, MODEL_NAME, classified_on, prediction['image_sha256'], prediction['model_version']))
+        class_id = cur.lastrowid
+
+    # Update scans.label with prediction
+    cur.execute('UPDATE scans SET label = ? WHERE scan_id = ?', (predicted_label, scan_id))
+
+    db.commit()
+
+    if cached is None and prediction['image_sha256'] and prediction['model_version']:
+        prediction_cache.put(prediction['image_sha256'], prediction['model_version'], {
+            'classification_id': class_id,
+            'scan_id': int(scan_id),
+            'processed_path': processed_path,
+            'predicted_label': predicted_label,
+            'confidence': confidence,
+        })
+
+    cache_stats = prediction_cache.stats()
+    return {
+        'success': True, 
+        'classification_id': class_id, 
+        'predicted_label': predicted_label, 
+        'confidence': confidence,
+        'cache': {
+            'hit': cached is not None,
+            'hits': cache_stats['hits'],
+            'misses': cache_stats['misses'],
+        }
+    }
 
 
 @app.route('/predict_scan', methods=['POST'])
@@ -324,48 +725,624 @@ def predict_scan():
         return jsonify({'success': False, 'error': 'scan_id required'}), 400
 
     try:
-        db = get_db()
-        cur = db.cursor()
-        row = cur.execute('SELECT processed_path FROM mri_scans WHERE rowid = ?', (scan_id,)).fetchone()
-        if not row:
+        result = classify_scan(get_db(), scan_id, reuse_duplicates=data.get('reuse_near_duplicate'))
+        if result is None:
             return jsonify({'success': False, 'error': 'scan not found'}), 404
+        return jsonify(result)
+        
+    except Exception as e:
+        print(f" Error in predict_scan: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+def run_bulk_prediction(conn, scan_ids=None, only_unlabeled=False, limit=None, batch_size=None, workers=None, progress=None):
+    """Classify many stored scans through the process-pool pipeline in bulk_predict.
+
+    Raises RuntimeError when the model is unavailable.
+    """
+    if not CV2_AVAILABLE or not TF_AVAILABLE:
+        raise RuntimeError('ML dependencies unavailable')
+    model = model_loader.get(timeout=MODEL_LOAD_TIMEOUT)
+    if model is None:
+        raise RuntimeError('Model not loaded')
+
+    scans = bulk_predict.select_scans(conn, scan_ids=scan_ids, only_unlabeled=only_unlabeled, limit=limit)
+    return bulk_predict.predict_scans(conn, scans, model, TUMOR_CLASSES, prediction_cache, MODEL_NAME,
+                                      batch_size=batch_size or BULK_PREDICT_BATCH, workers=workers or BULK_PREDICT_WORKERS,
+                                      resolve_path=find_local_image, shards=tensor_shards.open_dataset(TENSOR_SHARD_DIR),
+                                      progress=progress)
+
+
+@app.cli.command('migrate')
+@click.option('--status', is_flag=True, help='Show applied and pending migrations without applying anything.')
+@click.option('--to', 'target', type=int, default=None, help='Apply migrations up to this version only.')
+def migrate_command(status, target):
+    """Apply pending schema migrations to the database."""
+    conn = connect_db(timeout=30)
+    try:
+        if not status:
+            applied = migrations.migrate(conn, target)
+            if not applied:
+                print("✓ Schema is up to date")
+        for version, name, applied_on, duration_ms in migrations.history(conn):
+            print(f"  {version:4d}  applied {applied_on}  {name}")
+        for version, name in migrations.pending(conn):
+            print(f"  {version:4d}  pending  {name}")
+    finally:
+        conn.close()
+
+
+@app.cli.command('check-query-plans')
+@click.option('--verbose', is_flag=True, help='Print the plan of every query, not only failing ones.')
+def check_query_plans(verbose):
+    """EXPLAIN QUERY PLAN every app query and fail if one scans a table or sorts without an index."""
+    conn = connect_db()
+    try:
+        failures = 0
+        for query, details, problems in query_plans.check(conn):
+            if problems:
+                failures += 1
+                print(f"⚠️  {query.name}: {'; '.join(problems)}")
+                print(f"    {query.sql}")
+            elif verbose:
+                print(f"✓ {query.name}: {' | '.join(details)}")
+    finally:
+        conn.close()
+    if failures:
+        print(f"⚠️  {failures} of {len(query_plans.APP_QUERIES)} queries do not use an index")
+        sys.exit(1)
+    print(f"✓ All {len(query_plans.APP_QUERIES)} queries use an index")
+
+
+@app.cli.command('rebuild-dashboard-stats')
+@click.option('--verify-only', is_flag=True, help='Compare scan_stats with a fresh GROUP BY without rewriting it.')
+def rebuild_dashboard_stats(verify_only):
+    """Recompute the dashboard aggregate table from scans and check it matches."""
+    conn = connect_db(timeout=30)
+    try:
+        if not verify_only:
+            started = datetime.utcnow()
+            with conn:
+                rows = dashboard_stats.rebuild(conn)
+            print(f"✓ Rebuilt scan_stats: {rows} rows in {(datetime.utcnow() - started).total_seconds():.2f}s")
+        mismatches = dashboard_stats.verify(conn)
+    finally:
+        conn.close()
+    for (dimension, bucket, label), stored, expected in mismatches[:20]:
+        print(f"⚠️  {dimension}={bucket!r} label={label!r}: stored {stored}, expected {expected}")
+    if mismatches:
+        print(f"⚠️  {len(mismatches)} aggregate rows differ from the scans table")
+        sys.exit(1)
+    print("✓ scan_stats matches the scans table")
+
+
+@app.cli.command('backup-db')
+@click.option('--no-compress', is_flag=True, help='Keep the snapshot as a plain .db file.')
+@click.option('--no-prune', is_flag=True, help='Do not apply the retention policy afterwards.')
+def backup_db_command(no_compress, no_prune):
+    """Take an integrity-checked online snapshot of the database now."""
+    try:
+        result = backups.backup(app.config["DATABASE"], BACKUP_DIR, compress=not no_compress,
+                                pages_per_step=backup_scheduler.pages_per_step, step_sleep=backup_scheduler.step_sleep)
+    except backups.BackupError as e:
+        print(f"⚠️  {e}")
+        sys.exit(1)
+    print(f"✓ Snapshot {result['path']} ({result['pages']} pages, {result['file_size_bytes'] / 1e6:.1f} MB, "
+          f"{result['total_ms']:.0f} ms, integrity ok)")
+    if not no_prune:
+        for path in backups.prune(BACKUP_DIR, app.config["DATABASE"], backup_scheduler.keep_daily,
+                                  backup_scheduler.keep_weekly):
+            print(f"  pruned {os.path.basename(path)}")
+
+
+@app.cli.command('list-backups')
+def list_backups_command():
+    """List database snapshots, newest first, and which ones the retention policy keeps."""
+    snapshots = backups.list_snapshots(BACKUP_DIR, app.config["DATABASE"])
+    keep = backups.select_retained(snapshots, backup_scheduler.keep_daily, backup_scheduler.keep_weekly)
+    for snap in snapshots:
+        status = 'keep ' if snap['path'] in keep else 'prune'
+        integrity = snap.get('meta', {}).get('integrity_check', '?')
+        print(f"  {status}  {snap['name']}  {snap['size_bytes'] / 1e6:8.1f} MB  integrity={integrity}")
+    if not snapshots:
+        print(f"No snapshots in {BACKUP_DIR}")
+
+
+@app.cli.command('restore-db')
+@click.argument('snapshot')
+@click.option('--yes', is_flag=True, help='Do not ask for confirmation.')
+def restore_db_command(snapshot, yes):
+    """Replace the database with SNAPSHOT (a path or a name from list-backups)."""
+    path = snapshot if os.path.exists(snapshot) else os.path.join(BACKUP_DIR, snapshot)
+    if not yes:
+        click.confirm(f"Replace {app.config['DATABASE']} with {path}?", abort=True)
+    try:
+        safety = backups.restore(path, app.config["DATABASE"], BACKUP_DIR)
+    except backups.BackupError as e:
+        print(f"⚠️  {e}")
+        sys.exit(1)
+    print(f"✓ Restored {os.path.basename(path)}; previous state saved as {safety['path']}")
+    if tensor_cache is not None:
+        tensor_cache.clear()  # TENSOR_CACHE_DIR entries are keyed by scan id
+    # an older snapshot may predate the current schema
+    conn = connect_db(timeout=30)
+    try:
+        migrations.migrate(conn)
+    finally:
+        conn.close()
+
+
+@app.cli.command('backfill-predictions')
+@click.option('--all', 'rescore_all', is_flag=True, help='Re-score every scan, not only rows with label IS NULL.')
+@click.option('--scan-id', 'scan_ids', multiple=True, type=int, help='Scan id to classify (repeatable).')
+@click.option('--limit', type=int, default=None, help='Classify at most this many scans.')
+@click.option('--batch-size', type=int, default=None, help='Images per model call.')
+@click.option('--workers', type=int, default=None, help='Decode/preprocess processes.')
+def backfill_predictions(rescore_all, scan_ids, limit, batch_size, workers):
+    """Classify unlabeled (or all) scans offline and store the predictions."""
+    def progress(done, total, elapsed):
+        rate = done / elapsed if elapsed > 0 else 0.0
+        print(f"  {done}/{total} scans ({rate:.1f} images/sec)")
+
+    conn = connect_db()
+    try:
+        summary = run_bulk_prediction(conn, scan_ids=list(scan_ids), only_unlabeled=not rescore_all, limit=limit,
+                                      batch_size=batch_size, workers=workers, progress=progress)
+    finally:
+        conn.close()
+
+    print(f"✓ Classified {summary['total']} scans in {summary['elapsed_seconds']:.1f}s "
+          f"({summary['images_per_sec'] or 0:.1f} images/sec): {summary['predicted']} predicted, "
+          f"{summary['cached']} from cache, {summary['failed']} failed ({summary['from_shards']} read from tensor shards, "
+          f"{summary['stale_shard_rows']} stale shard rows decoded instead)")
+    for err in summary['errors'][:20]:
+        print(f"⚠️  scan {err['scan_id']}: {err['error']}")
+
+
+def run_bulk_ingest(conn, images, manifest=None, workers=None, chunk_size=None, keep_tensors=True, progress=None):
+    """Ingest many images (see bulk_ingest.py); patient accounts always get pending credentials."""
+    items, summary = bulk_ingest.ingest(conn, images, manifest, upload_dir=app.config['UPLOAD_FOLDER'],
+                                        workers=workers or BULK_INGEST_WORKERS,
+                                        chunk_size=chunk_size or BULK_INGEST_CHUNK,
+                                        pending_credential=('', '', passwords.PENDING_ITERATIONS),
+                                        allowed=allowed_file, keep_tensors=keep_tensors and tensor_cache is not None,
+                                        progress=progress)
+    if any(item['success'] and item['username'] for item in items):
+        schedule_credential_fill()
+    for item in items:
+        if item['success']:
+            cache_upload_thumbnail(item['path'], item['width'], item['height'], item['thumbnail'])
+    if tensor_cache is not None:
+        for item in items:
+            if item['success'] and item.get('pixels') is not None:
+                tensor_cache.put(item['scan_id'], item['pixels'], item['image_sha256'])
+    if near_duplicates is not None:
+        for item in items:
+            if item['success']:
+                near_duplicates.add(item['scan_id'], item['phash'], item['dhash'])
+    return [bulk_ingest.report_item(item) for item in items], summary
+
+
+@app.cli.command('bulk-ingest')
+@click.argument('folder', type=click.Path(exists=True, file_okay=False))
+@click.option('--manifest', type=click.Path(exists=True, dir_okay=False), default=None,
+              help='CSV or JSON with file, age, gender, hospital_unit (and optionally patient_id, scan_date).')
+@click.option('--workers', type=int, default=None, help='Decode/save processes.')
+@click.option('--chunk-size', type=int, default=None, help='Images written per transaction.')
+@click.option('--report', type=click.Path(dir_okay=False), default=None, help='Write the per-item report to this JSON file.')
+def bulk_ingest_command(folder, manifest, workers, chunk_size, report):
+    """Ingest every image in FOLDER as new scans, copying them into the upload folder."""
+    def progress(stage, done, total):
+        if done == total or done % 500 == 0:
+            print(f"  {stage}: {done}/{total}")
+
+    entries = None
+    if manifest:
+        with open(manifest, 'rb') as f:
+            try:
+                entries = bulk_ingest.read_manifest(f.read(), manifest)
+            except bulk_ingest.ManifestError as e:
+                raise click.ClickException(str(e))
+    paths = [os.path.join(folder, name) for name in sorted(os.listdir(folder))]
+    images = [(os.path.basename(path), path) for path in paths
+              if os.path.isfile(path) and not (manifest and os.path.samefile(path, manifest))
+              and (entries is not None or allowed_file(path))]
+
+    conn = connect_db()
+    try:
+        # tensors would only fill this process's memory; predictions decode from disk
+        items, summary = run_bulk_ingest(conn, images, entries, workers=workers, chunk_size=chunk_size,
+                                         keep_tensors=False, progress=progress)
+    finally:
+        conn.close()
+
+    print(f"✓ Ingested {summary['ingested']}/{summary['total']} images in {summary['seconds']:.1f}s "
+          f"({summary['images_per_sec'] or 0:.1f} images/sec; decode {summary['decode_seconds']:.1f}s, "
+          f"write {summary['write_seconds']:.1f}s)")
+    for item in [item for item in items if not item['success']][:20]:
+        print(f"⚠️  {item['file']}: {item['error']}")
+    if report:
+        with open(report, 'w') as f:
+            json.dump({'items': items, 'summary': summary}, f, indent=2)
+        print(f"✓ Report written to {report}")
+
+
+@app.cli.command('load-scans')
+@click.argument('metadata', required=False, type=click.Path(exists=True, dir_okay=False))
+@click.option('--chunk-size', type=int, default=1000, show_default=True, help='Records per transaction.')
+@click.option('--seed', type=int, default=42, show_default=True, help='Seed for the synthetic demographics of new scans.')
+@click.option('--no-demographics', is_flag=True, help='Leave patient, age, unit and date empty on new scans.')
+@click.option('--restart', is_flag=True, help='Ignore the checkpoint of an interrupted load.')
+def load_scans_command(metadata, chunk_size, seed, no_demographics, restart):
+    """Stream etl.py's metadata.csv into scans (default: processed_training/metadata.csv)."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    metadata = os.path.abspath(metadata or os.path.join(here, 'processed_training', 'metadata.csv'))
+    if not os.path.exists(metadata):
+        raise click.ClickException(f'{metadata} not found; run etl.py first')
+
+    def progress(done, elapsed):
+        if done % (chunk_size * 10) == 0:
+            print(f"  {done} records ({done / elapsed if elapsed > 0 else 0.0:.0f} rows/sec)")
+
+    conn = connect_db()
+    try:
+        summary = scan_loader.load(conn, scan_loader.iter_metadata(metadata), metadata,
+                                   scan_loader.file_fingerprint(metadata), chunk_size=chunk_size, seed=seed,
+                                   demographics=not no_demographics, restart=restart, base_dir=here,
+                                   progress=progress)
+    except scan_loader.LoadError as e:
+        raise click.ClickException(f'{e} (load checkpointed; fix the input or use --restart)')
+    finally:
+        conn.close()
+
+    if summary['resumed_from']:
+        print(f"  resumed after record {summary['resumed_from']}")
+    print(f"✓ Loaded {summary['records']} records in {summary['seconds']:.1f}s ({summary['rows_per_sec'] or 0:.0f} rows/sec): "
+          f"{summary['inserted']} inserted, {summary['updated']} updated, {summary['unchanged']} unchanged")
+
+
+@app.cli.command('hash-scans')
+@click.option('--rehash', is_flag=True, help='Recompute hashes for every scan, not only rows without them.')
+@click.option('--workers', type=int, default=None, help='Decode processes.')
+def hash_scans_command(rehash, workers):
+    """Store perceptual hashes for scans that have none (training images and older uploads)."""
+    if not CV2_AVAILABLE:
+        raise click.ClickException('OpenCV is required to hash images')
+
+    def progress(done, total, elapsed):
+        if done % 1000 == 0:
+            print(f"  {done}/{total} images ({done / elapsed if elapsed > 0 else 0.0:.0f} images/sec)")
+
+    conn = connect_db()
+    try:
+        summary = perceptual_hash.hash_scans(conn, find_local_image, rehash=rehash, workers=workers, progress=progress)
+    finally:
+        conn.close()
+
+    print(f"✓ Hashed {summary['hashed']} of {summary['total']} scans in {summary['seconds']:.1f}s "
+          f"({summary['images_per_sec'] or 0:.0f} images/sec), {summary['failed']} failed")
+    for err in summary['errors'][:20]:
+        print(f"⚠️  scan {err['scan_id']}: {err['error']}")
+
+
+@app.cli.command('near-duplicates')
+@click.option('--phash-radius', type=int, default=None, help='Max pHash Hamming distance (default: NEAR_DUPLICATE_PHASH_RADIUS).')
+@click.option('--dhash-radius', type=int, default=None, help='Max dHash Hamming distance (default: NEAR_DUPLICATE_DHASH_RADIUS).')
+@click.option('--top', type=int, default=10, show_default=True, help='Largest clusters to print.')
+@click.option('--report', type=click.Path(dir_okay=False, writable=True), default=None,
+              help='Write every cluster and its scans to this JSON file.')
+def near_duplicates_command(phash_radius, dhash_radius, top, report):
+    """Report clusters of near-duplicate scans (run hash-scans first)."""
+    if not CV2_AVAILABLE:
+        raise click.ClickException('OpenCV is required to hash images')
+    index = perceptual_hash.NearDuplicateIndex(
+        phash_radius=near_duplicates.phash_radius if phash_radius is None else phash_radius,
+        dhash_radius=near_duplicates.dhash_radius if dhash_radius is None else dhash_radius)
+
+    conn = connect_db()
+    try:
+        index.load(conn)
+        summary = perceptual_hash.cluster_report(conn, index)
+    finally:
+        conn.close()
+
+    clusters = sorted(summary['cluster_list'], key=lambda c: -c['size'])
+    print(f"✓ {summary['clusters']} near-duplicate clusters among {summary['hashed_scans']} hashed scans "
+          f"({summary['duplicate_scans']} scans, {summary['redundant_scans']} redundant) in {summary['seconds']:.1f}s")
+    if summary['mixed_clusters'] or summary['label_conflicts']:
+        print(f"⚠️  {summary['mixed_clusters']} clusters mix training images with other scans, "
+              f"{summary['label_conflicts']} carry conflicting labels")
+    for cluster in clusters[:top]:
+        flags = ', '.join(f for f in ('mixed', 'label_conflict') if cluster[f])
+        print(f"  {cluster['size']} scans, {cluster['patients']} patients{' (' + flags + ')' if flags else ''}: "
+              f"{', '.join(str(row['scan_id']) for row in cluster['scans'][:8])}")
+
+    if report:
+        with open(report, 'w') as f:
+            json.dump(dict(summary, cluster_list=clusters), f, indent=2)
+        print(f"✓ Report written to {report}")
+
+
+@app.route('/bulk_ingest', methods=['POST'])
+def bulk_ingest_scans():
+    """Ingest many scans in one request.
+
+    Multipart form: `mri_files` (repeated) and an optional `manifest` file (CSV
+    or JSON) giving age, gender and hospital_unit per file name. Returns a
+    report per item plus counts and images/second.
+    """
+    if not session.get('logged_in') or session.get('user_type') not in ('admin', 'radiologist'):
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
 
-        processed_path = row[0]
+    # one request carries the whole batch, so it gets its own size and part limits
+    request.max_content_length = BULK_INGEST_MAX_MB * 1024 * 1024
+    request.max_form_parts = BULK_INGEST_MAX_FILES + 16  # room for the manifest and form fields
+    files = request.files.getlist('mri_files')
+    if not files:
+        return jsonify({'success': False, 'error': 'No MRI files provided'}), 400
 
-        predicted_label, confidence = predict_tumor(processed_path)
-        model_name = 'xception_optimized_86val_70test'
-        classified_on = datetime.utcnow().isoformat()
+    entries = None
+    manifest = request.files.get('manifest')
+    if manifest is not None and manifest.filename:
+        try:
+            entries = bulk_ingest.read_manifest(manifest.read(), manifest.filename)
+        except bulk_ingest.ManifestError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
 
-        cur.execute('INSERT INTO tumor_classification (processed_path, predicted_label, confidence, model_name, classified_on) VALUES (?, ?, ?, ?, ?)',
-                    (processed_path, predicted_label, confidence, model_name, classified_on))
+    try:
+        # staged on disk so workers get a path instead of the pickled bytes of every upload
+        with tempfile.TemporaryDirectory(prefix='bulk_ingest_') as staging:
+            images = []
+            for i, f in enumerate(files):
+                path = os.path.join(staging, f"{i}_{secure_filename(f.filename) or 'image'}")
+                f.save(path)
+                images.append((f.filename, path))
+            items, summary = run_bulk_ingest(get_db(), images, entries)
+        return jsonify({'success': True, 'items': items, 'summary': summary})
+    except Exception as e:
+        print(f" Error in bulk_ingest: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
 
-        # Update mri_scans.label with prediction
-        cur.execute('UPDATE mri_scans SET label = ? WHERE rowid = ?', (predicted_label, scan_id))
 
-        db.commit()
+@app.route('/predict_scans', methods=['POST'])
+def predict_scans():
+    """Classify many scans in one call: {"scan_ids": [...]} or {"filter": "unlabeled" | "all"}.
 
-        class_id = cur.lastrowid
-        
-        return jsonify({
-            'success': True, 
-            'classification_id': class_id, 
-            'predicted_label': predicted_label, 
-            'confidence': confidence
-        })
-        
+    Up to PREDICT_SCANS_INLINE_MAX scan_ids run in the request. Filters and
+    longer lists can cover the whole table, so they are queued as a backfill
+    job and answer 202 with the job id, like /predict_jobs.
+    """
+    if not session.get('logged_in') or session.get('user_type') not in ('admin', 'radiologist'):
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+
+    data = request.get_json() or {}
+    scan_ids = data.get('scan_ids') or []
+    scan_filter = data.get('filter')
+    if not scan_ids and scan_filter not in ('unlabeled', 'all'):
+        return jsonify({'success': False, 'error': 'scan_ids or filter ("unlabeled" or "all") required'}), 400
+
+    if not scan_ids or len(scan_ids) > PREDICT_SCANS_INLINE_MAX:
+        payload = {'scan_ids': scan_ids or None, 'filter': None if scan_ids else scan_filter, 'limit': data.get('limit')}
+        return _queue_prediction_job('predict_scans', payload, data.get('priority', 'backfill'))
+
+    try:
+        summary = run_bulk_prediction(get_db(), scan_ids=scan_ids, limit=data.get('limit'))
+        return jsonify({'success': True, **summary})
+    except RuntimeError as e:
+        return jsonify({'success': False, 'error': str(e)}), 503
     except Exception as e:
-        print(f" Error in predict_scan: {e}")
+        print(f" Error in predict_scans: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def _run_prediction_job(kind, payload):
+    # runs on an inference worker thread, outside any request context
+    with db_pool.connection() as conn:
+        if kind == 'predict_scan':
+            result = classify_scan(conn, payload['scan_id'])
+            if result is None:
+                raise LookupError('scan not found')
+            return result
+        if kind == 'predict_scans':
+            return run_bulk_prediction(conn, scan_ids=payload.get('scan_ids'),
+                                       only_unlabeled=(payload.get('filter') == 'unlabeled'),
+                                       limit=payload.get('limit'))
+        raise ValueError(f"unknown job kind {kind!r}")
+
+
+prediction_jobs = JobQueue(_run_prediction_job, workers=INFERENCE_WORKERS, max_pending=PREDICT_QUEUE_SIZE)
+
+
+@app.route('/predict_jobs', methods=['POST'])
+def submit_prediction_job():
+    """Queue a prediction and return its job id immediately.
+
+    Body: {"scan_id": N} for an interactive prediction, or {"scan_ids": [...]} /
+    {"filter": "unlabeled" | "all"} for a backfill job. Answers 429 when the queue is full.
+    """
+    data = request.get_json() or {}
+    if data.get('scan_id'):
+        kind = 'predict_scan'
+        payload = {'scan_id': data['scan_id']}
+        priority = data.get('priority', 'interactive')
+    elif data.get('scan_ids') or data.get('filter') in ('unlabeled', 'all'):
+        if not session.get('logged_in') or session.get('user_type') not in ('admin', 'radiologist'):
+            return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+        kind = 'predict_scans'
+        payload = {'scan_ids': data.get('scan_ids'), 'filter': data.get('filter'), 'limit': data.get('limit')}
+        priority = data.get('priority', 'backfill')
+    else:
+        return jsonify({'success': False, 'error': 'scan_id, scan_ids or filter required'}), 400
+
+    return _queue_prediction_job(kind, payload, priority)
+
+
+def _queue_prediction_job(kind, payload, priority):
+    """Submit a job to prediction_jobs: 202 with its id and status URL, 429 when the queue is full."""
+    try:
+        job_id = prediction_jobs.submit(kind, payload, priority=priority)
+    except QueueFull as e:
+        resp = jsonify({'success': False, 'error': str(e)})
+        resp.headers['Retry-After'] = '5'
+        return resp, 429
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    return jsonify({'success': True, 'job_id': job_id, 'status': 'queued',
+                    'status_url': url_for('prediction_job_status', job_id=job_id)}), 202
+
+
+@app.route('/predict_jobs/<job_id>')
+def prediction_job_status(job_id):
+    """Status of a queued prediction job; includes the result once done"""
+    job = prediction_jobs.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'job not found'}), 404
+    return jsonify({'success': True, **job})
+
+@app.route('/model_status')
+def model_status():
+    """Readiness of the tumor model: idle, loading, warming, ready, failed or unavailable"""
+    status = model_loader.status()
+    status['load_mode'] = MODEL_LOAD_MODE
+    status['requested_backend'] = MODEL_BACKEND
+    status['tensorflow_available'] = TF_AVAILABLE
+    return jsonify(status), (200 if model_loader.ready else 503)
+
+@app.route('/predict_stats')
+def predict_stats():
+    """Batch size and latency statistics of the inference micro-batcher, plus cache and job queue counters"""
+    if not session.get('logged_in') or session.get('user_type') not in ('admin', 'radiologist'):
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+
+    return jsonify({
+        'success': True,
+        'stats': _batcher.stats() if _batcher is not None else None,
+        'cache': prediction_cache.stats(),
+        'jobs': prediction_jobs.stats(),
+        'tensor_cache': tensor_cache.stats() if tensor_cache is not None else None,
+        'near_duplicates': near_duplicates.stats() if near_duplicates is not None else None,
+    })
+
+@app.route('/dashboard_stats')
+def get_dashboard_stats():
+    """Scan counts by label, age group, hospital unit, gender and week from the scan_stats aggregates"""
+    if not session.get('logged_in') or session.get('user_type') not in ('admin', 'radiologist'):
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+
+    try:
+        return jsonify({'success': True, **dashboard_stats.read(get_db())})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/db_stats')
+def db_stats():
+    """Connection pool usage, checkout wait times and SQLite settings"""
+    if not session.get('logged_in') or session.get('user_type') not in ('admin', 'radiologist'):
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+
+    return jsonify({'success': True, 'pool': db_pool.stats()})
+
+
+@app.route('/auth_stats')
+def auth_stats():
+    """Password hashing executor load: queue waits, hash times, rejections and rehashes"""
+    if not session.get('logged_in') or session.get('user_type') != 'admin':
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+
+    stats = password_hasher.stats()
+    stats['pending_patient_credentials'] = get_db().execute(
+        'SELECT COUNT(*) FROM users WHERE iterations = 0').fetchone()[0]
+    stats['patient_credentials'] = PATIENT_CREDENTIALS
+    return jsonify({'success': True, **stats})
+
+
+@app.route('/backup_status')
+def backup_status():
+    """Database snapshots, retention policy and the scheduler's last run"""
+    if not session.get('logged_in') or session.get('user_type') != 'admin':
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+
+    return jsonify({'success': True, **backup_scheduler.status()})
+
+
+@app.route('/query_cache_stats')
+def query_cache_stats():
+    """Console query cache hit rate, invalidations and time saved, overall and per query"""
+    if not session.get('logged_in') or session.get('user_type') != 'admin':
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+
+    return jsonify({'success': True, 'cache': query_cache.stats()})
+
+
+@app.route('/slow_queries')
+def slow_queries():
+    """Recent console queries that were slow or hit their budget, with plans and index warnings"""
+    if not session.get('logged_in') or session.get('user_type') != 'admin':
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+
+    return jsonify({
+        'success': True,
+        **slow_query_log.stats(),
+        'budget': {'timeout_ms': QUERY_TIMEOUT_MS, 'max_vm_steps': QUERY_MAX_VM_STEPS, 'max_rows': QUERY_MAX_ROWS},
+        'queries': slow_query_log.recent(),
+    })
+
+# search both `static/training_images` and top-level `training_images`
+image_index = ImageIndex([
+    os.path.join(os.path.dirname(__file__), 'static', 'training_images'),
+    os.path.join(os.path.dirname(__file__), 'training_images')
+], check_interval=float(os.environ.get('IMAGE_INDEX_CHECK_SECONDS', 5)))
+
+
+def find_local_image(original_path, processed_path):
+    """Locate a scan's image file on this machine.
+
+    Stored paths are often Colab paths (`/content/...`), so fall back to
+    `training_images/<tumor>/<file>` matched by basename. Returns None if not found.
+    """
+    original_path = original_path or ''
+    processed_path = processed_path or ''
+
+    # Try to find the image in local directories
+    possible_paths = [
+        original_path,
+        processed_path,
+        original_path.replace('/content/', ''),
+        processed_path.replace('/content/', ''),
+        os.path.join('static', 'training_images', os.path.basename(original_path)),
+        os.path.join('static', 'training_images', os.path.basename(processed_path))
+    ]
+    for path in possible_paths:
+        if path and os.path.exists(path):
+            return path
+
+    # If images are organized under `training_images/<tumor>/<file>`, look the
+    # basename of the stored path up in the in-memory index.
+    try:
+        return image_index.lookup(original_path, processed_path)
+    except Exception:
+        return None
+
+
+@app.route('/image_index', methods=['GET', 'POST'])
+def image_index_status():
+    """Image location index statistics; POST rebuilds the index"""
+    if not session.get('logged_in') or session.get('user_type') not in ('admin', 'radiologist'):
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 401
+
+    if request.method == 'POST':
+        image_index.refresh()
+    return jsonify({'success': True, **image_index.stats(), 'derivatives': derivative_cache.stats()})
+
 @app.route('/image/<int:scan_id>')
 def get_image(scan_id):
-    """Serve MRI scan image or generate placeholder if not available"""
+    """Serve MRI scan image (?size=thumb|preview|full) or a placeholder if not available"""
     try:
         db = get_db()
         cursor = db.execute("""
             SELECT original_path, processed_path, label 
-            FROM mri_scans 
-            WHERE rowid = ?
+            FROM scans 
+            WHERE scan_id = ?
         """, (scan_id,))
         row = cursor.fetchone()
         
@@ -378,82 +1355,27 @@ def get_image(scan_id):
         processed_path = row[1]
         label = row[2]
         
-        # Try to find the image in local directories
-        possible_paths = [
-            original_path,
-            processed_path,
-            original_path.replace('/content/', ''),
-            processed_path.replace('/content/', ''),
-            os.path.join('static', 'training_images', os.path.basename(original_path)),
-            os.path.join('static', 'training_images', os.path.basename(processed_path))
-        ]
-        
-        image_found = False
-        for path in possible_paths:
-            if path and os.path.exists(path):
-                mtype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
-                return send_file(path, mimetype=mtype)
-
-        # If images are organized under `static/training_images/<tumor>/<file>`
-        # search recursively for a file matching the basename of the stored path.
-        try:
-            # search both `static/training_images` and top-level `training_images`
-            candidates = [
-                os.path.join(os.path.dirname(__file__), 'static', 'training_images'),
-                os.path.join(os.path.dirname(__file__), 'training_images')
-            ]
-            base_dir = None
-            for c in candidates:
-                if os.path.isdir(c):
-                    base_dir = c
-                    break
-
-            target_names = set()
-            if original_path:
-                target_names.add(os.path.basename(original_path).lower())
-            if processed_path:
-                target_names.add(os.path.basename(processed_path).lower())
-
-            if base_dir and os.path.isdir(base_dir):
-                for dp, dn, files in os.walk(base_dir):
-                    for fname in files:
-                        if fname.lower() in target_names:
-                            found_path = os.path.join(dp, fname)
-                            mtype = mimetypes.guess_type(found_path)[0] or 'application/octet-stream'
-                            return send_file(found_path, mimetype=mtype)
-        except Exception:
-            pass
-        
-        # If no image found, generate a placeholder
-        img = Image.new('RGB', (224, 224), color=(240, 240, 245))
-        draw = ImageDraw.Draw(img)
-        
-        # Draw text on placeholder
-        text_lines = [
-            "MRI Scan",
-            f"Type: {label.replace('_', ' ').title()}",
-            "Image not available",
-            "locally"
-        ]
+        variant = request.args.get('size', 'full')
+        if variant not in VARIANTS:
+            return jsonify({'error': f"size must be one of {', '.join(VARIANTS)}"}), 400
+
+        path = find_local_image(original_path, processed_path)
+        if path:
+            path = derivative_cache.variant_path(path, variant)
+            mtype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+            # strong ETag + Last-Modified from the file; If-None-Match answers 304
+            resp = send_file(path, mimetype=mtype, conditional=True, etag=True, max_age=IMAGE_MAX_AGE)
+            resp.cache_control.public = False
+            resp.cache_control.private = True
+            return resp
         
-        # Draw centered text
-        y_pos = 60
-        for line in text_lines:
-            # Simple text rendering (PIL default font)
-            bbox = draw.textbbox((0, 0), line)
-            text_width = bbox[2] - bbox[0]
-            x_pos = (224 - text_width) // 2
-            draw.text((x_pos, y_pos), line, fill=(100, 100, 120))
-            y_pos += 30
-        
-        # Draw border
-        draw.rectangle([(10, 10), (214, 214)], outline=(200, 200, 210), width=2)
-        
-        # Return the image
-        img_io = BytesIO()
-        img.save(img_io, 'PNG')
-        img_io.seek(0)
-        return send_file(img_io, mimetype='image/png')
+        # If no image found, serve the placeholder for this label (rendered once)
+        data, etag = derivative_cache.placeholder(label)
+        resp = Response(data, mimetype='image/png')
+        resp.set_etag(etag)
+        resp.cache_control.private = True
+        resp.cache_control.max_age = PLACEHOLDER_MAX_AGE
+        return resp.make_conditional(request)
         
     except Exception as e:
         # Return a simple error placeholder
@@ -482,8 +1404,8 @@ def login():
         if not row:
             return jsonify({'success': False, 'error': 'Invalid credentials'}), 401
 
-        stored_hash, stored_salt, iterations, role, patient_id = row
-        if _verify_password(stored_hash, stored_salt, iterations, password):
+        role, patient_id = row[3], row[4]
+        if _check_credentials(username, row, password):
             session.clear()
             session['logged_in'] = True
             session['username'] = username
@@ -502,6 +1424,8 @@ def login():
             return jsonify({'success': True, 'redirect': '/'})
 
         return jsonify({'success': False, 'error': 'Invalid credentials'}), 401
+    except (HasherBusy, FuturesTimeout):
+        return jsonify({'success': False, 'error': 'Too many sign-ins at once, please retry'}), 503
     except Exception:
         return jsonify({'success': False, 'error': 'Authentication error'}), 500
 
@@ -520,8 +1444,8 @@ def patient_login():
             row = cur.fetchone()
             if not row:
                 return jsonify({'success': False, 'error': 'Invalid credentials'}), 401
-            stored_hash, stored_salt, iterations, role, patient_id = row
-            if _verify_password(stored_hash, stored_salt, iterations, password):
+            role, patient_id = row[3], row[4]
+            if _check_credentials(str(username), row, password):
                 session.clear()
                 session['logged_in'] = True
                 session['username'] = str(username)
@@ -530,6 +1454,8 @@ def patient_login():
                     session['patient_id'] = patient_id
                 return jsonify({'success': True, 'redirect': '/patient_portal'})
             return jsonify({'success': False, 'error': 'Invalid credentials'}), 401
+        except (HasherBusy, FuturesTimeout):
+            return jsonify({'success': False, 'error': 'Too many sign-ins at once, please retry'}), 503
         except Exception:
             return jsonify({'success': False, 'error': 'Database error'}), 500
 
@@ -539,7 +1465,7 @@ def patient_login():
         return jsonify({'success': False, 'error': 'Patient ID is required'}), 400
     try:
         db = get_db()
-        cursor = db.execute("SELECT DISTINCT patient_id FROM mri_scans WHERE patient_id = ?", (patient_id,))
+        cursor = db.execute("SELECT patient_id FROM scans WHERE patient_id = ? LIMIT 1", (patient_id,))
         patient = cursor.fetchone()
         if patient:
             session.clear()
@@ -570,36 +1496,102 @@ def patient_portal():
         return redirect(url_for('index'))
     return render_template('patient_portal.html', patient_id=session.get('patient_id'))
 
+# Result paging / streaming for patient_records, find_scans_by_patient and execute_query
+PAGE_SIZE_DEFAULT = int(os.environ.get('PAGE_SIZE_DEFAULT', 500))
+PAGE_SIZE_MAX = int(os.environ.get('PAGE_SIZE_MAX', 5000))
+STREAM_CHUNK_ROWS = int(os.environ.get('STREAM_CHUNK_ROWS', 500))
+STREAM_FORMATS = ('ndjson', 'columnar')
+
+
+def _stream_response(cursor, columns, fmt, transform=None, max_rows=None, on_close=None):
+    """Stream the remaining rows of `cursor` as NDJSON lines (rows or columnar chunks).
+
+    `on_close` runs once the stream has been sent (or the client went away).
+    """
+    # the body is generated after the request's teardown; keep its connection out of the
+    # pool until the last row has been read
+    conn = g.pop('db', None)
+
+    def generate():
+        try:
+            yield from stream_rows(cursor, columns, fmt, STREAM_CHUNK_ROWS, transform, max_rows)
+        finally:
+            if on_close is not None:
+                on_close()
+            if conn is not None:
+                db_pool.release(conn)
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+def _add_image_url(record):
+    record['image_url'] = f"/image/{record['rowid']}"
+
+
+def _patient_scans_cursor(db, patient_id, after):
+    """Scans of one patient, newest first, starting after the keyset `after` ({'d': scan_date, 'id': scan_id})."""
+    sql = "SELECT scan_id AS rowid, * FROM mri_scans WHERE patient_id = ?"
+    args = [patient_id]
+    if after is not None:
+        try:
+            last_date, last_id = after['d'], int(after['id'])
+        except (KeyError, TypeError, ValueError):
+            raise CursorError('invalid cursor')
+        if last_date is None:
+            # NULL scan dates sort last
+            sql += " AND scan_date IS NULL AND scan_id > ?"
+            args.append(last_id)
+        else:
+            sql += " AND (scan_date < ? OR scan_date IS NULL OR (scan_date = ? AND scan_id > ?))"
+            args += [last_date, last_date, last_id]
+    # scan_id ascending among equal dates follows idx_scans_patient_date, so no sort step
+    sql += " ORDER BY scan_date DESC, scan_id"
+    return db.execute(sql, args)
+
+
+def _patient_scans_page(db, patient_id, params):
+    """(columns, records, next_cursor) for one page, or a streaming Response when params ask for one."""
+    after = decode_cursor(params.get('cursor'))
+    cursor = _patient_scans_cursor(db, patient_id, after)
+    columns = [description[0] for description in cursor.description]
+    if params.get('stream') in STREAM_FORMATS:
+        return _stream_response(cursor, columns, params['stream'], _add_image_url)
+
+    rows, has_more = fetch_page(cursor, page_size(params.get('limit'), PAGE_SIZE_DEFAULT, PAGE_SIZE_MAX))
+    records = []
+    for row in rows:
+        record = dict(zip(columns, row))
+        _add_image_url(record)
+        records.append(record)
+    next_cursor = encode_cursor({'d': records[-1]['scan_date'], 'id': records[-1]['rowid']}) if has_more else None
+    return columns, records, next_cursor
+
+
 @app.route('/patient_records')
 def patient_records():
+    """The logged-in patient's scans, newest first.
+
+    Query args: limit (page size), cursor (next_cursor of the previous page),
+    stream=ndjson|columnar to stream every row instead of paging.
+    """
     if not session.get('logged_in') or session.get('user_type') != 'patient':
         return jsonify({'error': 'Unauthorized'}), 401
     
     patient_id = session.get('patient_id')
     
     try:
-        db = get_db()
-        cursor = db.execute("""
-            SELECT rowid, * FROM mri_scans 
-            WHERE patient_id = ? 
-            ORDER BY scan_date DESC
-        """, (patient_id,))
-        
-        columns = [description[0] for description in cursor.description]
-        rows = cursor.fetchall()
-        
-        results = []
-        for row in rows:
-            record = dict(zip(columns, row))
-            # Add image URL
-            record['image_url'] = f"/image/{record['rowid']}"
-            results.append(record)
+        page = _patient_scans_page(get_db(), patient_id, request.args)
+        if isinstance(page, Response):
+            return page
+        _, results, next_cursor = page
         
         return jsonify({
             'success': True,
             'patient_id': patient_id,
             'records': results,
-            'count': len(results)
+            'count': len(results),
+            'next_cursor': next_cursor,
+            'has_more': next_cursor is not None
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 400
@@ -609,6 +1601,9 @@ def patient_records():
 def find_scans_by_patient():
     """Search MRI scans by patient_id (parameterized) and return results.
     Accessible to logged-in admins and radiologists.
+
+    Body: {"patient_id", "limit", "cursor", "stream": "ndjson" | "columnar"}; pages are
+    keyset-paginated on (scan_date, scan_id).
     """
     if not session.get('logged_in') or session.get('user_type') not in ('admin', 'radiologist'):
         return jsonify({'success': False, 'error': 'Unauthorized'}), 401
@@ -619,27 +1614,31 @@ def find_scans_by_patient():
         return jsonify({'success': False, 'error': 'patient_id is required'}), 400
 
     try:
-        db = get_db()
-        cursor = db.execute("SELECT rowid, * FROM mri_scans WHERE patient_id = ? ORDER BY scan_date DESC", (patient_id,))
-        columns = [description[0] for description in cursor.description]
-        rows = cursor.fetchall()
-
-        results = []
-        for row in rows:
-            record = dict(zip(columns, row))
-            record['image_url'] = f"/image/{record.get('rowid')}"
-            results.append(record)
+        page = _patient_scans_page(get_db(), patient_id, data)
+        if isinstance(page, Response):
+            return page
+        columns, results, next_cursor = page
 
         return jsonify({
             'success': True,
             'columns': columns,
             'data': results,
-            'count': len(results)
+            'count': len(results),
+            'next_cursor': next_cursor,
+            'has_more': next_cursor is not None
         })
+    except (CursorError, ValueError) as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+def _in_upload_folder(path):
+    """True if `path` lies inside the upload folder."""
+    root = os.path.realpath(app.config['UPLOAD_FOLDER'])
+    return os.path.commonpath([os.path.realpath(path), root]) == root
+
+
 @app.route('/delete_scans_by_patient', methods=['POST'])
 def delete_scans_by_patient():
     """Delete all MRI scans (and related classification rows/files) for a given patient_id.
@@ -658,31 +1657,33 @@ def delete_scans_by_patient():
         cur = db.cursor()
 
         # Find affected scans
-        cur.execute('SELECT rowid, original_path, processed_path FROM mri_scans WHERE patient_id = ?', (patient_id,))
+        cur.execute('SELECT scan_id, original_path, processed_path FROM scans WHERE patient_id = ?', (patient_id,))
         rows = cur.fetchall()
         if not rows:
             return jsonify({'success': True, 'deleted_count': 0, 'deleted_scan_ids': []})
 
         scan_ids = [r[0] for r in rows]
-        processed_paths = [r[2] for r in rows if r[2]]
-        original_paths = [r[1] for r in rows if r[1]]
+        # load-scans can point rows at shared training images; only uploads are the patient's own files
+        uploaded = {p for r in rows for p in (r[1], r[2]) if p and _in_upload_folder(p)}
 
-        # Delete related tumor_classification rows that reference these processed paths
-        if processed_paths:
-            placeholders = ','.join('?' for _ in processed_paths)
-            cur.execute(f"DELETE FROM tumor_classification WHERE processed_path IN ({placeholders})", tuple(processed_paths))
-
-        # Delete scans
-        cur.execute('DELETE FROM mri_scans WHERE patient_id = ?', (patient_id,))
+        # Delete scans; their tumor_classification rows go with them (ON DELETE CASCADE)
+        cur.execute('DELETE FROM scans WHERE patient_id = ?', (patient_id,))
         deleted_count = cur.rowcount
 
         db.commit()
 
-        # Attempt to remove files from disk (best-effort)
+        if tensor_cache is not None:
+            tensor_cache.evict(scan_ids)
+        if near_duplicates is not None:
+            near_duplicates.remove(scan_ids)
+
+        # Remove the files this app saved for the patient (best-effort); anything outside
+        # the upload folder, like the training images, is left alone
         removed_files = []
-        for p in processed_paths + original_paths:
+        for p in sorted(uploaded):
             try:
                 if p and os.path.exists(p):
+                    derivative_cache.discard(p)  # resized variants are keyed by the source's stat
                     os.remove(p)
                     removed_files.append(p)
             except Exception:
@@ -692,8 +1693,37 @@ def delete_scans_by_patient():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# Guardrails for ad-hoc console queries (0 disables a limit)
+QUERY_TIMEOUT_MS = int(os.environ.get('QUERY_TIMEOUT_MS', 5000))
+QUERY_MAX_VM_STEPS = int(os.environ.get('QUERY_MAX_VM_STEPS', 500000000))
+QUERY_MAX_ROWS = int(os.environ.get('QUERY_MAX_ROWS', 100000))
+slow_query_log = SlowQueryLog(threshold_ms=float(os.environ.get('QUERY_SLOW_MS', 500)))
+
+
+def _log_if_slow(db, budget, query, params, rows=None):
+    if budget.exceeded:
+        slow_query_log.record(db, query, params, budget.elapsed_ms, budget.steps, rows,
+                              outcome=f'aborted: {budget.exceeded[0]} budget')
+    elif slow_query_log.is_slow(budget.elapsed_ms):
+        slow_query_log.record(db, query, params, budget.elapsed_ms, budget.steps, rows)
+
+
 @app.route('/execute_query', methods=['POST'])
 def execute_query():
+    """Run an admin SELECT.
+
+    Body: {"query", "params", "limit", "cursor", "stream": "ndjson" | "columnar",
+    "cache": true}. Arbitrary SQL has no key to seek on, so the cursor records the row
+    offset (and which query it belongs to) and later pages skip rows on the sqlite
+    cursor; use stream for full result sets. Pages are served from query_cache until
+    the database changes; the response's `cache` field says whether it was a hit.
+
+    Each run is limited to QUERY_TIMEOUT_MS of execution time, QUERY_MAX_VM_STEPS
+    SQLite instructions and QUERY_MAX_ROWS rows in total (`truncated` is set when
+    the cap cut the result short). "explain": true returns the query plan and its
+    warnings without running the query. Slow and aborted queries are logged with
+    their plans (GET /slow_queries).
+    """
     if not session.get('logged_in') or session.get('user_type') != 'admin':
         return jsonify({'error': 'Unauthorized'}), 401
     
@@ -707,26 +1737,124 @@ def execute_query():
     if not query.upper().startswith('SELECT'):
         return jsonify({'error': 'Only SELECT queries are allowed'}), 400
     
+    params = data.get('params') or []
+    if not isinstance(params, list):
+        return jsonify({'error': 'params must be a list'}), 400
+    
     try:
+        normalized = normalize_sql(query)
+        query_key = hashlib.sha256(json.dumps([normalized, params]).encode('utf-8')).hexdigest()[:16]
+        state = decode_cursor(data.get('cursor'))
+        offset = 0
+        if state is not None:
+            if state.get('q') != query_key or not isinstance(state.get('o'), int) or state['o'] < 0:
+                raise CursorError('cursor does not belong to this query')
+            offset = state['o']
+        limit = page_size(data.get('limit'), PAGE_SIZE_DEFAULT, PAGE_SIZE_MAX)
+
+        if data.get('explain'):
+            plan = query_plans.explain(get_db(), query, params)
+            return jsonify({'success': True, 'plan': plan, 'warnings': query_plans.plan_warnings(plan)})
+
+        if QUERY_MAX_ROWS:
+            if offset >= QUERY_MAX_ROWS:
+                raise CursorError(f'row limit of {QUERY_MAX_ROWS} reached')
+            limit = min(limit, QUERY_MAX_ROWS - offset)
+
+        stream = data.get('stream') in STREAM_FORMATS
+        use_cache = not stream and data.get('cache', True) is not False
+        cache_key = (normalized, json.dumps(params), offset, limit)
+        if use_cache:
+            # read before executing: a commit in between only makes the stored page newer than its tag
+            version = query_cache.data_version()
+            cached = query_cache.get(cache_key, version)
+            if cached is not None:
+                page, cache_info = cached
+                return jsonify({'success': True, **page, 'cache': cache_info})
+
         db = get_db()
-        cursor = db.execute(query)
-        columns = [description[0] for description in cursor.description]
-        rows = cursor.fetchall()
+        budget = QueryBudget(db, QUERY_TIMEOUT_MS, QUERY_MAX_VM_STEPS).start()
+        streaming = False
+        try:
+            cursor = db.execute(query, params)
+            columns = [description[0] for description in cursor.description]
+            skip_rows(cursor, offset)
+            if stream:
+                # the budget stays on the connection until the last row has been sent
+                budget.pause()
+                streaming = True
+
+                def finish_stream():
+                    budget.stop()
+                    _log_if_slow(db, budget, query, params)
+
+                remaining = QUERY_MAX_ROWS - offset if QUERY_MAX_ROWS else None
+                return _stream_response(budget.cursor(cursor), columns, data['stream'],
+                                        max_rows=remaining, on_close=finish_stream)
+
+            rows, has_more = fetch_page(cursor, limit)
+        except sqlite3.OperationalError as e:
+            if budget.exceeded:
+                budget.stop()
+                _log_if_slow(db, budget, query, params)
+                error = budget.error()
+                return jsonify({'error': str(error), 'budget_exceeded': error.kind,
+                                'elapsed_ms': round(error.elapsed_ms, 3), 'vm_steps': error.steps}), 400
+            raise
+        finally:
+            if not streaming:
+                budget.stop()
+        _log_if_slow(db, budget, query, params, len(rows))
+        truncated = bool(has_more and QUERY_MAX_ROWS and offset + len(rows) >= QUERY_MAX_ROWS)
+        has_more = has_more and not truncated
         
         # Convert rows to list of dictionaries
         results = []
         for row in rows:
             results.append(dict(zip(columns, row)))
-        
-        return jsonify({
-            'success': True,
+        next_cursor = encode_cursor({'q': query_key, 'o': offset + len(rows)}) if has_more else None
+        page = {
             'columns': columns,
             'data': results,
-            'count': len(results)
-        })
+            'count': len(results),
+            'next_cursor': next_cursor,
+            'has_more': has_more,
+            'truncated': truncated
+        }
+        exec_ms = budget.elapsed_ms
+        if use_cache:
+            query_cache.put(cache_key, version, page, len(results), exec_ms)
+        
+        return jsonify({'success': True, **page, 'cache': {'hit': False, 'exec_ms': round(exec_ms, 3)}})
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
+def start_services():
+    """Load the model, migrate the database and start the backup scheduler.
+
+    Runs once in the serving (or CLI) process. Bulk ingest, bulk predict and the
+    perceptual-hash backfill use spawn workers, which re-import this module as
+    `__mp_main__` under `python app.py`; they must not repeat any of it.
+    """
+    if TF_AVAILABLE:
+        if MODEL_LOAD_MODE == 'eager':
+            model_loader.load()
+        elif MODEL_LOAD_MODE == 'background':
+            model_loader.start()
+
+    if os.path.exists(app.config["DATABASE"]):
+        backup_scheduler.start()
+
+    if not (hasattr(app, 'before_first_request') or hasattr(app, 'before_serving')):
+        ensure_users_table_and_defaults()  # safe and idempotent
+
+    # Create upload folder if it doesn't exist
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+
+
+if multiprocessing.parent_process() is None:
+    start_services()
+
 if __name__ == '__main__':
     app.run(debug=True)
 
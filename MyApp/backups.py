@@ -0,0 +1,390 @@
+"""Online snapshots of brain_etl.db with retention and restore.
+
+Snapshots are taken with SQLite's online backup API, copying `pages_per_step`
+pages at a time and sleeping between steps, so the server keeps reading and
+writing while a backup runs and every snapshot is a consistent view of one
+committed state (a plain file copy can catch a half-written page or miss the
+WAL). Each snapshot is integrity-checked before it is kept, optionally
+gzip-compressed, and described by a `.json` sidecar (size, SHA-256, source
+pages, integrity result).
+
+`prune` keeps the newest snapshot of each of the last `keep_daily` days and
+`keep_weekly` ISO weeks that have one. `restore` copies a verified snapshot
+back into the live database through the same backup API, after taking a
+safety snapshot of the current state. It refuses to run while the app is
+serving the database: the server's caches (predictions, tensors, near
+duplicates, console results) would keep describing the replaced data.
+
+BackupScheduler runs `backup` + `prune` on a daemon thread. A lock file in
+the backup directory keeps several server processes from backing up at the
+same time, and a run is skipped while the newest snapshot is younger than the
+interval, so restarts do not pile up snapshots.
+"""
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+try:
+    import fcntl
+except ImportError:  # Windows: restore cannot tell whether the app is serving
+    fcntl = None
+
+SNAPSHOT_TIME_FORMAT = '%Y%m%dT%H%M%SZ'
+
+
+class BackupError(RuntimeError):
+    """A snapshot could not be taken, failed its integrity check or cannot be restored."""
+
+
+def _sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def integrity_check(db_path):
+    """PRAGMA integrity_check of a database file; returns [] when it is sound."""
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    try:
+        rows = [row[0] for row in conn.execute('PRAGMA integrity_check')]
+    finally:
+        conn.close()
+    return [] if rows == ['ok'] else rows
+
+
+def _snapshot_prefix(db_path):
+    return os.path.splitext(os.path.basename(db_path))[0] + '-'
+
+
+def list_snapshots(backup_dir, db_path):
+    """Snapshots of `db_path` in `backup_dir`, newest first: [{'path', 'taken_on', 'compressed', ...}]."""
+    if not os.path.isdir(backup_dir):
+        return []
+    prefix = _snapshot_prefix(db_path)
+    snapshots = []
+    for name in os.listdir(backup_dir):
+        if not name.startswith(prefix) or not (name.endswith('.db') or name.endswith('.db.gz')):
+            continue
+        stamp = name[len(prefix):].split('.', 1)[0]
+        try:
+            taken_on = datetime.strptime(stamp, SNAPSHOT_TIME_FORMAT)
+        except ValueError:
+            continue
+        path = os.path.join(backup_dir, name)
+        info = {'path': path, 'name': name, 'taken_on': taken_on, 'compressed': name.endswith('.gz'),
+                'size_bytes': os.path.getsize(path)}
+        meta_path = path + '.json'
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                info['meta'] = json.load(f)
+        snapshots.append(info)
+    snapshots.sort(key=lambda s: s['taken_on'], reverse=True)
+    return snapshots
+
+
+def backup(db_path, backup_dir, compress=True, pages_per_step=1024, step_sleep=0.01, now=None):
+    """Take a verified snapshot of `db_path` into `backup_dir`; returns its metadata dict.
+
+    Raises BackupError (and keeps nothing) if the snapshot fails its integrity check.
+    """
+    os.makedirs(backup_dir, exist_ok=True)
+    now = (now or datetime.utcnow()).replace(microsecond=0)
+    while True:
+        name = f'{_snapshot_prefix(db_path)}{now.strftime(SNAPSHOT_TIME_FORMAT)}.db'
+        final_path = os.path.join(backup_dir, name + ('.gz' if compress else ''))
+        if not os.path.exists(final_path) and not os.path.exists(os.path.join(backup_dir, name)):
+            break
+        now += timedelta(seconds=1)  # two snapshots within the same second
+    tmp_path = os.path.join(backup_dir, f'.{name}.tmp')
+
+    started = time.perf_counter()
+    steps = 0
+
+    def progress(status, remaining, total):
+        nonlocal steps
+        steps += 1
+
+    src = sqlite3.connect(db_path)
+    dest = sqlite3.connect(tmp_path)
+    try:
+        src.backup(dest, pages=pages_per_step, progress=progress, sleep=step_sleep)
+        page_count = dest.execute('PRAGMA page_count').fetchone()[0]
+        # a standalone file: no -wal next to the snapshot
+        dest.execute('PRAGMA journal_mode = DELETE')
+    finally:
+        dest.close()
+        src.close()
+    copy_ms = (time.perf_counter() - started) * 1000.0
+
+    try:
+        problems = integrity_check(tmp_path)
+        if problems:
+            raise BackupError(f'snapshot of {db_path} failed integrity_check: {problems[:5]}')
+        raw_size = os.path.getsize(tmp_path)
+        raw_sha256 = _sha256(tmp_path)
+        if compress:
+            with open(tmp_path, 'rb') as f_in, gzip.open(final_path + '.tmp', 'wb', compresslevel=6) as f_out:
+                shutil.copyfileobj(f_in, f_out, 1 << 20)
+            os.replace(final_path + '.tmp', final_path)
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, final_path)
+    except BaseException:
+        for path in (tmp_path, final_path + '.tmp'):
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+
+    meta = {
+        'source': os.path.abspath(db_path),
+        'taken_on': now.isoformat(),
+        'pages': page_count,
+        'steps': steps,
+        'copy_ms': round(copy_ms, 1),
+        'total_ms': round((time.perf_counter() - started) * 1000.0, 1),
+        'db_size_bytes': raw_size,
+        'db_sha256': raw_sha256,
+        'file_size_bytes': os.path.getsize(final_path),
+        'compressed': compress,
+        'integrity_check': 'ok',
+    }
+    with open(final_path + '.json', 'w') as f:
+        json.dump(meta, f, indent=2)
+    meta['path'] = final_path
+    return meta
+
+
+def select_retained(snapshots, keep_daily=7, keep_weekly=4):
+    """Paths to keep: the newest snapshot of each of the last `keep_daily` days and
+    `keep_weekly` ISO weeks that have one (the newest snapshot is always kept)."""
+    keep = set()
+    if snapshots:
+        keep.add(snapshots[0]['path'])
+    for period, count in ((lambda d: d.date(), keep_daily), (lambda d: d.isocalendar()[:2], keep_weekly)):
+        seen = []
+        for snap in snapshots:  # newest first
+            key = period(snap['taken_on'])
+            if key in seen:
+                continue
+            if len(seen) >= count:
+                break
+            seen.append(key)
+            keep.add(snap['path'])
+    return keep
+
+
+def prune(backup_dir, db_path, keep_daily=7, keep_weekly=4):
+    """Delete snapshots outside the retention policy; returns the deleted paths."""
+    snapshots = list_snapshots(backup_dir, db_path)
+    keep = select_retained(snapshots, keep_daily, keep_weekly)
+    deleted = []
+    for snap in snapshots:
+        if snap['path'] in keep:
+            continue
+        os.remove(snap['path'])
+        if os.path.exists(snap['path'] + '.json'):
+            os.remove(snap['path'] + '.json')
+        deleted.append(snap['path'])
+    return deleted
+
+
+def _open_snapshot(snapshot_path, work_dir):
+    """Path of an uncompressed copy of the snapshot, verified against its sidecar."""
+    path = snapshot_path
+    if snapshot_path.endswith('.gz'):
+        path = os.path.join(work_dir, '.restore-' + os.path.basename(snapshot_path)[:-3])
+        with gzip.open(snapshot_path, 'rb') as f_in, open(path, 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out, 1 << 20)
+    meta_path = snapshot_path + '.json'
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            expected = json.load(f).get('db_sha256')
+        if expected and _sha256(path) != expected:
+            raise BackupError(f'{snapshot_path} does not match the checksum recorded when it was taken')
+    problems = integrity_check(path)
+    if problems:
+        raise BackupError(f'{snapshot_path} failed integrity_check: {problems[:5]}')
+    return path
+
+
+def serving_lock_path(db_path):
+    return db_path + '.serving'
+
+
+def hold_serving_lock(db_path):
+    """Mark this process as serving `db_path` until it exits; returns the open lock file (None without fcntl).
+
+    Every serving process holds the lock shared and restore() takes it
+    exclusively, so this waits while a restore runs.
+    """
+    if fcntl is None:
+        return None
+    f = open(serving_lock_path(db_path), 'a')
+    fcntl.flock(f, fcntl.LOCK_SH)
+    return f
+
+
+@contextmanager
+def _servers_locked_out(db_path):
+    if fcntl is None:
+        yield
+        return
+    with open(serving_lock_path(db_path), 'a') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise BackupError('the app is serving this database; stop it before restoring '
+                              '(its caches would keep answering from the replaced data)')
+        yield
+
+
+def restore(snapshot_path, db_path, backup_dir, pages_per_step=1024):
+    """Replace the contents of `db_path` with a snapshot.
+
+    The snapshot is checked first and the current database is snapshotted to
+    `backup_dir` (uncompressed) so the restore can be undone. The copy goes
+    through the backup API into the live file, so other connections see either
+    the old or the restored database, never a mix. Raises BackupError while a
+    process holds the serving lock (hold_serving_lock), and keeps servers from
+    starting until it is done. Returns the safety snapshot's metadata.
+    """
+    if not os.path.exists(snapshot_path):
+        raise BackupError(f'no such snapshot: {snapshot_path}')
+    os.makedirs(backup_dir, exist_ok=True)
+    with _servers_locked_out(db_path):
+        source_path = _open_snapshot(snapshot_path, backup_dir)
+        try:
+            safety = backup(db_path, backup_dir, compress=False, pages_per_step=pages_per_step, step_sleep=0)
+            src = sqlite3.connect(f'file:{source_path}?mode=ro', uri=True)
+            dest = sqlite3.connect(db_path, timeout=30)
+            try:
+                src.backup(dest, pages=0)
+            finally:
+                dest.close()
+                src.close()
+        finally:
+            if source_path != snapshot_path:
+                os.remove(source_path)
+    return safety
+
+
+class BackupScheduler:
+    """Snapshots the database every `interval_hours` on a daemon thread."""
+
+    def __init__(self, db_path, backup_dir, interval_hours=24, keep_daily=7, keep_weekly=4, compress=True,
+                 pages_per_step=1024, step_sleep=0.01, initial_delay=60):
+        self.db_path = db_path
+        self.backup_dir = backup_dir
+        self.interval = timedelta(hours=interval_hours)
+        self.keep_daily = keep_daily
+        self.keep_weekly = keep_weekly
+        self.compress = compress
+        self.pages_per_step = pages_per_step
+        self.step_sleep = step_sleep
+        self.initial_delay = initial_delay
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.last_result = None
+        self.last_error = None
+        self.runs = 0
+        self.failures = 0
+
+    @property
+    def lock_path(self):
+        return os.path.join(self.backup_dir, '.backup.lock')
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None or self.interval <= timedelta(0):
+                return
+            self._thread = threading.Thread(target=self._run, name='db-backup', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _due(self):
+        snapshots = list_snapshots(self.backup_dir, self.db_path)
+        return not snapshots or datetime.utcnow() - snapshots[0]['taken_on'] >= self.interval
+
+    def _acquire_file_lock(self):
+        os.makedirs(self.backup_dir, exist_ok=True)
+        try:
+            # a lock left behind by a crashed process is ignored after an hour
+            if time.time() - os.path.getmtime(self.lock_path) > 3600:
+                os.remove(self.lock_path)
+        except OSError:
+            pass
+        try:
+            fd = os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        os.write(fd, str(os.getpid()).encode('ascii'))
+        os.close(fd)
+        return True
+
+    def run_once(self, force=False):
+        """Back up and prune now (unless not due and not forced); returns the snapshot metadata or None."""
+        if not force and not self._due():
+            return None
+        if not self._acquire_file_lock():
+            return None  # another process is taking the snapshot
+        try:
+            if not force and not self._due():
+                return None
+            result = backup(self.db_path, self.backup_dir, self.compress, self.pages_per_step, self.step_sleep)
+            result['pruned'] = prune(self.backup_dir, self.db_path, self.keep_daily, self.keep_weekly)
+            self.last_result = result
+            self.last_error = None
+            self.runs += 1
+            print(f"✓ Database snapshot {os.path.basename(result['path'])} "
+                  f"({result['file_size_bytes'] / 1e6:.1f} MB, {result['total_ms']:.0f} ms, "
+                  f"{len(result['pruned'])} pruned)")
+            return result
+        finally:
+            os.remove(self.lock_path)
+
+    def _run(self):
+        if self._stop.wait(self.initial_delay):
+            return
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                self.failures += 1
+                self.last_error = str(e)
+                print(f"⚠️  Database backup failed: {e}")
+            # wake up often enough to notice a snapshot that fell due after a restart
+            if self._stop.wait(min(self.interval.total_seconds(), 3600)):
+                return
+
+    def status(self):
+        snapshots = list_snapshots(self.backup_dir, self.db_path)
+        next_due = snapshots[0]['taken_on'] + self.interval if snapshots else None
+        return {
+            'backup_dir': self.backup_dir,
+            'running': self._thread is not None,
+            'interval_hours': self.interval.total_seconds() / 3600.0,
+            'retention': {'daily': self.keep_daily, 'weekly': self.keep_weekly},
+            'compress': self.compress,
+            'runs': self.runs,
+            'failures': self.failures,
+            'last_error': self.last_error,
+            'next_due': next_due.isoformat() if next_due else None,
+            'snapshots': [{
+                'name': s['name'],
+                'taken_on': s['taken_on'].isoformat(),
+                'size_bytes': s['size_bytes'],
+                'integrity_check': s.get('meta', {}).get('integrity_check'),
+            } for s in snapshots],
+        }
@@ -0,0 +1,143 @@
+"""Dynamic micro-batching for model inference.
+
+Callers submit one preprocessed image tensor at a time; a single worker thread
+collects pending requests until either `max_batch_size` items are queued or
+`max_wait_ms` has elapsed since the first one arrived, runs one `predict_fn`
+over the stacked batch and hands each caller its own row of the output.
+"""
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class MicroBatcher:
+    """Collects single-image predictions into batches for one predict call."""
+
+    def __init__(self, predict_fn, max_batch_size=16, max_wait_ms=10, stats_window=1000):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = False
+
+        # statistics
+        self._recent = deque(maxlen=stats_window)  # (batch_size, queue_wait_s, predict_s)
+        self._total_batches = 0
+        self._total_items = 0
+        self._total_errors = 0
+        self._size_histogram = {}
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopped = False
+                self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        self._queue.put(None)
+
+    def submit(self, tensor):
+        """Queue one image tensor (H, W, C); returns a Future resolving to its output row."""
+        self.start()
+        future = Future()
+        self._queue.put((tensor, future, time.perf_counter()))
+        return future
+
+    def predict(self, tensor, timeout=None):
+        return self.submit(tensor).result(timeout=timeout)
+
+    def _collect(self):
+        first = self._queue.get()
+        if first is None:
+            return []
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                self._stopped = True
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while not self._stopped:
+            batch = self._collect()
+            if not batch:
+                continue
+
+            started = time.perf_counter()
+            queue_wait = started - min(enqueued for _, _, enqueued in batch)
+            try:
+                stacked = np.stack([tensor for tensor, _, _ in batch])
+                outputs = self.predict_fn(stacked)
+                for i, (_, future, _) in enumerate(batch):
+                    future.set_result(outputs[i])
+                failed = False
+            except Exception as e:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                failed = True
+            elapsed = time.perf_counter() - started
+            self._record(len(batch), queue_wait, elapsed, failed)
+
+    def _record(self, size, queue_wait, predict_time, failed):
+        with self._lock:
+            self._recent.append((size, queue_wait, predict_time))
+            self._total_batches += 1
+            self._total_items += size
+            if failed:
+                self._total_errors += 1
+            self._size_histogram[size] = self._size_histogram.get(size, 0) + 1
+
+    def stats(self):
+        """Per-batch size and latency statistics over the recent window."""
+        with self._lock:
+            recent = list(self._recent)
+            result = {
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000.0,
+                'pending': self._queue.qsize(),
+                'total_batches': self._total_batches,
+                'total_items': self._total_items,
+                'failed_batches': self._total_errors,
+                'batch_size_histogram': {str(k): v for k, v in sorted(self._size_histogram.items())},
+            }
+
+        if recent:
+            sizes = np.array([r[0] for r in recent], dtype=float)
+            waits = np.array([r[1] for r in recent]) * 1000.0
+            latencies = np.array([r[2] for r in recent]) * 1000.0
+            result['window'] = {
+                'batches': len(recent),
+                'mean_batch_size': float(sizes.mean()),
+                'queue_wait_ms': _percentiles(waits),
+                'predict_ms': _percentiles(latencies),
+                'predict_ms_per_item': float(latencies.sum() / sizes.sum()),
+            }
+        return result
+
+
+def _percentiles(values):
+    return {
+        'mean': float(np.mean(values)),
+        'p50': float(np.percentile(values, 50)),
+        'p95': float(np.percentile(values, 95)),
+        'p99': float(np.percentile(values, 99)),
+        'max': float(np.max(values)),
+    }
@@ -0,0 +1,405 @@
+"""HTTP load and latency benchmark for the Flask app.
+
+Builds a seeded SQLite fixture in a temporary directory, starts the app on a
+local threaded server (with a stub model by default, or the real one with
+--model real), drives concurrent workloads against the hot routes and writes
+throughput and p50/p95/p99 latency per route as JSON. Runs with the same
+arguments are comparable across commits; --compare flags regressions.
+--fixture runs against an existing database instead, such as one written by
+synth_data.py; it is used in place, so write routes add rows to it.
+
+Usage (from MyApp/):
+    python benchmarks/http_bench.py --output bench.json
+    python benchmarks/http_bench.py --routes image patient_records --concurrency 16
+    python benchmarks/http_bench.py --compare bench_main.json --output bench_branch.json
+    python benchmarks/http_bench.py --fixture /tmp/synth.db --routes patient_records find_scans_by_patient
+"""
+import argparse
+import contextlib
+import http.client
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from PIL import Image
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(HERE)
+
+LABELS = ['glioma_tumor', 'meningioma_tumor', 'no_tumor', 'pituitary_tumor']
+UNITS = ['Neurology', 'Oncology', 'Radiology', 'Emergency']
+
+
+def build_fixture(workdir, scans, patients, images, seed):
+    """Create brain_etl.db with `scans` rows over `patients` ids and a pool of JPEGs."""
+    rng = random.Random(seed)
+    image_dir = os.path.join(workdir, 'fixture_images')
+    os.makedirs(image_dir)
+    image_paths = []
+    np_rng = np.random.default_rng(seed)
+    for i in range(images):
+        path = os.path.join(image_dir, f'scan_{i}.jpg')
+        Image.fromarray(np_rng.integers(0, 255, (512, 512, 3), dtype=np.uint8)).save(path, quality=90)
+        image_paths.append(path)
+
+    db_path = os.path.join(workdir, 'brain_etl.db')
+    conn = sqlite3.connect(db_path)
+    conn.execute('''CREATE TABLE "mri_scans" (
+        "original_path" TEXT, "processed_path" TEXT, "label" TEXT,
+        "orig_width" INTEGER, "orig_height" INTEGER, "proc_width" INTEGER, "proc_height" INTEGER,
+        "mean_pixel" REAL, "std_pixel" REAL, "ingest_timestamp" TEXT,
+        "patient_id" INTEGER, "age" INTEGER, "gender" TEXT, "hospital_unit" TEXT, "scan_date" TEXT)''')
+    conn.execute('''CREATE TABLE tumor_classification (
+        classification_id INTEGER PRIMARY KEY AUTOINCREMENT, processed_path TEXT, predicted_label TEXT,
+        confidence FLOAT, model_name TEXT, classified_on TEXT)''')
+
+    start = datetime(2024, 1, 1)
+    patient_ids = [1000 + i for i in range(patients)]
+    demographics = {pid: (rng.randint(18, 85), rng.choice(['M', 'F'])) for pid in patient_ids}
+    rows = []
+    for i in range(scans):
+        pid = rng.choice(patient_ids)
+        path = image_paths[i % len(image_paths)]
+        age, gender = demographics[pid]
+        scan_date = (start + timedelta(minutes=rng.randint(0, 60 * 24 * 365))).isoformat()
+        rows.append((path, path, rng.choice(LABELS), 512, 512, 512, 512, rng.uniform(20, 80), rng.uniform(30, 60),
+                     scan_date, pid, age, gender, rng.choice(UNITS), scan_date))
+    conn.executemany('INSERT INTO mri_scans VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+    conn.commit()
+    conn.close()
+    # only patients that actually have scans can use the legacy patient_id login
+    return db_path, sorted({row[10] for row in rows}), image_paths
+
+
+def open_fixture(db_path, workdir, patients, seed):
+    """Patient ids sampled from an existing database's scans, its scan id range and one upload JPEG."""
+    conn = sqlite3.connect(db_path)
+    try:
+        scans = conn.execute('SELECT MAX(scan_id) FROM scans').fetchone()[0] or 0
+        if not scans:
+            raise SystemExit(f'{db_path} has no scans')
+        rng = random.Random(seed)
+        sample = [rng.randint(1, scans) for _ in range(patients)]
+        patient_ids = set()
+        for i in range(0, len(sample), 500):
+            part = sample[i:i + 500]
+            rows = conn.execute(f"SELECT patient_id FROM scans WHERE scan_id IN ({','.join('?' for _ in part)}) "
+                                f"AND patient_id IS NOT NULL", part)
+            patient_ids.update(pid for pid, in rows)
+        has_users = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users'").fetchone()
+        pending = conn.execute('SELECT COUNT(*) FROM users WHERE iterations = 0').fetchone()[0] if has_users else 0
+        if pending:
+            print(f"⚠️  {pending} pending patient credentials: the app hashes them into {db_path} during the run "
+                  f"(regenerate with synth_data.py --password-iterations N)", file=sys.stderr)
+    finally:
+        conn.close()
+    path = os.path.join(workdir, 'upload.jpg')
+    Image.fromarray(np.random.default_rng(seed).integers(0, 255, (512, 512, 3), dtype=np.uint8)).save(path, quality=90)
+    return sorted(patient_ids), scans, path
+
+
+class StubModel:
+    """Stands in for the Xception model: fixed latency per batch plus per image."""
+
+    def __init__(self, batch_ms, item_ms, seed):
+        self.batch_ms = batch_ms
+        self.item_ms = item_ms
+        self.rng = np.random.default_rng(seed)
+        self.input_shape = (None, 299, 299, 3)
+        self.output_shape = (None, len(LABELS))
+
+    def predict(self, batch, verbose=0):
+        time.sleep((self.batch_ms + self.item_ms * len(batch)) / 1000.0)
+        scores = self.rng.random((len(batch), len(LABELS)))
+        return scores / scores.sum(axis=1, keepdims=True)
+
+
+def start_app(db_path, workdir, model, stub_args, seed):
+    os.environ['DATABASE_PATH'] = db_path
+    os.environ['MODEL_LOAD_MODE'] = 'lazy' if model == 'stub' else 'eager'
+    # no snapshots mid-run, and nothing written next to the app
+    os.environ['BACKUP_INTERVAL_HOURS'] = '0'
+    os.environ['BACKUP_DIR'] = os.path.join(workdir, 'backups')
+    os.environ['DERIVATIVE_CACHE_DIR'] = os.path.join(workdir, 'derivative_cache')
+    sys.path.insert(0, APP_DIR)
+    import app as myapp
+
+    if model == 'stub':
+        from model_loader import ModelLoader
+        stub = StubModel(*stub_args, seed=seed)
+        myapp.TF_AVAILABLE = True
+        myapp.model_loader = ModelLoader(lambda: stub)
+        myapp.model_loader.load()
+        myapp.prediction_cache.set_model_version(f'{myapp.MODEL_NAME}:stub')
+
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server('127.0.0.1', 0, myapp.app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, myapp
+
+
+class Client:
+    """One keep-alive connection with its own session cookie."""
+
+    def __init__(self, port):
+        self.port = port
+        self.conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        self.cookie = None
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        try:
+            self.conn.request(method, path, body=body, headers=headers)
+            resp = self.conn.getresponse()
+        except (http.client.HTTPException, OSError):
+            self.conn.close()
+            self.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+            raise
+        data = resp.read()
+        cookie = resp.getheader('Set-Cookie')
+        if cookie:
+            self.cookie = cookie.split(';', 1)[0]
+        return resp.status, data
+
+    def login(self, role, patient_id=None):
+        if role == 'patient':
+            status, _ = self.request('POST', '/patient_login', {'patient_id': patient_id})
+        else:
+            status, _ = self.request('POST', '/login', {'username': 'admin' if role == 'admin' else 'rad1',
+                                                        'password': 'password123'})
+        if status != 200:
+            raise RuntimeError(f'{role} login failed with HTTP {status}')
+
+
+def multipart(fields, file_field, filename, data):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{file_field}"; filename="{filename}"\r\n'
+                 f'Content-Type: image/jpeg\r\n\r\n'.encode() + data + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), {'Content-Type': f'multipart/form-data; boundary={boundary}'}
+
+
+def route_specs(ctx):
+    """route name -> (login role, request factory(rng) -> (method, path, body, headers))"""
+    patient_ids, scan_count = ctx['patient_ids'], ctx['scans']
+    upload = ctx['upload_bytes']
+
+    def submit(rng):
+        body, headers = multipart({'age': rng.randint(18, 85), 'gender': rng.choice('MF'),
+                                   'hospital_unit': rng.choice(UNITS)}, 'mri_file', 'bench.jpg', upload)
+        return 'POST', '/submit_patient_scan', body, headers
+
+    return {
+        'login': (None, lambda rng: ('POST', '/login', {'username': f'rad{rng.randint(1, 5)}', 'password': 'password123'}, None)),
+        'patient_records': ('patient', lambda rng: ('GET', '/patient_records', None, None)),
+        'find_scans_by_patient': ('radiologist', lambda rng: ('POST', '/find_scans_by_patient',
+                                                              {'patient_id': rng.choice(patient_ids)}, None)),
+        'execute_query': ('admin', lambda rng: ('POST', '/execute_query', {'query': rng.choice(ctx['queries'])}, None)),
+        'image': (None, lambda rng: ('GET', f'/image/{rng.randint(1, scan_count)}', None, None)),
+        'image_thumb': (None, lambda rng: ('GET', f'/image/{rng.randint(1, scan_count)}?size=thumb', None, None)),
+        'submit_patient_scan': (None, submit),
+        'predict_scan': (None, lambda rng: ('POST', '/predict_scan', {'scan_id': rng.randint(1, scan_count)}, None)),
+    }
+
+
+ADMIN_QUERIES = [
+    'SELECT label, COUNT(*) AS total_cases FROM mri_scans GROUP BY label ORDER BY total_cases DESC',
+    "SELECT CASE WHEN age < 30 THEN 'Under 30' WHEN age BETWEEN 30 AND 50 THEN '30-50' WHEN age > 50 THEN 'Over 50' END AS age_group, COUNT(*) AS count FROM mri_scans GROUP BY age_group",
+    'SELECT hospital_unit, COUNT(*) AS count FROM mri_scans GROUP BY hospital_unit ORDER BY count DESC',
+    'SELECT gender, COUNT(*) AS count FROM mri_scans GROUP BY gender',
+    "SELECT STRFTIME('%Y-%W', scan_date) AS week, COUNT(*) AS scans FROM mri_scans GROUP BY week ORDER BY week",
+]
+
+
+def run_route(name, spec, port, concurrency, duration, max_requests, seed):
+    role, factory = spec
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+    issued = [0]
+
+    def worker(worker_id):
+        nonlocal errors
+        rng = random.Random(f'{seed}-{name}-{worker_id}')
+        client = Client(port)
+        if role:
+            client.login(role, rng.choice(CTX['patient_ids']))
+        local = []
+        local_errors = 0
+        while time.perf_counter() < deadline:
+            with lock:
+                if max_requests and issued[0] >= max_requests:
+                    break
+                issued[0] += 1
+            method, path, body, headers = factory(rng)
+            t0 = time.perf_counter()
+            try:
+                status, _ = client.request(method, path, body, headers)
+                if status >= 400:
+                    local_errors += 1
+            except Exception:
+                local_errors += 1
+            local.append(time.perf_counter() - t0)
+        with lock:
+            latencies.extend(local)
+            errors += local_errors
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    ms = np.array(latencies) * 1000.0
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'concurrency': concurrency,
+        'elapsed_seconds': elapsed,
+        'throughput_rps': len(latencies) / elapsed if elapsed > 0 else 0.0,
+        'latency_ms': {
+            'mean': float(ms.mean()) if len(ms) else None,
+            'p50': float(np.percentile(ms, 50)) if len(ms) else None,
+            'p95': float(np.percentile(ms, 95)) if len(ms) else None,
+            'p99': float(np.percentile(ms, 99)) if len(ms) else None,
+        },
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=APP_DIR, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path, threshold):
+    """Print routes whose p95 latency or throughput regressed by more than `threshold`."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    regressions = []
+    for name, cur in results['routes'].items():
+        base = baseline.get('routes', {}).get(name)
+        if not base or not base['latency_ms']['p95'] or not cur['latency_ms']['p95']:
+            continue
+        p95_ratio = cur['latency_ms']['p95'] / base['latency_ms']['p95']
+        rps_ratio = cur['throughput_rps'] / base['throughput_rps'] if base['throughput_rps'] else 1.0
+        status = 'ok'
+        if p95_ratio > 1 + threshold or rps_ratio < 1 - threshold:
+            status = 'REGRESSION'
+            regressions.append(name)
+        print(f"  {name:24s} p95 {base['latency_ms']['p95']:8.2f} -> {cur['latency_ms']['p95']:8.2f} ms "
+              f"({p95_ratio:5.2f}x), rps {base['throughput_rps']:8.1f} -> {cur['throughput_rps']:8.1f}  {status}")
+    return regressions
+
+
+CTX = {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--routes', nargs='+', default=None, help='routes to run (default: all)')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per route')
+    parser.add_argument('--max-requests', type=int, default=0, help='stop a route after this many requests')
+    parser.add_argument('--fixture', default=None, help='existing database to run against (used in place)')
+    parser.add_argument('--scans', type=int, default=5000, help='mri_scans rows in the fixture')
+    parser.add_argument('--patients', type=int, default=1500, help='patients in the fixture (sampled with --fixture)')
+    parser.add_argument('--images', type=int, default=50, help='distinct image files in the fixture')
+    parser.add_argument('--model', choices=['stub', 'real'], default='stub')
+    parser.add_argument('--stub-batch-ms', type=float, default=20.0)
+    parser.add_argument('--stub-item-ms', type=float, default=5.0)
+    parser.add_argument('--seed', type=int, default=5110)
+    parser.add_argument('--output', default=None, help='write JSON results here (default: stdout)')
+    parser.add_argument('--compare', default=None, help='baseline JSON to compare against')
+    parser.add_argument('--regression-threshold', type=float, default=0.15)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='brain_bench_')
+    cwd = os.getcwd()
+    try:
+        if args.fixture:
+            db_path = os.path.abspath(args.fixture)
+            patient_ids, args.scans, upload_path = open_fixture(db_path, workdir, args.patients, args.seed)
+        else:
+            db_path, patient_ids, image_paths = build_fixture(workdir, args.scans, args.patients, args.images,
+                                                              args.seed)
+            upload_path = image_paths[0]
+        if args.model == 'real':
+            os.environ.setdefault('MODEL_PATH', os.path.join(APP_DIR, 'models', 'optimized_best.h5'))
+        os.chdir(workdir)  # uploads and derivatives land in the scratch directory
+        # the app logs with print(); keep it out of the results stream
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            server, _ = start_app(db_path, workdir, args.model, (args.stub_batch_ms, args.stub_item_ms), args.seed)
+        with open(upload_path, 'rb') as f:
+            upload_bytes = f.read()
+        CTX.update(patient_ids=patient_ids, scans=args.scans, upload_bytes=upload_bytes, queries=ADMIN_QUERIES)
+
+        specs = route_specs(CTX)
+        names = args.routes or list(specs)
+        unknown = [n for n in names if n not in specs]
+        if unknown:
+            parser.error(f"unknown routes: {', '.join(unknown)} (choose from {', '.join(specs)})")
+
+        results = {
+            'commit': git_commit(),
+            'created_on': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'params': {k: v for k, v in vars(args).items() if k not in ('output', 'compare')},
+            'routes': {},
+        }
+        for name in names:
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                res = run_route(name, specs[name], server.server_port, args.concurrency, args.duration,
+                                args.max_requests, args.seed)
+            results['routes'][name] = res
+            lat = res['latency_ms']
+            print(f"{name:24s} {res['throughput_rps']:8.1f} req/s  p50 {lat['p50'] or 0:8.2f}  p95 {lat['p95'] or 0:8.2f}  "
+                  f"p99 {lat['p99'] or 0:8.2f} ms  errors {res['errors']}", file=sys.stderr)
+        server.shutdown()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.compare:
+        print(f"Compared with {args.compare}:", file=sys.stderr)
+        if compare(results, args.compare, args.regression_threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""Read-throughput benchmark: tensor shards against decoding training_images.
+
+Produces the same model-ready float32 batches three ways and times each
+pass end to end (shard views are paged in lazily, so reading and
+preprocess_batch cannot be timed apart):
+
+    decode            cv2 decode + RGB + resize of each source file (decode_for_model)
+    shards            ShardDataset.take in shard order (memmap views)
+    shards_shuffled   ShardDataset.take in random order (one gather copy per batch)
+
+--cold drops the shard files and source images from the page cache
+(posix_fadvise DONTNEED) before every pass, so the first read comes from
+disk; without it the passes measure warm-cache throughput. Decoding runs in
+this process on one core, like each bulk-prediction worker. preprocess_batch
+alone on a resident batch is reported as the ceiling any reader can reach.
+
+Usage (from MyApp/, after `python tensor_shards.py`):
+    python benchmarks/shard_bench.py
+    python benchmarks/shard_bench.py --limit 1000 --batch-size 64 --cold --output shard_bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(HERE)
+sys.path.insert(0, APP_DIR)
+
+import tensor_shards  # noqa: E402
+from preprocessing import decode_for_model, preprocess_batch  # noqa: E402
+
+
+def drop_cache(paths):
+    """Ask the kernel to evict these files' clean pages."""
+    for path in paths:
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def time_pass(batches):
+    """Turn each uint8 batch into a model batch; returns (images, seconds)."""
+    images = 0
+    started = time.perf_counter()
+    for pixels, in batches:
+        preprocess_batch(pixels)
+        images += len(pixels)
+    return images, time.perf_counter() - started
+
+
+def preprocess_ceiling(dataset, batch_size, repeats=10):
+    """images/sec of preprocess_batch alone, on a batch already in memory."""
+    pixels = np.ascontiguousarray(dataset.take(np.arange(min(batch_size, len(dataset)))))
+    started = time.perf_counter()
+    for _ in range(repeats):
+        preprocess_batch(pixels)
+    return len(pixels) * repeats / (time.perf_counter() - started)
+
+
+def decode_batches(source_dir, dataset, positions, batch_size):
+    for i in range(0, len(positions), batch_size):
+        part = positions[i:i + batch_size]
+        yield np.stack([decode_for_model(os.path.join(source_dir, dataset.keys[p]))[0] for p in part]),
+
+
+def shard_batches(dataset, positions, batch_size):
+    for i in range(0, len(positions), batch_size):
+        yield dataset.take(positions[i:i + batch_size]),
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--shards', default=tensor_shards.DEFAULT_OUTPUT, help='shard directory')
+    parser.add_argument('--source', default=tensor_shards.DEFAULT_SOURCE, help='image root the shards were built from')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--limit', type=int, default=0, help='images per pass (default: all)')
+    parser.add_argument('--modes', nargs='+', default=['decode', 'shards', 'shards_shuffled'],
+                        choices=['decode', 'shards', 'shards_shuffled'])
+    parser.add_argument('--cold', action='store_true', help='evict shards and images from the page cache before each pass')
+    parser.add_argument('--seed', type=int, default=5110)
+    parser.add_argument('--output', default=None, help='write JSON results here')
+    args = parser.parse_args()
+
+    dataset = tensor_shards.ShardDataset(args.shards)
+    positions = np.arange(min(args.limit, len(dataset)) if args.limit else len(dataset))  # same images in every mode
+    shuffled = np.random.default_rng(args.seed).permutation(positions)
+    files = [tensor_shards.shard_path(args.shards, shard) for shard in sorted(set(dataset.shards[positions].tolist()))]
+    files += [os.path.join(args.source, dataset.keys[p]) for p in positions]
+
+    results = {
+        'created_on': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': {k: v for k, v in vars(args).items() if k != 'output'},
+        'images': len(positions),
+        'modes': {},
+    }
+    for mode in args.modes:
+        if args.cold:
+            drop_cache(files)
+        if mode == 'decode':
+            batches = decode_batches(args.source, dataset, positions, args.batch_size)
+        else:
+            batches = shard_batches(dataset, shuffled if mode == 'shards_shuffled' else positions, args.batch_size)
+        images, elapsed = time_pass(batches)
+        results['modes'][mode] = {
+            'images': images,
+            'seconds': round(elapsed, 3),
+            'images_per_sec': round(images / elapsed, 1) if elapsed > 0 else None,
+            'mb_per_sec': round(images * tensor_shards.ROW_BYTES / 2 ** 20 / elapsed, 1) if elapsed > 0 else None,
+        }
+    results['preprocess_only_images_per_sec'] = round(preprocess_ceiling(dataset, args.batch_size), 1)
+
+    base = results['modes'].get('decode')
+    for mode, res in results['modes'].items():
+        speedup = base['seconds'] / res['seconds'] if base and res['seconds'] else None
+        res['speedup_vs_decode'] = round(speedup, 2) if speedup else None
+        print(f"{mode:17s} {res['images_per_sec'] or 0:9.1f} images/sec  {res['mb_per_sec'] or 0:8.1f} MB/s  "
+              f"{res['speedup_vs_decode'] or 0:6.2f}x", file=sys.stderr)
+    print(f"{'preprocess only':17s} {results['preprocess_only_images_per_sec']:9.1f} images/sec", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,323 @@
+"""Seeded synthetic database fixtures at production scale.
+
+Writes patients, patient accounts, scans (read through the mri_scans view)
+and tumor_classification rows for 10^5-10^7 scans straight into a new SQLite
+file with the app's current schema (migrations.py). Columns are drawn with
+numpy 100k rows at a time and inserted with executemany. Secondary indexes
+and the scan_stats triggers are dropped for the load and recreated
+afterwards; scan_stats is then rebuilt once and the database analyzed, which
+is far faster than maintaining them row by row.
+
+The default distributions follow the training set (label mix, units, ages).
+Patients get a heavy-tailed number of scans (lognormal activity, at least
+one each), and ages advance with scan dates. The same seed, sizes and
+configuration give the same database. Override any distribution with a JSON
+file, e.g. {"labels": {"no_tumor": 1, "glioma_tumor": 3},
+"scans_per_patient": {"mean": 8}}.
+
+Usage (from MyApp/):
+    python benchmarks/synth_data.py --scans 1000000 --output /tmp/synth.db
+    python benchmarks/synth_data.py --scans 100000 --images 200 --config dist.json --output /tmp/synth.db
+    python benchmarks/http_bench.py --fixture /tmp/synth.db --routes patient_records find_scans_by_patient
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.dirname(HERE)
+sys.path.insert(0, APP_DIR)
+
+import dashboard_stats  # noqa: E402
+import migrations  # noqa: E402
+import passwords  # noqa: E402
+
+CHUNK_ROWS = 100_000
+PATIENT_ID_BASE = 1_700_000_000_000  # millisecond-timestamp ids, like uploads
+MODEL_NAME = 'xception_optimized_86val_70test'
+LOADED_TABLES = ('patients', 'users', 'scans', 'tumor_classification')
+PATIENT_PASSWORD = 'changeme'  # app.DEFAULT_PATIENT_PASSWORD
+
+DEFAULT_DISTRIBUTIONS = {
+    # training set class counts
+    'labels': {'glioma_tumor': 826, 'meningioma_tumor': 822, 'no_tumor': 395, 'pituitary_tumor': 827},
+    'hospital_units': {'Neuro': 0.5, 'Radiology': 0.3, 'Oncology': 0.2},
+    'gender': {'M': 0.5, 'F': 0.5},
+    'age': {'mean': 52, 'sd': 16, 'min': 1, 'max': 95},
+    # scans per patient: mean, and lognormal sigma of patient activity (0 = even spread)
+    'scans_per_patient': {'mean': 3.0, 'sigma': 1.0},
+    'scan_dates': {'start': '2023-01-01', 'end': '2026-01-01'},
+    'image_sizes': {'512x512': 0.7, '256x256': 0.1, '630x630': 0.1, '225x225': 0.1},
+    'mean_pixel': {'mean': 0.18, 'sd': 0.05},
+    'std_pixel': {'mean': 0.17, 'sd': 0.04},
+    # scans still waiting for a label, scans with a stored prediction, prediction quality
+    'unlabeled_fraction': 0.05,
+    'classified_fraction': 0.6,
+    'accuracy': 0.86,
+    'confidence': {'a': 8.0, 'b': 2.0},
+    'account_fraction': 1.0,
+}
+_WEIGHTED = ('labels', 'hospital_units', 'gender', 'image_sizes')
+
+# same table as app.ensure_users_table_and_defaults
+USERS_DDL = '''
+    CREATE TABLE IF NOT EXISTS users (
+        username TEXT PRIMARY KEY,
+        password_hash TEXT NOT NULL,
+        password_salt TEXT NOT NULL,
+        iterations INTEGER NOT NULL,
+        role TEXT NOT NULL,
+        patient_id INTEGER,
+        created_on TEXT NOT NULL
+    )
+'''
+
+
+def load_distributions(path=None):
+    """DEFAULT_DISTRIBUTIONS with the overrides from the JSON file at `path`."""
+    dist = json.loads(json.dumps(DEFAULT_DISTRIBUTIONS))
+    if path:
+        with open(path) as f:
+            overrides = json.load(f)
+        for key, value in overrides.items():
+            if key not in dist:
+                raise ValueError(f'unknown distribution {key!r} (choose from {", ".join(dist)})')
+            if isinstance(value, dict) and key not in _WEIGHTED:
+                dist[key].update(value)
+            else:
+                dist[key] = value
+    return dist
+
+
+def _categorical(rng, weights, size):
+    names = list(weights)
+    p = np.array([weights[name] for name in names], dtype=float)
+    return np.array(names, dtype=object)[rng.choice(len(names), size=size, p=p / p.sum())]
+
+
+def _normal(rng, spec, size, low, high):
+    return np.clip(rng.normal(spec['mean'], spec['sd'], size), low, high)
+
+
+def _hex_digests(rng, size):
+    raw = rng.bytes(32 * size).hex()
+    return [raw[i:i + 64] for i in range(0, 64 * size, 64)]
+
+
+def assign_patients(rng, scans, dist):
+    """(patient count, owning patient index per scan): every patient has a scan, busy ones many."""
+    fan = dist['scans_per_patient']
+    patients = int(max(1, min(scans, round(scans / fan['mean']))))
+    activity = rng.lognormal(0.0, fan['sigma'], patients) if fan['sigma'] else np.ones(patients)
+    extra = rng.choice(patients, size=scans - patients, p=activity / activity.sum())
+    owner = np.concatenate([np.arange(patients), extra])
+    rng.shuffle(owner)
+    return patients, owner
+
+
+def placeholder_images(image_dir, count, rng):
+    """`count` small grayscale PNGs (noise around a bright blob) for /image to serve."""
+    os.makedirs(image_dir, exist_ok=True)
+    yy, xx = np.mgrid[0:256, 0:256]
+    paths = []
+    for i in range(count):
+        cy, cx, r = rng.integers(64, 192), rng.integers(64, 192), rng.integers(10, 40)
+        img = rng.normal(40, 12, (256, 256))
+        img[(yy - cy) ** 2 + (xx - cx) ** 2 < r * r] += 120
+        path = os.path.join(image_dir, f'synthetic_{i}.png')
+        Image.fromarray(np.clip(img, 0, 255).astype(np.uint8)).save(path)
+        paths.append(path)
+    return paths
+
+
+def _drop_secondary(conn):
+    """Drop indexes and triggers on the loaded tables; returns their DDL, indexes first."""
+    placeholders = ','.join('?' for _ in LOADED_TABLES)
+    rows = conn.execute(f"SELECT type, name, sql FROM sqlite_master WHERE type IN ('index', 'trigger') "
+                        f"AND sql IS NOT NULL AND tbl_name IN ({placeholders}) ORDER BY type, name",
+                        LOADED_TABLES).fetchall()
+    for kind, name, _ in rows:
+        conn.execute(f'DROP {kind.upper()} "{name}"')
+    return [sql for _, _, sql in rows]
+
+
+def generate(db_path, scans, seed=5110, dist=None, images=0, image_dir=None, progress=None, password_iterations=1000):
+    """Create the fixture at `db_path`; returns row counts and seconds per phase.
+
+    Patient accounts get the default password hashed with `password_iterations`
+    PBKDF2 rounds, one hash and salt shared by all of them; 0 leaves them
+    pending, so the app's background credential fill hashes (and rewrites)
+    every account once it opens the database.
+    """
+    dist = dist or load_distributions()
+    rng = np.random.default_rng(seed)
+    timings = {}
+    started = time.perf_counter()
+
+    def phase(name, t0):
+        timings[name] = round(time.perf_counter() - t0, 3)
+
+    t0 = time.perf_counter()
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute('PRAGMA cache_size = -262144')
+    conn.execute(USERS_DDL)
+    migrations.migrate(conn)
+    conn.execute('BEGIN')
+    deferred_ddl = _drop_secondary(conn)
+    phase('schema', t0)
+
+    # per-patient attributes and the scan timeline
+    t0 = time.perf_counter()
+    patients, owner = assign_patients(rng, scans, dist)
+    start = np.datetime64(dist['scan_dates']['start'], 's')
+    span = int((np.datetime64(dist['scan_dates']['end'], 's') - start) / np.timedelta64(1, 's'))
+    seconds = np.sort(rng.integers(0, span, scans))  # scan ids follow scan dates, like real ingests
+    _, first_index = np.unique(owner, return_index=True)
+    first_seconds = seconds[first_index]
+    genders = _categorical(rng, dist['gender'], patients)
+    base_age = _normal(rng, dist['age'], patients, dist['age']['min'], dist['age']['max']).astype(np.int64)
+    patient_created = np.datetime_as_string(start + first_seconds)
+    patient_ids = PATIENT_ID_BASE + np.arange(patients, dtype=np.int64)
+    # images draw from their own stream so --images does not change the rows
+    image_paths = placeholder_images(image_dir, images, np.random.default_rng([seed, 1])) if images else None
+    phase('prepare', t0)
+
+    t0 = time.perf_counter()
+    ids, created = patient_ids.tolist(), patient_created.tolist()
+    conn.executemany('INSERT INTO patients (patient_id, gender, created_on) VALUES (?, ?, ?)',
+                     zip(ids, genders.tolist(), created))
+    has_account = rng.random(patients) < dist['account_fraction']
+    if password_iterations:
+        credential = passwords.hash_password(PATIENT_PASSWORD, np.random.default_rng([seed, 2]).bytes(16),
+                                             password_iterations)
+    else:
+        credential = ('', '', passwords.PENDING_ITERATIONS)
+    conn.executemany('INSERT INTO users (username, password_hash, password_salt, iterations, role, patient_id, created_on) '
+                     "VALUES ('patient_' || ?, ?, ?, ?, 'patient', ?, ?)",
+                     ((pid, *credential, pid, c) for pid, c, a in zip(ids, created, has_account.tolist()) if a))
+    phase('patients', t0)
+
+    t0 = time.perf_counter()
+    widths = np.array([int(name.split('x')[0]) for name in dist['image_sizes']])
+    heights = np.array([int(name.split('x')[1]) for name in dist['image_sizes']])
+    size_weights = np.array(list(dist['image_sizes'].values()), dtype=float)
+    size_weights /= size_weights.sum()
+    labels = list(dist['labels'])
+    classifications = 0
+    for lo in range(0, scans, CHUNK_ROWS):
+        hi = min(scans, lo + CHUNK_ROWS)
+        n = hi - lo
+        scan_ids = np.arange(lo + 1, hi + 1)
+        who = owner[lo:hi]
+        when = seconds[lo:hi]
+        dates = np.datetime_as_string(start + when).tolist()
+        truth = _categorical(rng, dist['labels'], n)
+        label = truth.copy()
+        label[rng.random(n) < dist['unlabeled_fraction']] = None
+        size = rng.choice(len(size_weights), size=n, p=size_weights)
+        width, height = widths[size], heights[size]
+        ages = base_age[who] + (when - first_seconds[who]) // int(365.25 * 86400)
+        if image_paths:
+            paths = [image_paths[i % len(image_paths)] for i in scan_ids.tolist()]
+        else:
+            paths = [f'synthetic/scan_{i}.png' for i in scan_ids.tolist()]
+        conn.executemany(
+            'INSERT INTO scans (scan_id, patient_id, original_path, processed_path, label, orig_width, orig_height, '
+            'proc_width, proc_height, mean_pixel, std_pixel, age, gender, hospital_unit, scan_date, ingest_timestamp) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            zip(scan_ids.tolist(), (PATIENT_ID_BASE + who).tolist(), paths, paths, label.tolist(), width.tolist(),
+                height.tolist(), width.tolist(), height.tolist(),
+                _normal(rng, dist['mean_pixel'], n, 0.0, 1.0).tolist(), _normal(rng, dist['std_pixel'], n, 0.0, 1.0).tolist(),
+                ages.tolist(), genders[who].tolist(), _categorical(rng, dist['hospital_units'], n).tolist(), dates, dates))
+
+        classified = np.flatnonzero(rng.random(n) < dist['classified_fraction'])
+        k = len(classified)
+        wrong = rng.random(k) >= dist['accuracy']
+        predicted = truth[classified]
+        predicted[wrong] = np.array(labels, dtype=object)[rng.integers(0, len(labels), int(wrong.sum()))]
+        classified_on = np.datetime_as_string(start + when[classified] + rng.integers(60, 86400, k)).tolist()
+        conn.executemany(
+            'INSERT INTO tumor_classification (classification_id, scan_id, processed_path, predicted_label, confidence, '
+            'model_name, classified_on, image_sha256, model_version) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            zip(range(classifications + 1, classifications + k + 1), scan_ids[classified].tolist(),
+                [paths[i] for i in classified.tolist()], predicted.tolist(),
+                rng.beta(dist['confidence']['a'], dist['confidence']['b'], k).tolist(),
+                [MODEL_NAME] * k, classified_on, _hex_digests(rng, k), [f'{MODEL_NAME}:synthetic'] * k))
+        classifications += k
+        if progress:
+            progress(hi, scans, time.perf_counter() - t0)
+    phase('scans', t0)
+
+    t0 = time.perf_counter()
+    for sql in deferred_ddl:
+        conn.execute(sql)
+    phase('indexes', t0)
+    t0 = time.perf_counter()
+    dashboard_stats.rebuild(conn)
+    conn.execute('COMMIT')
+    phase('scan_stats', t0)
+    t0 = time.perf_counter()
+    conn.execute('ANALYZE')
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.close()
+    phase('analyze', t0)
+
+    elapsed = time.perf_counter() - started
+    return {
+        'database': db_path,
+        'seed': seed,
+        'patients': patients,
+        'accounts': int(has_account.sum()),
+        'scans': scans,
+        'classifications': classifications,
+        'images': images,
+        'size_mb': round(os.path.getsize(db_path) / 2 ** 20, 1),
+        'phase_seconds': timings,
+        'seconds': round(elapsed, 3),
+        'scans_per_sec': round(scans / timings['scans'], 1) if timings['scans'] else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--output', required=True, help='SQLite file to create')
+    parser.add_argument('--scans', type=int, default=100_000)
+    parser.add_argument('--seed', type=int, default=5110)
+    parser.add_argument('--config', default=None, help='JSON overrides for DEFAULT_DISTRIBUTIONS')
+    parser.add_argument('--images', type=int, default=0, help='placeholder PNGs shared by the scans (0 = none)')
+    parser.add_argument('--image-dir', default=None, help='where to write them (default: next to --output)')
+    parser.add_argument('--force', action='store_true', help='replace an existing --output')
+    parser.add_argument('--password-iterations', type=int, default=1000,
+                        help='PBKDF2 rounds of the patient accounts\' shared hash (0 = pending, hashed by the app)')
+    args = parser.parse_args()
+
+    if os.path.exists(args.output):
+        if not args.force:
+            parser.error(f'{args.output} exists (use --force to replace it)')
+        for suffix in ('', '-wal', '-shm', '-journal'):
+            if os.path.exists(args.output + suffix):
+                os.remove(args.output + suffix)
+    image_dir = args.image_dir or os.path.join(os.path.dirname(os.path.abspath(args.output)), 'synthetic_images')
+
+    def progress(done, total, elapsed):
+        if done == total or done % (10 * CHUNK_ROWS) == 0:
+            print(f"  {done}/{total} scans ({done / elapsed if elapsed > 0 else 0.0:.0f} rows/sec)")
+
+    summary = generate(args.output, args.scans, args.seed, load_distributions(args.config), args.images,
+                       image_dir, progress, args.password_iterations)
+    print(f"✓ {summary['scans']} scans, {summary['patients']} patients, {summary['classifications']} "
+          f"classifications in {summary['seconds']:.1f}s ({summary['size_mb']} MB)")
+    for name, seconds in summary['phase_seconds'].items():
+        print(f"     {name:<12}{seconds:8.3f}s")
+
+
+if __name__ == '__main__':
+    main()
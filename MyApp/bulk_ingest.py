@@ -0,0 +1,301 @@
+"""Bulk ingest of MRI images with a metadata manifest.
+
+Images are decoded, measured and saved in a process pool, which also hands
+back each one's thumbnail for the caller's derivative cache. Patients, patient user accounts and scans are then written with
+`executemany`, `chunk_size` items per transaction, instead of a commit per
+image. New patient accounts get a pending credential (see passwords.py), so
+no password hashing happens during the ingest.
+
+The manifest is CSV or JSON with one entry per image:
+
+    file,age,gender,hospital_unit[,patient_id][,scan_date]
+
+`file` matches an image by name. Entries with a `patient_id` add a scan to
+that patient; the others create a new patient. Each item is reported
+separately: an unreadable image or a manifest entry without an image fails
+on its own without stopping the rest.
+"""
+import csv
+import io
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from PIL import Image, ImageStat, UnidentifiedImageError
+from werkzeug.utils import secure_filename
+
+MANIFEST_FIELDS = ('file', 'patient_id', 'age', 'gender', 'hospital_unit', 'scan_date')
+
+
+class ManifestError(ValueError):
+    """The manifest cannot be parsed."""
+
+
+def _blank_to_none(value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def read_manifest(data, filename=''):
+    """Parse manifest bytes (CSV, or JSON: a list or {"items": [...]}) into {file name: entry}."""
+    text = data.decode('utf-8-sig') if isinstance(data, bytes) else data
+    is_json = filename.lower().endswith('.json') or text.lstrip().startswith(('[', '{'))
+    try:
+        if is_json:
+            rows = json.loads(text)
+            if isinstance(rows, dict):
+                rows = rows.get('items', [])
+        else:
+            rows = list(csv.DictReader(io.StringIO(text)))
+    except (ValueError, csv.Error) as e:
+        raise ManifestError(f'cannot parse manifest: {e}')
+    if not isinstance(rows, list):
+        raise ManifestError('manifest must be a list of entries')
+
+    manifest = {}
+    for number, row in enumerate(rows, 1):
+        if not isinstance(row, dict):
+            raise ManifestError(f'manifest entry {number} is not an object')
+        row = {str(k).strip().lower(): v for k, v in row.items() if k is not None}
+        name = _blank_to_none(row.get('file') or row.get('filename'))
+        if not name:
+            raise ManifestError(f'manifest entry {number} has no file name')
+        entry = {field: _blank_to_none(row.get(field)) for field in MANIFEST_FIELDS}
+        entry['file'] = os.path.basename(name)
+        for field in ('age', 'patient_id'):
+            if entry[field] is not None:
+                try:
+                    entry[field] = int(float(entry[field]))
+                except ValueError:
+                    raise ManifestError(f'manifest entry {number}: {field} must be a number')
+        manifest[entry['file']] = entry
+    return manifest
+
+
+def _image_stats(data):
+    """(width, height, mean_pixel, std_pixel, pixels, sha256, phash, dhash, thumbnail JPEG); the last five are None without OpenCV."""
+    try:
+        from preprocessing import prepare_upload
+    except ImportError:
+        prepare_upload = None
+    if prepare_upload is not None:
+        prepared = prepare_upload(data)
+        return (prepared.width, prepared.height, prepared.mean_pixel, prepared.std_pixel,
+                prepared.pixels, prepared.image_sha256, prepared.phash, prepared.dhash, prepared.thumbnail)
+    with Image.open(io.BytesIO(data)) as img:
+        img = img.convert('RGB')
+        stat = ImageStat.Stat(img)
+        return (img.size[0], img.size[1], float(sum(stat.mean) / len(stat.mean)),
+                float(sum(stat.stddev) / len(stat.stddev)), None, None, None, None, None)
+
+
+def prepare_item_worker(job):
+    """Process-pool entry point: decode one image and save it.
+
+    job = (index, source, save_path, keep_tensor) where source
+    is the image bytes or a path to read. Returns (index, stats tuple or None,
+    error or None); the model tensor is only sent back if `keep_tensor`.
+    """
+    index, source, save_path, keep_tensor = job
+    try:
+        if isinstance(source, str):
+            with open(source, 'rb') as f:
+                data = f.read()
+        else:
+            data = source
+        stats = _image_stats(data)
+        if not keep_tensor:
+            stats = stats[:4] + (None,) + stats[5:]
+        with open(save_path, 'wb') as f:
+            f.write(data)
+        return index, stats, None
+    except UnidentifiedImageError:
+        return index, None, 'not a readable image'
+    except Exception as e:
+        return index, None, f'cannot read image: {e}'
+
+
+def allocate_patient_ids(conn, count):
+    """`count` unused patient ids for new patients, shared by single uploads and bulk ingest.
+
+    Ids follow the largest one stored in patients or users (never below the
+    current millisecond timestamp, the shape of older upload ids). Only call
+    inside a `BEGIN IMMEDIATE` transaction that also inserts the patients:
+    the write lock keeps another writer from taking the same ids.
+    """
+    largest = max(conn.execute('SELECT MAX(patient_id) FROM patients').fetchone()[0] or 0,
+                  conn.execute('SELECT MAX(patient_id) FROM users').fetchone()[0] or 0)
+    start = max(int(datetime.utcnow().timestamp() * 1000), largest + 1)
+    return list(range(start, start + count))
+
+
+def _write_chunk(conn, items, pending_credential):
+    """Insert one chunk of prepared items in a single transaction.
+
+    Fills in each item's patient_id, scan_id and, for accounts created here, username.
+    """
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        now = datetime.utcnow().isoformat()
+        new_patients = [item for item in items if item['patient_id'] is None]
+        for item, patient_id in zip(new_patients, allocate_patient_ids(conn, len(new_patients))):
+            item['patient_id'] = patient_id
+        # manifest patient ids without an account get one, like new patients
+        accounts = {}
+        for item in items:
+            if item['patient_id'] not in accounts and not conn.execute(
+                    'SELECT 1 FROM users WHERE patient_id = ? LIMIT 1', (item['patient_id'],)).fetchone():
+                accounts[item['patient_id']] = f"patient_{item['patient_id']}"
+        for item in items:
+            item['username'] = accounts.get(item['patient_id'])
+        pwd_hash, salt_hex, iterations = pending_credential
+        # a taken username fails the chunk rather than sharing a patient_id between accounts
+        conn.executemany('INSERT INTO users (username, password_hash, password_salt, iterations, role, patient_id, created_on) '
+                         'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                         [(username, pwd_hash, salt_hex, iterations, 'patient', patient_id, now)
+                          for patient_id, username in accounts.items()])
+        conn.executemany('INSERT INTO patients (patient_id, gender, created_on) VALUES (?, ?, ?) '
+                         'ON CONFLICT (patient_id) DO UPDATE SET gender = COALESCE(excluded.gender, patients.gender)',
+                         [(item['patient_id'], item['gender'], now) for item in items])
+        conn.executemany('INSERT INTO scans (patient_id, original_path, processed_path, label, orig_width, orig_height, '
+                         'proc_width, proc_height, mean_pixel, std_pixel, age, gender, hospital_unit, scan_date, '
+                         'ingest_timestamp, phash, dhash) VALUES (?, ?, ?, NULL, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                         [(item['patient_id'], item['path'], item['path'], item['width'], item['height'],
+                           item['width'], item['height'], item['mean_pixel'], item['std_pixel'], item['age'],
+                           item['gender'], item['hospital_unit'], item['scan_date'] or now, now, item['phash'],
+                           item['dhash'])
+                          for item in items])
+        # AUTOINCREMENT hands out consecutive ids and the write lock is held, so the
+        # chunk's scans are the last len(items) ids
+        last_id = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'scans'").fetchone()[0]
+        for scan_id, item in zip(range(last_id - len(items) + 1, last_id + 1), items):
+            item['scan_id'] = scan_id
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+
+
+def ingest(conn, images, manifest=None, upload_dir='static/uploads', workers=None,
+           chunk_size=500, pending_credential=('', '', 0), allowed=None, keep_tensors=False, progress=None):
+    """Ingest `images` [(file name, bytes or path)] described by `manifest` ({file name: entry}).
+
+    Without a manifest every image becomes a new patient with no demographics.
+    `allowed(file name)` rejects unsupported files.
+    Returns (items, summary): one report dict per image or manifest entry, and
+    the overall counts, stage timings and images/second. With OpenCV, written
+    items carry their `thumbnail` JPEG, and with `keep_tensors` also
+    `pixels`/`image_sha256` for the caller's tensor cache; report_item() leaves
+    them out.
+    """
+    started = time.perf_counter()
+    os.makedirs(upload_dir, exist_ok=True)
+    stamp = datetime.utcnow().strftime('%Y%m%dT%H%M%S')
+
+    items = []
+    seen = set()
+    for name, source in images:
+        name = os.path.basename(name)
+        entry = (manifest or {}).get(name)
+        item = {'index': len(items), 'file': name, 'success': False, 'error': None}
+        if name in seen:
+            item['error'] = 'duplicate file name'
+        elif allowed is not None and not allowed(name):
+            item['error'] = 'unsupported file type'
+        elif manifest is not None and entry is None:
+            item['error'] = 'no manifest entry for this file'
+        seen.add(name)
+        entry = entry or {}
+        disk_name = f"{stamp}_{item['index']}_{secure_filename(name) or 'image'}"
+        item.update(source=source, patient_id=entry.get('patient_id'), age=entry.get('age'),
+                    gender=entry.get('gender'), hospital_unit=entry.get('hospital_unit'),
+                    scan_date=entry.get('scan_date'), username=None,
+                    path=os.path.join(upload_dir, disk_name))
+        items.append(item)
+    for name in sorted(set(manifest or {}) - seen):
+        items.append({'index': len(items), 'file': name, 'success': False, 'error': 'image missing from upload'})
+
+    # decode, measure and save in parallel
+    jobs = []
+    for item in items:
+        source = item.pop('source', None)
+        if item['error'] is None:
+            jobs.append((item['index'], source, item['path'], keep_tensors))
+    decode_started = time.perf_counter()
+    workers = max(1, min(workers or os.cpu_count() or 1, len(jobs) or 1))
+    if workers == 1:
+        results = map(prepare_item_worker, jobs)
+        pool = None
+    else:
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        results = pool.map(prepare_item_worker, jobs, chunksize=4)
+    try:
+        ready = []
+        for done, (index, stats, error) in enumerate(results, 1):
+            item = items[index]
+            if error:
+                item['error'] = error
+            else:
+                (item['width'], item['height'], item['mean_pixel'], item['std_pixel'],
+                 item['pixels'], item['image_sha256'], item['phash'], item['dhash'], item['thumbnail']) = stats
+                ready.append(item)
+            if progress:
+                progress('decode', done, len(jobs))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    decode_seconds = time.perf_counter() - decode_started
+
+    # batched writes
+    write_started = time.perf_counter()
+    previous_isolation = conn.isolation_level
+    conn.isolation_level = None  # explicit BEGIN/COMMIT per chunk
+    try:
+        for i in range(0, len(ready), chunk_size):
+            chunk = ready[i:i + chunk_size]
+            try:
+                _write_chunk(conn, chunk, pending_credential)
+            except Exception as e:
+                for item in chunk:
+                    item['error'] = f'database write failed: {e}'
+                    if os.path.exists(item['path']):
+                        os.remove(item['path'])
+                continue
+            for item in chunk:
+                item['success'] = True
+            if progress:
+                progress('write', min(i + chunk_size, len(ready)), len(ready))
+    finally:
+        conn.isolation_level = previous_isolation
+    write_seconds = time.perf_counter() - write_started
+
+    elapsed = time.perf_counter() - started
+    ingested = sum(1 for item in items if item['success'])
+    summary = {
+        'total': len(items),
+        'ingested': ingested,
+        'failed': len(items) - ingested,
+        'workers': workers,
+        'chunk_size': chunk_size,
+        'decode_seconds': round(decode_seconds, 3),
+        'write_seconds': round(write_seconds, 3),
+        'seconds': round(elapsed, 3),
+        'images_per_sec': round(ingested / elapsed, 1) if elapsed > 0 else None,
+    }
+    return items, summary
+
+
+def report_item(item, upload_url='/static/uploads'):
+    """JSON-safe report of one item."""
+    report = {'index': item['index'], 'file': item['file'], 'success': item['success']}
+    if item['success']:
+        report.update(patient_id=item['patient_id'], scan_id=item['scan_id'], username=item.get('username'),
+                      filepath=f"{upload_url}/{os.path.basename(item['path'])}")
+    else:
+        report['error'] = item['error']
+    return report
@@ -0,0 +1,154 @@
+"""Bulk classification of stored scans.
+
+Images are decoded and resized in a process pool while the main process feeds
+the model full batches; classification rows and label updates are written
+with `executemany` in a few large transactions. Scans packed in tensor shards
+(tensor_shards.py) are read from the memory map instead of being decoded, as
+long as the packed file's hash still matches scans.content_sha256.
+"""
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+from preprocessing import decode_for_model_worker, preprocess_batch
+
+
+def select_scans(conn, scan_ids=None, only_unlabeled=False, limit=None):
+    """Return [(scan_id, original_path, processed_path, content_sha256)] for explicit ids, unlabeled rows or all rows."""
+    if scan_ids:
+        rows = []
+        ids = [int(s) for s in scan_ids]
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            placeholders = ','.join('?' for _ in chunk)
+            rows.extend(conn.execute(f'SELECT scan_id, original_path, processed_path, content_sha256 FROM scans WHERE scan_id IN ({placeholders})',
+                                     chunk).fetchall())
+        rows.sort(key=lambda r: r[0])
+    else:
+        sql = 'SELECT scan_id, original_path, processed_path, content_sha256 FROM scans'
+        if only_unlabeled:
+            sql += ' WHERE label IS NULL'
+        sql += ' ORDER BY scan_id'
+        rows = conn.execute(sql).fetchall()
+    rows = [(r[0], r[1], r[2], r[3]) for r in rows]
+    return rows[:limit] if limit else rows
+
+
+def predict_scans(conn, scans, model, classes, cache, model_name, batch_size=32, workers=None,
+                  commit_every=1000, resolve_path=None, shards=None, progress=None):
+    """Classify `scans` (as returned by select_scans) and store the results.
+
+    `resolve_path(original_path, processed_path)` returns the local image file
+    (or None); `shards` is an optional tensor_shards.ShardDataset; `progress` is
+    called as progress(done, total, elapsed_seconds). Returns a summary dict.
+    """
+    started = time.perf_counter()
+    total = len(scans)
+    model_version = cache.model_version
+    summary = {'total': total, 'predicted': 0, 'cached': 0, 'failed': 0, 'from_shards': 0, 'stale_shard_rows': 0, 'errors': []}
+
+    stored_paths = {scan_id: processed for scan_id, _, processed, _ in scans}
+    pending_rows = []     # tumor_classification inserts
+    pending_labels = []   # scans label updates
+    batch = []            # (scan_id, uint8 pixels, sha256)
+    done = 0
+    reported = 0
+
+    def flush_writes():
+        if not pending_rows and not pending_labels:
+            return
+        conn.executemany('INSERT INTO tumor_classification (scan_id, processed_path, predicted_label, confidence, model_name, classified_on, image_sha256, model_version) '
+                         'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', pending_rows)
+        conn.executemany('UPDATE scans SET label = ? WHERE scan_id = ?', pending_labels)
+        conn.commit()
+        pending_rows.clear()
+        pending_labels.clear()
+
+    def record(scan_id, label, confidence, image_sha256):
+        pending_rows.append((scan_id, stored_paths[scan_id], label, confidence, model_name,
+                             datetime.utcnow().isoformat(), image_sha256, model_version))
+        pending_labels.append((label, scan_id))
+
+    def run_batch():
+        nonlocal done
+        if not batch:
+            return
+        outputs = model.predict(preprocess_batch([b[1] for b in batch]), verbose=0)
+        for (scan_id, _, image_sha256), scores in zip(batch, outputs):
+            class_idx = int(np.argmax(scores))
+            record(scan_id, classes[class_idx], float(scores[class_idx]), image_sha256)
+        summary['predicted'] += len(batch)
+        done += len(batch)
+        batch.clear()
+
+    resolve_path = resolve_path or (lambda original, processed: processed)
+    items = []
+    packed = []
+    for scan_id, original, processed, content_sha256 in scans:
+        position = shards.position(scan_id) if shards is not None else None
+        if position is not None:
+            if content_sha256 is not None and shards.sha256[position] == content_sha256:
+                packed.append((scan_id, position))
+                continue
+            # the image was replaced (or not hashed yet) since the shards were built
+            summary['stale_shard_rows'] += 1
+        local = resolve_path(original, processed)
+        if local is None:
+            summary['failed'] += 1
+            summary['errors'].append({'scan_id': scan_id, 'error': 'image file not found'})
+            done += 1
+        else:
+            items.append((scan_id, local))
+
+    def handle(scan_id, pixels, image_sha256, error):
+        nonlocal done, reported
+        if error is not None:
+            summary['failed'] += 1
+            summary['errors'].append({'scan_id': scan_id, 'error': error})
+            done += 1
+            return
+
+        cached = cache.get(conn, image_sha256)
+        if cached is not None:
+            if cached.get('scan_id') == scan_id:
+                # this exact scan was already classified by the current model
+                pending_labels.append((cached['predicted_label'], scan_id))
+            else:
+                record(scan_id, cached['predicted_label'], cached['confidence'], image_sha256)
+            summary['cached'] += 1
+            done += 1
+        else:
+            batch.append((scan_id, pixels, image_sha256))
+            if len(batch) >= batch_size:
+                run_batch()
+
+        if len(pending_labels) >= commit_every:
+            flush_writes()
+        if progress is not None and done - reported >= batch_size:
+            reported = done
+            progress(done, total, time.perf_counter() - started)
+
+    for scan_id, position in packed:
+        handle(scan_id, shards.pixels(position), shards.image_sha256[position], None)
+    summary['from_shards'] = len(packed)
+
+    if items:
+        workers = workers or os.cpu_count() or 1
+        ctx = multiprocessing.get_context('spawn')  # never fork a process that holds TensorFlow
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+            for result in pool.map(decode_for_model_worker, items, chunksize=8):
+                handle(*result)
+
+    run_batch()
+    flush_writes()
+
+    elapsed = time.perf_counter() - started
+    summary['elapsed_seconds'] = elapsed
+    summary['images_per_sec'] = (total / elapsed) if elapsed > 0 else None
+    if progress is not None:
+        progress(total, total, elapsed)
+    return summary
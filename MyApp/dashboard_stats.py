@@ -0,0 +1,108 @@
+"""Precomputed scan counts for the admin dashboard.
+
+`scan_stats` holds one row per (dimension, bucket, label) with the number of
+scans and their summed image area, e.g. ('hospital_unit', 'Neuro',
+'glioma_tumor'). Triggers on `scans` (created by migration 4, see
+migrations.py) keep it current for every write path
+(uploads, predictions, bulk backfills, cascading deletes, inserts through
+the mri_scans view), so the dashboard reads a few hundred rows instead of
+grouping the whole scans table. NULL buckets and labels are
+stored as '' because key columns cannot be NULL.
+
+`rebuild` recomputes the table from scratch and `verify` compares it against
+a fresh GROUP BY. Changing DIMENSIONS needs a new migration that recreates
+the triggers.
+"""
+
+# dimension -> bucket expression over a scans row ({r} is its alias); migration 4 has the trigger copy
+DIMENSIONS = {
+    'all': "''",
+    'age': "COALESCE(CAST({r}.age AS TEXT), '')",
+    'hospital_unit': "COALESCE({r}.hospital_unit, '')",
+    'gender': "COALESCE({r}.gender, '')",
+    'week': "COALESCE(STRFTIME('%Y-%W', {r}.scan_date), '')",
+}
+
+_LABEL = "COALESCE({r}.label, '')"
+
+
+def _fresh_counts(conn):
+    """{(dimension, bucket, label): (scans, area_sum, area_count)} from a full GROUP BY."""
+    counts = {}
+    for dim, expr in DIMENSIONS.items():
+        rows = conn.execute(
+            f"SELECT {expr.format(r='s')}, {_LABEL.format(r='s')}, COUNT(*), "
+            f"TOTAL(s.orig_width * s.orig_height), COUNT(s.orig_width * s.orig_height) "
+            f"FROM scans s GROUP BY 1, 2").fetchall()
+        for bucket, label, scans, area_sum, area_count in rows:
+            counts[(dim, bucket, label)] = (scans, float(area_sum), area_count)
+    return counts
+
+
+def rebuild(conn):
+    """Recompute scan_stats from the scans table; returns the number of rows written."""
+    counts = _fresh_counts(conn)
+    conn.execute('DELETE FROM scan_stats')
+    conn.executemany('INSERT INTO scan_stats (dimension, bucket, label, scans, area_sum, area_count) '
+                     'VALUES (?, ?, ?, ?, ?, ?)', [k + v for k, v in counts.items()])
+    return len(counts)
+
+
+def verify(conn):
+    """Differences between scan_stats and a fresh GROUP BY: [(key, stored, expected)]."""
+    expected = _fresh_counts(conn)
+    stored = {}
+    for dim, bucket, label, scans, area_sum, area_count in conn.execute('SELECT * FROM scan_stats WHERE scans != 0'):
+        stored[(dim, bucket, label)] = (scans, float(area_sum), area_count)
+    mismatches = []
+    for key in sorted(set(expected) | set(stored)):
+        got, want = stored.get(key), expected.get(key)
+        if got is None or want is None or got[0] != want[0] or got[2] != want[2] or abs(got[1] - want[1]) > 1e-6 * max(1.0, abs(want[1])):
+            mismatches.append((key, got, want))
+    return mismatches
+
+
+def age_group(age):
+    """Buckets of the console's age-group query (missing or non-numeric ages fall into its ELSE)."""
+    try:
+        age = int(float(age))
+    except (TypeError, ValueError):
+        return '70s+'
+    if 20 <= age <= 69:
+        return f'{age // 10 * 10}s'
+    return '70s+'
+
+
+def read(conn):
+    """Dashboard aggregates from scan_stats; cost depends on the number of buckets, not scans."""
+    dims = {}
+    for dim, bucket, label, scans, area_sum, area_count in conn.execute(
+            'SELECT dimension, bucket, label, scans, area_sum, area_count FROM scan_stats WHERE scans > 0'):
+        dims.setdefault(dim, []).append((bucket or None, label or None, scans, area_sum, area_count))
+
+    # exact ages are stored so any age grouping can be derived; the console uses decades
+    age_rows = {}
+    for bucket, label, scans, area_sum, area_count in dims.pop('age', []):
+        key = (age_group(bucket), label)
+        acc = age_rows.setdefault(key, [0, 0.0, 0])
+        acc[0] += scans
+        acc[1] += area_sum
+        acc[2] += area_count
+    dims['age_group'] = [(k[0], k[1], *v) for k, v in age_rows.items()]
+
+    result = {'total_scans': sum(r[2] for r in dims.get('all', []))}
+    result['by_label'] = sorted(({'label': label, 'count': scans} for _, label, scans, _, _ in dims.get('all', [])),
+                                key=lambda r: -r['count'])
+    for dim in ('age_group', 'hospital_unit', 'gender', 'week'):
+        buckets = {}
+        for bucket, label, scans, area_sum, area_count in dims.get(dim, []):
+            entry = buckets.setdefault(bucket, {dim: bucket, 'count': 0, 'by_label': {}, '_area': 0.0, '_n': 0})
+            entry['count'] += scans
+            entry['by_label'][label or 'unlabeled'] = entry['by_label'].get(label or 'unlabeled', 0) + scans
+            entry['_area'] += area_sum
+            entry['_n'] += area_count
+        for entry in buckets.values():
+            entry['avg_area'] = entry.pop('_area') / entry['_n'] if entry['_n'] else None
+            entry.pop('_n')
+        result[f'by_{dim}'] = sorted(buckets.values(), key=lambda e: (e[dim] is None, e[dim] or ''))
+    return result
@@ -0,0 +1,187 @@
+"""Pool of long-lived SQLite connections for request and worker threads.
+
+Opening a connection per request re-reads the schema, throws away the page
+cache and the prepared-statement cache each time. The pool keeps up to `size`
+configured connections open; a request checks one out in `get_db` and returns
+it at teardown, so each worker thread keeps reusing a warm connection. The
+database runs in WAL mode, so readers see the last committed state instead of
+waiting on a writer, and writers wait up to `busy_timeout_ms` for each other
+instead of failing with "database is locked".
+"""
+import queue
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class PoolTimeout(RuntimeError):
+    """No connection became free within the pool timeout."""
+
+
+def configure_connection(conn, busy_timeout_ms=5000, cache_size_kb=16384, mmap_size_mb=256):
+    """Per-connection pragmas shared by pooled and one-off (CLI) connections."""
+    conn.execute(f'PRAGMA busy_timeout = {int(busy_timeout_ms)}')
+    conn.execute('PRAGMA foreign_keys = ON')
+    # WAL makes NORMAL durable against application crashes; only power loss can drop the last commits
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute(f'PRAGMA cache_size = {-int(cache_size_kb)}')
+    conn.execute(f'PRAGMA mmap_size = {int(mmap_size_mb) * 2 ** 20}')
+    conn.execute('PRAGMA temp_store = MEMORY')
+    return conn
+
+
+class ConnectionPool:
+    def __init__(self, db_path, size=8, timeout=10.0, busy_timeout_ms=5000, cache_size_kb=16384,
+                 mmap_size_mb=256, cached_statements=256, row_factory=sqlite3.Row, stats_window=1000):
+        self.db_path = db_path
+        self.size = max(1, int(size))
+        self.timeout = timeout
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size_mb = mmap_size_mb
+        self.cached_statements = cached_statements
+        self.row_factory = row_factory
+        self.journal_mode = None
+        self._idle = queue.LifoQueue()  # most recently used first: its cache is warmest
+        self._lock = threading.Lock()
+        self._open = 0
+        self._in_use = 0
+
+        # statistics
+        self._recent_waits = deque(maxlen=stats_window)
+        self._checkouts = 0
+        self._waited = 0
+        self._timeouts = 0
+        self._created = 0
+        self._discarded = 0
+        self._peak_in_use = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout_ms / 1000.0,
+                               check_same_thread=False, cached_statements=self.cached_statements)
+        configure_connection(conn, self.busy_timeout_ms, self.cache_size_kb, self.mmap_size_mb)
+        if self.journal_mode is None:
+            # persistent in the database file; only the first connection needs to ask
+            self.journal_mode = conn.execute('PRAGMA journal_mode = WAL').fetchone()[0]
+            if self.journal_mode.lower() != 'wal':
+                print(f"⚠️  SQLite WAL unavailable for {self.db_path} (journal_mode={self.journal_mode})")
+        conn.row_factory = self.row_factory
+        return conn
+
+    def acquire(self):
+        """Check out a connection, opening one if the pool is below `size`.
+
+        Raises PoolTimeout when all connections stay busy for `timeout` seconds.
+        """
+        started = time.perf_counter()
+        waited = False
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._open < self.size
+                if create:
+                    self._open += 1
+            if create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._open -= 1
+                    raise
+                with self._lock:
+                    self._created += 1
+            else:
+                waited = True
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    with self._lock:
+                        self._timeouts += 1
+                    raise PoolTimeout(f'no database connection free after {self.timeout:.1f}s '
+                                      f'({self.size} in use)')
+
+        wait = time.perf_counter() - started
+        with self._lock:
+            self._checkouts += 1
+            self._waited += waited
+            self._in_use += 1
+            self._peak_in_use = max(self._peak_in_use, self._in_use)
+            self._recent_waits.append(wait)
+        return conn
+
+    def release(self, conn):
+        """Return a connection; an open transaction is rolled back and any progress handler removed."""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.set_progress_handler(None, 0)
+        except sqlite3.Error:
+            # closed or broken: drop it and let the next acquire open a fresh one
+            with self._lock:
+                self._in_use -= 1
+                self._open -= 1
+                self._discarded += 1
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+            return
+        with self._lock:
+            self._in_use -= 1
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close_all(self):
+        """Close the idle connections."""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._open -= 1
+
+    def stats(self):
+        with self._lock:
+            waits = sorted(self._recent_waits)
+            result = {
+                'db_path': self.db_path,
+                'journal_mode': self.journal_mode,
+                'size': self.size,
+                'open': self._open,
+                'in_use': self._in_use,
+                'idle': self._open - self._in_use,
+                'peak_in_use': self._peak_in_use,
+                'created': self._created,
+                'discarded': self._discarded,
+                'checkouts': self._checkouts,
+                'checkouts_waited': self._waited,
+                'timeouts': self._timeouts,
+                'settings': {
+                    'busy_timeout_ms': self.busy_timeout_ms,
+                    'cache_size_kb': self.cache_size_kb,
+                    'mmap_size_mb': self.mmap_size_mb,
+                    'cached_statements': self.cached_statements,
+                    'synchronous': 'NORMAL',
+                },
+            }
+        if waits:
+            result['wait_ms'] = {
+                'mean': 1000.0 * sum(waits) / len(waits),
+                'p50': 1000.0 * waits[len(waits) // 2],
+                'p95': 1000.0 * waits[min(len(waits) - 1, int(len(waits) * 0.95))],
+                'p99': 1000.0 * waits[min(len(waits) - 1, int(len(waits) * 0.99))],
+                'max': 1000.0 * waits[-1],
+            }
+        return result
@@ -2,7 +2,7 @@ import sqlite3, os, mimetypes
 db_path = os.path.join(os.path.dirname(__file__), 'brain_etl.db')
 conn = sqlite3.connect(db_path)
 cur = conn.cursor()
-cur.execute('SELECT rowid, original_path, processed_path, label FROM mri_scans LIMIT 5')
+cur.execute('SELECT scan_id, original_path, processed_path, label FROM mri_scans LIMIT 5')
 rows = cur.fetchall()
 for r in rows:
     rid, orig, proc, label = r
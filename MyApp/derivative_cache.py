@@ -0,0 +1,182 @@
+"""On-disk cache of resized image variants for /image/<scan_id>.
+
+Each (source file, variant) pair is rendered once to a JPEG whose name hashes
+the source path, size and mtime, so editing or replacing the source produces
+a new entry and the stale one ages out. Total size is bounded; the least
+recently used files are removed first. Uploads seed their 'thumb' entry with
+the thumbnail encoded while the upload was decoded, so it is never rendered
+again. Placeholder PNGs for scans without a local image are rendered once per
+label and kept in memory.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+from PIL import Image, ImageDraw
+
+# variant name -> longest side in pixels (None = original file)
+VARIANTS = {'thumb': 256, 'preview': 768, 'full': None}
+
+
+class DerivativeCache:
+    def __init__(self, cache_dir, max_bytes=512 * 2 ** 20):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._files = OrderedDict()  # path -> size, least recently used first
+        self._bytes = 0
+        self._placeholders = {}      # label -> (png bytes, etag)
+        self.hits = 0
+        self.renders = 0
+        self.evictions = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith('.jpg') and os.path.isfile(path):
+                st = os.stat(path)
+                entries.append((st.st_atime, path, st.st_size))
+        for _, path, size in sorted(entries):
+            self._files[path] = size
+            self._bytes += size
+
+    def variant_path(self, source_path, variant):
+        """Path of `variant` for `source_path`, rendering it if needed.
+
+        Returns the source itself for 'full' or when the source is already small enough.
+        """
+        size = VARIANTS[variant]
+        if size is None:
+            return source_path
+
+        path = self._entry_path(source_path, os.stat(source_path), variant)
+
+        with self._lock:
+            if path in self._files:
+                self._files.move_to_end(path)
+                self.hits += 1
+                return path
+
+        with Image.open(source_path) as img:
+            if max(img.size) <= size:
+                return source_path
+            img = img.convert('RGB')
+            img.thumbnail((size, size))
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            img.save(tmp, 'JPEG', quality=85)
+        os.replace(tmp, path)
+
+        with self._lock:
+            self.renders += 1
+            if path not in self._files:
+                self._files[path] = os.path.getsize(path)
+                self._bytes += self._files[path]
+            self._evict()
+        return path
+
+    def store(self, source_path, variant, data):
+        """Add already encoded JPEG bytes as `variant` of `source_path` (saved and no longer changing)."""
+        path = self._entry_path(source_path, os.stat(source_path), variant)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self._lock:
+            if path not in self._files:
+                self._files[path] = len(data)
+                self._bytes += len(data)
+            self._evict()
+        return path
+
+    def _entry_path(self, source_path, st, variant):
+        key = hashlib.sha256(f"{os.path.abspath(source_path)}|{st.st_size}|{st.st_mtime_ns}|{variant}".encode()).hexdigest()
+        return os.path.join(self.cache_dir, f"{key[:32]}.jpg")
+
+    def discard(self, source_path):
+        """Remove every cached variant of `source_path`; call before the source itself is deleted."""
+        try:
+            st = os.stat(source_path)
+        except OSError:
+            return 0
+        paths = [self._entry_path(source_path, st, variant) for variant, size in VARIANTS.items() if size is not None]
+        removed = 0
+        with self._lock:
+            for path in paths:
+                size = self._files.pop(path, None)
+                if size is None:
+                    continue
+                self._bytes -= size
+                removed += 1
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        return removed
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and len(self._files) > 1:
+            path, size = self._files.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def placeholder(self, label):
+        """(PNG bytes, etag) of the 'image not available' card for `label`, rendered once."""
+        label = label or 'unknown'
+        with self._lock:
+            cached = self._placeholders.get(label)
+        if cached is not None:
+            return cached
+
+        img = Image.new('RGB', (224, 224), color=(240, 240, 245))
+        draw = ImageDraw.Draw(img)
+
+        # Draw text on placeholder
+        text_lines = [
+            "MRI Scan",
+            f"Type: {label.replace('_', ' ').title()}",
+            "Image not available",
+            "locally"
+        ]
+
+        # Draw centered text
+        y_pos = 60
+        for line in text_lines:
+            # Simple text rendering (PIL default font)
+            bbox = draw.textbbox((0, 0), line)
+            text_width = bbox[2] - bbox[0]
+            x_pos = (224 - text_width) // 2
+            draw.text((x_pos, y_pos), line, fill=(100, 100, 120))
+            y_pos += 30
+
+        # Draw border
+        draw.rectangle([(10, 10), (214, 214)], outline=(200, 200, 210), width=2)
+
+        img_io = BytesIO()
+        img.save(img_io, 'PNG')
+        data = img_io.getvalue()
+        cached = (data, hashlib.sha256(data).hexdigest()[:32])
+        with self._lock:
+            self._placeholders[label] = cached
+        return cached
+
+    def stats(self):
+        with self._lock:
+            return {
+                'cache_dir': self.cache_dir,
+                'files': len(self._files),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'renders': self.renders,
+                'evictions': self.evictions,
+                'placeholders': len(self._placeholders),
+            }
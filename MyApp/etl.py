@@ -0,0 +1,293 @@
+"""Incremental, parallel preprocessing of the training images.
+
+The loop from `ETL_Pipeline (1).ipynb` as a module: every image in
+training_images/<class>/ is decoded, resized to 224x224, normalized and
+written as a PNG to processed_training/<class>/, and metadata.csv gets the
+row the notebook loaded into mri_scans (paths, label, sizes, mean/std);
+`flask --app app load-scans` streams it into the database (scan_loader.py).
+
+Images are processed in a process pool sized to the cores. manifest.json
+records each source file's size, mtime and SHA-256 next to its outputs. A
+re-run stats every file and skips the ones whose size and mtime are
+unchanged; the rest are hashed, and only new or changed content is decoded
+again (a file that was merely touched is not). Outputs of deleted sources
+are removed. The manifest is checkpointed while the pool runs, so an
+interrupted run resumes where it stopped.
+
+Usage:
+    python etl.py
+    python etl.py --source training_images --output processed_training --workers 8
+    python etl.py --force        # rebuild everything
+"""
+import argparse
+import csv
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SOURCE = os.path.join(HERE, 'training_images')
+DEFAULT_OUTPUT = os.path.join(HERE, 'processed_training')
+IMG_SIZE = (224, 224)
+SUPPORTED_EXT = ('.jpg', '.png', '.jpeg', '.bmp', '.tif', '.tiff')
+MANIFEST_VERSION = 1
+METADATA_FIELDS = ('original_path', 'processed_path', 'label', 'orig_width', 'orig_height', 'proc_width',
+                   'proc_height', 'mean_pixel', 'std_pixel', 'ingest_timestamp', 'source_key', 'content_sha256')
+WORKER_STAGES = ('read_hash', 'decode', 'resize_normalize', 'encode_write')
+
+
+def _write_json_atomic(path, data):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def load_manifest(output_dir):
+    """{relative source path: entry} from output_dir/manifest.json; empty if missing or built for another size."""
+    try:
+        with open(os.path.join(output_dir, 'manifest.json')) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get('version') != MANIFEST_VERSION or manifest.get('image_size') != list(IMG_SIZE):
+        return {}
+    return manifest.get('files', {})
+
+
+def save_manifest(output_dir, files):
+    _write_json_atomic(os.path.join(output_dir, 'manifest.json'), {
+        'version': MANIFEST_VERSION,
+        'image_size': list(IMG_SIZE),
+        'updated_on': datetime.utcnow().isoformat(),
+        'files': files,
+    })
+
+
+def scan_sources(source_dir):
+    """[(relative path, label, size, mtime_ns)] for every supported image in the class directories."""
+    found = []
+    for label in sorted(os.listdir(source_dir)):
+        class_dir = os.path.join(source_dir, label)
+        if not os.path.isdir(class_dir):
+            continue
+        with os.scandir(class_dir) as entries:
+            for entry in entries:
+                if entry.is_file() and os.path.splitext(entry.name)[1].lower() in SUPPORTED_EXT:
+                    st = entry.stat()
+                    found.append((f'{label}/{entry.name}', label, st.st_size, st.st_mtime_ns))
+    found.sort()
+    return found
+
+
+def output_names(sources):
+    """{relative source path: relative PNG path}; `a.jpg` and `a.png` in one class keep their extension apart."""
+    names = {rel: os.path.splitext(rel)[0] + '.png' for rel, *_ in sources}
+    counts = {}
+    for name in names.values():
+        counts[name] = counts.get(name, 0) + 1
+    return {rel: (name if counts[name] == 1 else rel.replace('.', '_') + '.png') for rel, name in names.items()}
+
+
+def process_image_worker(job):
+    """Process-pool entry point: hash one source image and, unless its content is known, preprocess it.
+
+    job = (relative path, source path, output path, known sha256 or None).
+    Returns (relative path, status, result dict or None, stage timings, error or None)
+    with status 'processed', 'unchanged' or 'failed'.
+    """
+    rel_path, src_path, out_path, known_sha256 = job
+    timings = dict.fromkeys(WORKER_STAGES, 0.0)
+    t0 = time.perf_counter()
+    try:
+        with open(src_path, 'rb') as f:
+            data = f.read()
+        sha256 = hashlib.sha256(data).hexdigest()
+        t1 = time.perf_counter()
+        timings['read_hash'] = t1 - t0
+        if sha256 == known_sha256 and os.path.exists(out_path):
+            return rel_path, 'unchanged', {'sha256': sha256}, timings, None
+
+        # imdecode avoids Unicode path issues
+        img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            raise ValueError('not a readable image')
+        t2 = time.perf_counter()
+        timings['decode'] = t2 - t1
+
+        orig_h, orig_w = img.shape[:2]
+        resized = cv2.resize(img, IMG_SIZE)
+        norm = resized.astype('float32') / 255.0
+        mean_pixel, std_pixel = float(norm.mean()), float(norm.std())
+        t3 = time.perf_counter()
+        timings['resize_normalize'] = t3 - t2
+
+        ok, encoded = cv2.imencode('.png', (norm * 255).astype('uint8'))
+        if not ok:
+            raise ValueError('PNG encoding failed')
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        tmp = out_path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(encoded.tobytes())
+        os.replace(tmp, out_path)
+        timings['encode_write'] = time.perf_counter() - t3
+
+        return rel_path, 'processed', {
+            'sha256': sha256,
+            'orig_width': orig_w,
+            'orig_height': orig_h,
+            'mean_pixel': mean_pixel,
+            'std_pixel': std_pixel,
+        }, timings, None
+    except Exception as e:
+        return rel_path, 'failed', None, timings, str(e)
+
+
+def write_metadata(output_dir, source_dir, files):
+    """metadata.csv with the notebook's columns plus the keys scan_loader upserts on, one row per image."""
+    tmp = os.path.join(output_dir, 'metadata.csv.tmp')
+    with open(tmp, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(METADATA_FIELDS)
+        for rel_path in sorted(files):
+            entry = files[rel_path]
+            writer.writerow([os.path.join(source_dir, rel_path), os.path.join(output_dir, entry['output']),
+                             entry['label'], entry['orig_width'], entry['orig_height'], IMG_SIZE[0], IMG_SIZE[1],
+                             entry['mean_pixel'], entry['std_pixel'], entry['ingest_timestamp'], rel_path,
+                             entry['sha256']])
+    os.replace(tmp, os.path.join(output_dir, 'metadata.csv'))
+
+
+def run(source_dir=DEFAULT_SOURCE, output_dir=DEFAULT_OUTPUT, workers=None, force=False,
+        checkpoint_every=500, progress=None):
+    """Bring output_dir up to date with source_dir; returns counts, per-stage seconds and images/sec.
+
+    Worker stage times are summed over all workers (CPU-seconds), so with N
+    workers they can add up to about N times the pool's wall time.
+    """
+    started = time.perf_counter()
+    os.makedirs(output_dir, exist_ok=True)
+    stages = dict.fromkeys(('scan',) + WORKER_STAGES + ('pool', 'manifest'), 0.0)
+
+    files = {} if force else load_manifest(output_dir)
+    sources = scan_sources(source_dir)
+    names = output_names(sources)
+    present = {rel for rel, *_ in sources}
+
+    # drop sources that disappeared, and their outputs
+    removed = [rel for rel in files if rel not in present]
+    for rel in removed:
+        out_path = os.path.join(output_dir, files.pop(rel)['output'])
+        if os.path.exists(out_path):
+            os.remove(out_path)
+
+    jobs = []
+    stat_of = {}
+    for rel, label, size, mtime_ns in sources:
+        entry = files.get(rel)
+        out_path = os.path.join(output_dir, names[rel])
+        if (entry and entry['size'] == size and entry['mtime_ns'] == mtime_ns and entry['output'] == names[rel]
+                and os.path.exists(out_path)):
+            continue
+        stat_of[rel] = (label, size, mtime_ns)
+        known = entry['sha256'] if entry and entry['output'] == names[rel] else None
+        if entry and entry['output'] != names[rel] and os.path.exists(os.path.join(output_dir, entry['output'])):
+            os.remove(os.path.join(output_dir, entry['output']))
+        jobs.append((rel, os.path.join(source_dir, rel), out_path, known))
+    stages['scan'] = time.perf_counter() - started
+
+    counts = {'processed': 0, 'touched': 0, 'failed': 0}
+    errors = []
+    pool_started = time.perf_counter()
+    workers = max(1, min(workers or os.cpu_count() or 1, len(jobs) or 1))
+    if jobs:
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        try:
+            chunksize = max(1, min(32, len(jobs) // (workers * 4)))
+            for done, (rel, status, result, timings, error) in enumerate(
+                    pool.map(process_image_worker, jobs, chunksize=chunksize), 1):
+                for stage, seconds in timings.items():
+                    stages[stage] += seconds
+                if status == 'failed':
+                    counts['failed'] += 1
+                    errors.append({'file': rel, 'error': error})
+                    files.pop(rel, None)
+                else:
+                    label, size, mtime_ns = stat_of[rel]
+                    if status == 'unchanged':
+                        counts['touched'] += 1
+                        files[rel].update(size=size, mtime_ns=mtime_ns)
+                    else:
+                        counts['processed'] += 1
+                        files[rel] = dict(result, label=label, size=size, mtime_ns=mtime_ns, output=names[rel],
+                                          ingest_timestamp=datetime.utcnow().isoformat())
+                if checkpoint_every and done % checkpoint_every == 0:
+                    t = time.perf_counter()
+                    save_manifest(output_dir, files)
+                    stages['manifest'] += time.perf_counter() - t
+                if progress:
+                    progress(done, len(jobs), time.perf_counter() - pool_started)
+        finally:
+            pool.shutdown()
+    stages['pool'] = time.perf_counter() - pool_started
+
+    t = time.perf_counter()
+    save_manifest(output_dir, files)
+    write_metadata(output_dir, source_dir, files)
+    stages['manifest'] += time.perf_counter() - t
+
+    elapsed = time.perf_counter() - started
+    return {
+        'scanned': len(sources),
+        'unchanged': len(sources) - len(jobs) + counts['touched'],
+        'touched': counts['touched'],
+        'processed': counts['processed'],
+        'failed': counts['failed'],
+        'removed': len(removed),
+        'errors': errors,
+        'workers': workers,
+        'stage_seconds': {stage: round(seconds, 3) for stage, seconds in stages.items()},
+        'seconds': round(elapsed, 3),
+        'images_per_sec': round(counts['processed'] / stages['pool'], 1) if counts['processed'] else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--source', default=DEFAULT_SOURCE, help='class-per-directory image root')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help='processed PNGs, manifest.json and metadata.csv')
+    parser.add_argument('--workers', type=int, default=None, help='processes (default: one per core)')
+    parser.add_argument('--force', action='store_true', help='ignore the manifest and rebuild everything')
+    parser.add_argument('--checkpoint-every', type=int, default=500, help='images between manifest checkpoints')
+    parser.add_argument('--report', default=None, help='write the summary to this JSON file')
+    args = parser.parse_args()
+
+    def progress(done, total, elapsed):
+        if done == total or done % 500 == 0:
+            print(f"  {done}/{total} images ({done / elapsed if elapsed > 0 else 0.0:.1f} images/sec)")
+
+    summary = run(args.source, args.output, workers=args.workers, force=args.force,
+                  checkpoint_every=args.checkpoint_every, progress=progress)
+
+    print(f"✓ {summary['scanned']} images: {summary['processed']} processed, {summary['unchanged']} unchanged "
+          f"({summary['touched']} re-hashed), {summary['removed']} removed, {summary['failed']} failed "
+          f"in {summary['seconds']:.1f}s ({summary['images_per_sec'] or 0:.1f} images/sec, {summary['workers']} workers)")
+    for stage, seconds in summary['stage_seconds'].items():
+        print(f"     {stage:<17}{seconds:8.3f}s")
+    for err in summary['errors'][:20]:
+        print(f"⚠️  {err['file']}: {err['error']}")
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(summary, f, indent=2)
+        print(f"Report written to {args.report}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+"""Export the tumor model to quantized TFLite builds and gate their promotion.
+
+Converts models/optimized_best.h5 into float16, dynamic-range and int8 TFLite
+files (int8 calibrated on images drawn from training_images), then compares
+each build against the Keras reference on a held-out sample: per-class
+accuracy, agreement with the reference, p50/p99 single-image latency and
+resident memory with the interpreters for every batch size the app serves
+allocated. The report (models/export_report.json) marks which builds
+stay within the accuracy budget; the app refuses to serve a build that
+doesn't (see MODEL_BACKEND in app.py).
+
+Usage:
+    python export_model.py
+    python export_model.py --backends tflite_int8 --max-accuracy-drop 0.005
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import resource
+import time
+from datetime import datetime
+
+import numpy as np
+
+from preprocessing import decode_for_model, preprocess_batch
+from tflite_backend import TFLITE_BACKENDS, TFLiteModel, backend_path
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_MODEL = os.path.join(HERE, 'models', 'optimized_best.h5')
+DEFAULT_IMAGES = os.path.join(HERE, 'training_images')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def rss_mb():
+    """Current resident set size in MB (peak RSS where /proc is unavailable)."""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2 ** 20 if peak > 2 ** 32 else peak / 1024  # bytes on macOS, KB on Linux
+
+
+def sample_images(image_dir, per_class, seed, exclude=()):
+    """Pick up to `per_class` images from each class directory -> ([(path, class_idx)], classes)."""
+    classes = sorted(d for d in os.listdir(image_dir) if os.path.isdir(os.path.join(image_dir, d)))
+    rng = random.Random(seed)
+    exclude = set(exclude)
+    picked = []
+    for idx, name in enumerate(classes):
+        class_dir = os.path.join(image_dir, name)
+        files = sorted(os.path.join(class_dir, f) for f in os.listdir(class_dir)
+                       if f.lower().endswith(IMAGE_EXTENSIONS))
+        files = [f for f in files if f not in exclude]
+        rng.shuffle(files)
+        picked.extend((path, idx) for path in files[:per_class])
+    return picked, classes
+
+
+def load_batch(paths):
+    return preprocess_batch([decode_for_model(p)[0] for p in paths])
+
+
+def convert(keras_model, backend, calibration_paths):
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(keras_model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if backend == 'tflite_fp16':
+        converter.target_spec.supported_types = [tf.float16]
+    elif backend == 'tflite_int8':
+        def representative_dataset():
+            for path in calibration_paths:
+                yield [load_batch([path])]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    # tflite_dynamic: DEFAULT optimizations alone quantize weights to int8
+    return converter.convert()
+
+
+def evaluate(model, eval_set, batch_size):
+    """Return (predicted class indices, single-image latencies in ms)."""
+    predicted = []
+    for i in range(0, len(eval_set), batch_size):
+        batch = load_batch([p for p, _ in eval_set[i:i + batch_size]])
+        predicted.extend(np.argmax(model.predict(batch, verbose=0), axis=1).tolist())
+
+    latencies = []
+    sample = load_batch([eval_set[0][0]])
+    model.predict(sample, verbose=0)  # exclude first-call setup from the timings
+    for path, _ in eval_set[:min(len(eval_set), 100)]:
+        one = load_batch([path])
+        t0 = time.perf_counter()
+        model.predict(one, verbose=0)
+        latencies.append((time.perf_counter() - t0) * 1000.0)
+    return np.array(predicted), np.array(latencies)
+
+
+def summarize(predicted, labels, classes, latencies, rss_delta, reference=None):
+    result = {
+        'accuracy': float(np.mean(predicted == labels)),
+        'per_class_accuracy': {
+            name: float(np.mean(predicted[labels == idx] == idx)) if np.any(labels == idx) else None
+            for idx, name in enumerate(classes)
+        },
+        'latency_ms': {
+            'p50': float(np.percentile(latencies, 50)),
+            'p99': float(np.percentile(latencies, 99)),
+        },
+        'rss_delta_mb': rss_delta,
+    }
+    if reference is not None:
+        result['agreement'] = float(np.mean(predicted == reference))
+    return result
+
+
+def within_budget(metrics, reference, args):
+    reasons = []
+    drop = reference['accuracy'] - metrics['accuracy']
+    if drop > args.max_accuracy_drop:
+        reasons.append(f"accuracy drop {drop:.4f} > {args.max_accuracy_drop}")
+    for name, ref_acc in reference['per_class_accuracy'].items():
+        acc = metrics['per_class_accuracy'][name]
+        if ref_acc is not None and acc is not None and ref_acc - acc > args.max_class_drop:
+            reasons.append(f"{name} accuracy drop {ref_acc - acc:.4f} > {args.max_class_drop}")
+    if metrics['agreement'] < args.min_agreement:
+        reasons.append(f"agreement {metrics['agreement']:.4f} < {args.min_agreement}")
+    return not reasons, reasons
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--model', default=DEFAULT_MODEL, help='Keras reference model (.h5)')
+    parser.add_argument('--images', default=DEFAULT_IMAGES, help='class-per-directory image root')
+    parser.add_argument('--backends', nargs='+', default=list(TFLITE_BACKENDS), choices=list(TFLITE_BACKENDS))
+    parser.add_argument('--calibration-per-class', type=int, default=50)
+    parser.add_argument('--eval-per-class', type=int, default=100)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--serving-max-batch', type=int,
+                        default=max(int(os.environ.get('PREDICT_MAX_BATCH', 16)),
+                                    int(os.environ.get('BULK_PREDICT_BATCH', 32))),
+                        help='largest batch the app serves (default: max of PREDICT_MAX_BATCH, BULK_PREDICT_BATCH)')
+    parser.add_argument('--max-accuracy-drop', type=float, default=0.01, help='allowed absolute top-1 accuracy drop')
+    parser.add_argument('--max-class-drop', type=float, default=0.03, help='allowed per-class accuracy drop')
+    parser.add_argument('--min-agreement', type=float, default=0.97, help='required agreement with the reference')
+    parser.add_argument('--seed', type=int, default=5110)
+    parser.add_argument('--report', default=None, help='report path (default: models/export_report.json)')
+    args = parser.parse_args()
+
+    from tensorflow.keras.models import load_model
+
+    calibration, classes = sample_images(args.images, args.calibration_per_class, args.seed)
+    eval_set, _ = sample_images(args.images, args.eval_per_class, args.seed + 1,
+                                exclude=[p for p, _ in calibration])
+    labels = np.array([idx for _, idx in eval_set])
+    print(f"Calibration images: {len(calibration)}, evaluation images: {len(eval_set)}")
+
+    base_rss = rss_mb()
+    keras_model = load_model(args.model, compile=False)
+    ref_pred, ref_lat = evaluate(keras_model, eval_set, args.batch_size)
+    reference = summarize(ref_pred, labels, classes, ref_lat, rss_mb() - base_rss)
+    reference['file'] = args.model
+    reference['size_mb'] = os.path.getsize(args.model) / 2 ** 20
+    print(f"✓ keras: accuracy {reference['accuracy']:.4f}, p50 {reference['latency_ms']['p50']:.1f} ms")
+
+    report = {
+        'created_on': datetime.utcnow().isoformat(),
+        'reference_model': args.model,
+        'classes': classes,
+        'eval_images': len(eval_set),
+        'calibration_images': len(calibration),
+        'budget': {
+            'max_accuracy_drop': args.max_accuracy_drop,
+            'max_class_drop': args.max_class_drop,
+            'min_agreement': args.min_agreement,
+        },
+        'backends': {'keras': reference},
+    }
+
+    for backend in args.backends:
+        out_path = backend_path(args.model, backend)
+        t0 = time.perf_counter()
+        with open(out_path, 'wb') as f:
+            f.write(convert(keras_model, backend, [p for p, _ in calibration]))
+        convert_seconds = time.perf_counter() - t0
+
+        gc.collect()
+        before = rss_mb()
+        # same buckets as serving, all allocated, so the memory figure is what the app will hold
+        model = TFLiteModel(out_path, num_threads=os.cpu_count(), max_batch=args.serving_max_batch)
+        model.warm_up()
+        pred, lat = evaluate(model, eval_set, args.batch_size)
+        metrics = summarize(pred, labels, classes, lat, rss_mb() - before, reference=ref_pred)
+        metrics['batch_buckets'] = model.buckets
+        del model
+
+        metrics['file'] = out_path
+        metrics['size_mb'] = os.path.getsize(out_path) / 2 ** 20
+        metrics['convert_seconds'] = convert_seconds
+        metrics['within_budget'], metrics['budget_violations'] = within_budget(metrics, reference, args)
+        report['backends'][backend] = metrics
+
+        mark = '✓' if metrics['within_budget'] else '⚠️ '
+        print(f"{mark} {backend}: accuracy {metrics['accuracy']:.4f}, agreement {metrics['agreement']:.4f}, "
+              f"p50 {metrics['latency_ms']['p50']:.1f} ms, p99 {metrics['latency_ms']['p99']:.1f} ms, "
+              f"{metrics['size_mb']:.1f} MB")
+        for reason in metrics['budget_violations']:
+            print(f"     {reason}")
+
+    report_path = args.report or os.path.join(os.path.dirname(args.model), 'export_report.json')
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {report_path}")
+
+
+if __name__ == '__main__':
+    main()
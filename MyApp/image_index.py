@@ -0,0 +1,97 @@
+"""Basename -> path index over the training image directories.
+
+Stored scan paths are often Colab paths that don't exist locally, so images are
+matched by file name under `training_images/<tumor>/`. The index is built once
+(lazily, on first lookup), lookups are a dict access, and it stays current by
+re-checking directory mtimes at most every `check_interval` seconds; adding or
+removing a file changes its directory's mtime and triggers a rebuild.
+"""
+import os
+import threading
+import time
+
+
+class ImageIndex:
+    def __init__(self, roots, check_interval=5.0):
+        self.roots = list(roots)
+        self.check_interval = check_interval
+        self._paths = None          # lower-cased basename -> path
+        self._dir_mtimes = {}
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+        self.builds = 0
+        self.build_seconds = None
+        self.built_at = None
+        self.hits = 0
+        self.misses = 0
+
+    def _build(self):
+        started = time.perf_counter()
+        paths = {}
+        mtimes = {}
+        for root in self.roots:
+            if not os.path.isdir(root):
+                continue
+            for dp, dn, files in os.walk(root):
+                mtimes[dp] = os.stat(dp).st_mtime_ns
+                for fname in files:
+                    # first match wins, like the directory walk it replaces
+                    paths.setdefault(fname.lower(), os.path.join(dp, fname))
+        self._paths = paths
+        self._dir_mtimes = mtimes
+        self._last_check = time.monotonic()
+        self.builds += 1
+        self.build_seconds = time.perf_counter() - started
+        self.built_at = time.time()
+
+    def _stale(self):
+        for root in self.roots:
+            if os.path.isdir(root) and root not in self._dir_mtimes:
+                return True
+        for dp, mtime in self._dir_mtimes.items():
+            try:
+                if os.stat(dp).st_mtime_ns != mtime:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    def _ensure_current(self):
+        with self._lock:
+            if self._paths is None:
+                self._build()
+            elif time.monotonic() - self._last_check >= self.check_interval:
+                self._last_check = time.monotonic()
+                if self._stale():
+                    self._build()
+
+    def refresh(self):
+        """Rebuild the index now."""
+        with self._lock:
+            self._build()
+
+    def lookup(self, *names):
+        """Return the indexed path of the first basename found, or None."""
+        self._ensure_current()
+        paths = self._paths
+        for name in names:
+            if not name:
+                continue
+            path = paths.get(os.path.basename(name).lower())
+            if path is not None:
+                self.hits += 1
+                return path
+        self.misses += 1
+        return None
+
+    def stats(self):
+        return {
+            'roots': self.roots,
+            'files': len(self._paths) if self._paths is not None else None,
+            'directories': len(self._dir_mtimes),
+            'builds': self.builds,
+            'build_seconds': self.build_seconds,
+            'built_at': self.built_at,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
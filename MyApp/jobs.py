@@ -0,0 +1,123 @@
+"""Bounded, prioritized job queue for asynchronous predictions.
+
+Submitting a job returns its id immediately; a small pool of worker threads
+runs the jobs so Flask request threads stay free for pages and images.
+When `max_pending` jobs are already waiting, `submit` raises `QueueFull`
+and the caller should answer 429.
+"""
+import itertools
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+PRIORITIES = {'interactive': 0, 'backfill': 10}
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobQueue:
+    """Runs `handler(kind, payload)` for each job on `workers` background threads."""
+
+    def __init__(self, handler, workers=2, max_pending=64, keep_finished=1000):
+        self.handler = handler
+        self.workers = max(1, int(workers))
+        self.max_pending = max(1, int(max_pending))
+        self.keep_finished = keep_finished
+        self._queue = queue.PriorityQueue()
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+        self._threads = []
+        self._pending = 0
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._run, name=f'inference-worker-{i}', daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def submit(self, kind, payload, priority='interactive'):
+        """Queue a job and return its id; raises QueueFull when the queue is at capacity."""
+        if priority not in PRIORITIES:
+            raise ValueError(f"unknown priority {priority!r}")
+        self.start()
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                raise QueueFull(f"prediction queue is full ({self.max_pending} jobs waiting)")
+            self._pending += 1
+            self.submitted += 1
+            self._jobs[job_id] = {
+                'job_id': job_id,
+                'kind': kind,
+                'priority': priority,
+                'status': 'queued',
+                'submitted_at': time.time(),
+                'started_at': None,
+                'finished_at': None,
+                'result': None,
+                'error': None,
+            }
+            self._trim()
+        self._queue.put((PRIORITIES[priority], next(self._seq), job_id, payload))
+        return job_id
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def _run(self):
+        while True:
+            _, _, job_id, payload = self._queue.get()
+            with self._lock:
+                self._pending -= 1
+                job = self._jobs.get(job_id)
+                if job is None:
+                    continue
+                job['status'] = 'running'
+                job['started_at'] = time.time()
+                kind = job['kind']
+
+            try:
+                result = self.handler(kind, payload)
+                with self._lock:
+                    job.update(status='done', result=result, finished_at=time.time())
+                    self.completed += 1
+            except Exception as e:
+                with self._lock:
+                    job.update(status='failed', error=str(e), finished_at=time.time())
+                    self.failed += 1
+
+    def _trim(self):
+        # drop the oldest finished jobs once we hold too many results
+        excess = len(self._jobs) - self.keep_finished
+        if excess <= 0:
+            return
+        for job_id in [j for j, job in self._jobs.items() if job['status'] in ('done', 'failed')][:excess]:
+            del self._jobs[job_id]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'pending': self._pending,
+                'running': sum(1 for job in self._jobs.values() if job['status'] == 'running'),
+                'submitted': self.submitted,
+                'rejected': self.rejected,
+                'completed': self.completed,
+                'failed': self.failed,
+            }
@@ -0,0 +1,368 @@
+"""Versioned schema migrations for brain_etl.db.
+
+Each migration is a (version, name, function) entry in MIGRATIONS, applied in
+order at startup and recorded in `schema_migrations`. Every migration runs in
+its own `BEGIN IMMEDIATE` transaction and the applied version is re-read after
+the write lock is taken, so several processes starting at once (gunicorn
+workers, a CLI next to the server) apply each migration exactly once. SQLite
+DDL is transactional: a failing migration leaves no partial schema behind.
+
+Migrations must only move forward; add a new entry instead of editing one that
+has shipped.
+"""
+import time
+from datetime import datetime
+
+
+def _has_table(conn, name):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone() is not None
+
+
+def _prediction_cache_keys(conn):
+    # cache key of prediction_cache.py: hash of the decoded pixels + model weights version
+    if not _has_table(conn, 'tumor_classification'):
+        return
+    cols = {row[1] for row in conn.execute('PRAGMA table_info(tumor_classification)')}
+    if 'image_sha256' not in cols:
+        conn.execute('ALTER TABLE tumor_classification ADD COLUMN image_sha256 TEXT')
+    if 'model_version' not in cols:
+        conn.execute('ALTER TABLE tumor_classification ADD COLUMN model_version TEXT')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_tumor_classification_image '
+                 'ON tumor_classification (image_sha256, model_version)')
+
+
+def _hot_query_indexes(conn):
+    if _has_table(conn, 'mri_scans'):
+        # /patient_records, /find_scans_by_patient, delete_scans_by_patient, legacy /patient_login:
+        # equality on patient_id, newest scan first without a sort step
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_mri_scans_patient_date ON mri_scans (patient_id, scan_date DESC)')
+        # dashboard GROUP BYs and the unlabeled-scan backfill are answered from the index alone
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_mri_scans_label ON mri_scans (label)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_mri_scans_hospital_unit ON mri_scans (hospital_unit)')
+    if _has_table(conn, 'tumor_classification'):
+        # DELETE ... WHERE processed_path IN (...) when a patient's scans are removed
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_tumor_classification_processed_path '
+                     'ON tumor_classification (processed_path)')
+    if _has_table(conn, 'users'):
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_users_patient_id ON users (patient_id)')
+
+
+# Legacy row shape of mri_scans (pandas to_sql column order), kept by the compatibility view
+MRI_SCANS_COLUMNS = ['original_path', 'processed_path', 'label', 'orig_width', 'orig_height', 'proc_width',
+                     'proc_height', 'mean_pixel', 'std_pixel', 'ingest_timestamp', 'patient_id', 'age', 'gender',
+                     'hospital_unit', 'scan_date']
+
+
+def _normalize_patients_and_scans(conn):
+    """Split mri_scans into patients + scans and key tumor_classification on scan_id.
+
+    Scan ids are the old rowids, so /image/<id> links and cached tensors stay
+    valid, and AUTOINCREMENT keeps a deleted scan's id from being reused. Age
+    and gender stay on the scan, as recorded with it (patients in the legacy
+    table do not always have the same gender on every scan); patients.gender
+    is derived, the latest non-empty value written for the patient.
+    `mri_scans` becomes a view with the old columns plus scan_id, so ad-hoc
+    SELECTs keep working, and an INSTEAD OF INSERT trigger routes legacy
+    inserts into the new tables.
+    """
+    conn.execute('''
+        CREATE TABLE patients (
+            patient_id INTEGER PRIMARY KEY,
+            gender TEXT,
+            created_on TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE scans (
+            scan_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            patient_id INTEGER REFERENCES patients (patient_id) ON DELETE CASCADE,
+            original_path TEXT,
+            processed_path TEXT,
+            label TEXT,
+            orig_width INTEGER,
+            orig_height INTEGER,
+            proc_width INTEGER,
+            proc_height INTEGER,
+            mean_pixel REAL,
+            std_pixel REAL,
+            age INTEGER,
+            gender TEXT,
+            hospital_unit TEXT,
+            scan_date TEXT,
+            ingest_timestamp TEXT
+        )
+    ''')
+
+    legacy = _has_table(conn, 'mri_scans')
+    if legacy:
+        # patients.gender: the latest scan's non-empty value
+        conn.execute('''
+            INSERT INTO patients (patient_id, gender, created_on)
+            SELECT patient_id, gender, first_ingest FROM (
+                SELECT patient_id, gender,
+                       MIN(ingest_timestamp) OVER (PARTITION BY patient_id) AS first_ingest,
+                       ROW_NUMBER() OVER (PARTITION BY patient_id
+                                          ORDER BY gender IS NULL, scan_date DESC, rowid DESC) AS rn
+                FROM mri_scans WHERE patient_id IS NOT NULL
+            ) WHERE rn = 1
+        ''')
+        conn.execute('''
+            INSERT INTO scans (scan_id, patient_id, original_path, processed_path, label, orig_width, orig_height,
+                               proc_width, proc_height, mean_pixel, std_pixel, age, gender, hospital_unit, scan_date,
+                               ingest_timestamp)
+            SELECT rowid, patient_id, original_path, processed_path, label, orig_width, orig_height,
+                   proc_width, proc_height, mean_pixel, std_pixel, age, gender, hospital_unit, scan_date, ingest_timestamp
+            FROM mri_scans ORDER BY rowid
+        ''')
+        conn.execute('DROP TABLE mri_scans')
+
+    conn.execute('CREATE INDEX idx_scans_patient_date ON scans (patient_id, scan_date DESC)')
+    conn.execute('CREATE INDEX idx_scans_label ON scans (label)')
+    conn.execute('CREATE INDEX idx_scans_hospital_unit ON scans (hospital_unit)')
+    conn.execute('CREATE INDEX idx_scans_processed_path ON scans (processed_path)')
+
+    if _has_table(conn, 'tumor_classification'):
+        conn.execute('ALTER TABLE tumor_classification ADD COLUMN scan_id INTEGER '
+                     'REFERENCES scans (scan_id) ON DELETE CASCADE')
+        # history rows only knew their scan by path; rows for scans deleted earlier stay NULL
+        conn.execute('''
+            UPDATE tumor_classification SET scan_id = (
+                SELECT MAX(s.scan_id) FROM scans s WHERE s.processed_path = tumor_classification.processed_path)
+        ''')
+        conn.execute('DROP INDEX IF EXISTS idx_tumor_classification_processed_path')
+    else:
+        conn.execute('''
+            CREATE TABLE tumor_classification (
+                classification_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                scan_id INTEGER REFERENCES scans (scan_id) ON DELETE CASCADE,
+                processed_path TEXT,
+                predicted_label TEXT,
+                confidence FLOAT,
+                model_name TEXT,
+                classified_on TEXT,
+                image_sha256 TEXT,
+                model_version TEXT
+            )
+        ''')
+        conn.execute('CREATE INDEX idx_tumor_classification_image ON tumor_classification (image_sha256, model_version)')
+    conn.execute('CREATE INDEX idx_tumor_classification_scan ON tumor_classification (scan_id, classification_id)')
+
+    conn.execute('''
+        CREATE VIEW mri_scans AS
+        SELECT s.original_path, s.processed_path, s.label, s.orig_width, s.orig_height, s.proc_width, s.proc_height,
+               s.mean_pixel, s.std_pixel, s.ingest_timestamp, s.patient_id, s.age, s.gender,
+               s.hospital_unit, s.scan_date, s.scan_id
+        FROM scans s
+    ''')
+    conn.execute('''
+        CREATE TRIGGER mri_scans_insert INSTEAD OF INSERT ON mri_scans
+        BEGIN
+            INSERT INTO patients (patient_id, gender, created_on)
+            SELECT NEW.patient_id, NEW.gender, COALESCE(NEW.ingest_timestamp, STRFTIME('%Y-%m-%dT%H:%M:%f', 'now'))
+            WHERE NEW.patient_id IS NOT NULL
+            ON CONFLICT (patient_id) DO UPDATE SET gender = COALESCE(excluded.gender, patients.gender);
+            INSERT INTO scans (scan_id, patient_id, original_path, processed_path, label, orig_width, orig_height,
+                               proc_width, proc_height, mean_pixel, std_pixel, age, gender, hospital_unit, scan_date,
+                               ingest_timestamp)
+            VALUES (NEW.scan_id, NEW.patient_id, NEW.original_path, NEW.processed_path, NEW.label, NEW.orig_width,
+                    NEW.orig_height, NEW.proc_width, NEW.proc_height, NEW.mean_pixel, NEW.std_pixel, NEW.age,
+                    NEW.gender, NEW.hospital_unit, NEW.scan_date, NEW.ingest_timestamp);
+        END
+    ''')
+
+
+# scan_stats dimension -> bucket expression over a scans row ({r} is NEW, OLD or the table),
+# as dashboard_stats.DIMENSIONS stood when migration 4 shipped
+_SCAN_STATS_DIMENSIONS = {
+    'all': "''",
+    'age': "COALESCE(CAST({r}.age AS TEXT), '')",
+    'hospital_unit': "COALESCE({r}.hospital_unit, '')",
+    'gender': "COALESCE({r}.gender, '')",
+    'week': "COALESCE(STRFTIME('%Y-%W', {r}.scan_date), '')",
+}
+
+
+def _scan_stats_bump(r, sign):
+    return '\n'.join(
+        f"INSERT INTO scan_stats (dimension, bucket, label, scans, area_sum, area_count) "
+        f"VALUES ('{dim}', {expr.format(r=r)}, COALESCE({r}.label, ''), {sign}, "
+        f"{sign} * COALESCE({r}.orig_width * {r}.orig_height, 0), "
+        f"{sign} * ({r}.orig_width * {r}.orig_height IS NOT NULL)) "
+        f"ON CONFLICT (dimension, bucket, label) DO UPDATE SET scans = scans + excluded.scans, "
+        f"area_sum = area_sum + excluded.area_sum, area_count = area_count + excluded.area_count;"
+        for dim, expr in _SCAN_STATS_DIMENSIONS.items())
+
+
+def _dashboard_stats(conn):
+    """scan_stats, kept current by triggers on scans (read by dashboard_stats.py), filled from scans.
+
+    The table, trigger bodies and initial fill are a frozen copy, so editing
+    dashboard_stats.py later cannot change what this migration builds.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS scan_stats (
+            dimension TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            label TEXT NOT NULL,
+            scans INTEGER NOT NULL,
+            area_sum REAL NOT NULL,
+            area_count INTEGER NOT NULL,
+            PRIMARY KEY (dimension, bucket, label)
+        ) WITHOUT ROWID
+    ''')
+    for name in ('scans_stats_insert', 'scans_stats_delete', 'scans_stats_update'):
+        conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+    conn.execute(f'CREATE TRIGGER scans_stats_insert AFTER INSERT ON scans BEGIN\n{_scan_stats_bump("NEW", 1)}\nEND')
+    conn.execute(f'CREATE TRIGGER scans_stats_delete AFTER DELETE ON scans BEGIN\n{_scan_stats_bump("OLD", -1)}\nEND')
+    conn.execute(f'''CREATE TRIGGER scans_stats_update
+        AFTER UPDATE OF label, age, gender, hospital_unit, scan_date, patient_id, orig_width, orig_height ON scans
+        BEGIN
+        {_scan_stats_bump("OLD", -1)}
+        {_scan_stats_bump("NEW", 1)}
+        END''')
+    conn.execute('DELETE FROM scan_stats')
+    for dim, expr in _SCAN_STATS_DIMENSIONS.items():
+        conn.execute(f"INSERT INTO scan_stats (dimension, bucket, label, scans, area_sum, area_count) "
+                     f"SELECT '{dim}', {expr.format(r='s')}, COALESCE(s.label, ''), COUNT(*), "
+                     f"TOTAL(s.orig_width * s.orig_height), COUNT(s.orig_width * s.orig_height) "
+                     f"FROM scans s GROUP BY 2, 3")
+
+
+def _pending_credentials_index(conn):
+    if _has_table(conn, 'users'):
+        # patient accounts whose password hash is still to be generated (iterations = 0)
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_users_pending_credentials ON users (username) WHERE iterations = 0')
+
+
+def _scan_source_keys(conn):
+    """Key scans loaded from the training image set so reloads update rows instead of replacing the table.
+
+    source_key is the image's path below the image root (`<class>/<file>`),
+    content_sha256 the SHA-256 of its bytes (see scan_loader.py). Rows loaded
+    by the notebook get their key back from original_path; their hash stays
+    NULL until the next load fills it in. load_checkpoints records how far an
+    interrupted load got.
+    """
+    conn.execute('ALTER TABLE scans ADD COLUMN source_key TEXT')
+    conn.execute('ALTER TABLE scans ADD COLUMN content_sha256 TEXT')
+    conn.execute('''
+        UPDATE scans SET source_key = SUBSTR(REPLACE(original_path, '\\', '/'),
+                                             INSTR(REPLACE(original_path, '\\', '/'), 'training_images/') + 16)
+        WHERE scan_id IN (SELECT MIN(scan_id) FROM scans
+                          WHERE REPLACE(original_path, '\\', '/') LIKE '%training_images/%'
+                          GROUP BY REPLACE(original_path, '\\', '/'))
+    ''')
+    conn.execute('CREATE UNIQUE INDEX idx_scans_source_key ON scans (source_key) WHERE source_key IS NOT NULL')
+    conn.execute('''
+        CREATE TABLE load_checkpoints (
+            source TEXT PRIMARY KEY,
+            fingerprint TEXT NOT NULL,
+            records_done INTEGER NOT NULL,
+            updated_on TEXT NOT NULL
+        )
+    ''')
+
+
+def _perceptual_hashes(conn):
+    """Perceptual hashes per scan for near-duplicate lookups (see perceptual_hash.py).
+
+    Both are 64-bit hashes stored as signed integers and written together;
+    existing rows stay NULL until `flask --app app hash-scans` fills them in.
+    The partial index keeps counting and listing hashed rows off the table.
+    """
+    conn.execute('ALTER TABLE scans ADD COLUMN phash INTEGER')
+    conn.execute('ALTER TABLE scans ADD COLUMN dhash INTEGER')
+    conn.execute('CREATE INDEX idx_scans_phash ON scans (phash, dhash) WHERE phash IS NOT NULL')
+
+
+def _reused_classifications(conn):
+    """Mark predictions copied from a near duplicate instead of produced by the model.
+
+    `source_classification_id` names the row whose prediction was reused; it is
+    NULL for model output, which is what accuracy figures should count.
+    """
+    conn.execute('ALTER TABLE tumor_classification ADD COLUMN source_classification_id INTEGER')
+
+
+MIGRATIONS = [
+    (1, 'prediction cache key columns on tumor_classification', _prediction_cache_keys),
+    (2, 'indexes for patient, label, unit and classification lookups', _hot_query_indexes),
+    (3, 'patients table, scans keyed by scan_id, tumor_classification.scan_id with cascading deletes',
+     _normalize_patients_and_scans),
+    (4, 'scan_stats aggregate table maintained by triggers', _dashboard_stats),
+    (5, 'partial index on users with pending credentials', _pending_credentials_index),
+    (6, 'source and content keys on scans, load_checkpoints table', _scan_source_keys),
+    (7, 'perceptual hash columns on scans', _perceptual_hashes),
+    (8, 'source_classification_id on tumor_classification for reused predictions', _reused_classifications),
+]
+
+
+def _ensure_version_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_on TEXT NOT NULL,
+            duration_ms REAL
+        )
+    ''')
+
+
+def current_version(conn):
+    """Highest applied migration version (0 for a database never migrated)."""
+    if not _has_table(conn, 'schema_migrations'):
+        return 0
+    return conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_migrations').fetchone()[0]
+
+
+def pending(conn):
+    version = current_version(conn)
+    return [(v, name) for v, name, _ in MIGRATIONS if v > version]
+
+
+def migrate(conn, target=None, busy_timeout_ms=30000):
+    """Apply every pending migration up to `target` (default: latest).
+
+    Commits any transaction already open on `conn`. Returns the list of
+    (version, name) applied by this call.
+    """
+    conn.commit()
+    previous_isolation = conn.isolation_level
+    conn.isolation_level = None  # explicit BEGIN/COMMIT below
+    conn.execute(f'PRAGMA busy_timeout = {int(busy_timeout_ms)}')
+    applied = []
+    try:
+        for version, name, fn in MIGRATIONS:
+            if target is not None and version > target:
+                break
+            # cheap check without the write lock; most starts have nothing to do
+            if version <= current_version(conn):
+                continue
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                _ensure_version_table(conn)
+                if version <= current_version(conn):
+                    # another process got here first
+                    conn.execute('COMMIT')
+                    continue
+                started = time.perf_counter()
+                fn(conn)
+                duration_ms = (time.perf_counter() - started) * 1000.0
+                conn.execute('INSERT INTO schema_migrations (version, name, applied_on, duration_ms) VALUES (?, ?, ?, ?)',
+                             (version, name, datetime.utcnow().isoformat(), duration_ms))
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            print(f"✓ Applied migration {version}: {name} ({duration_ms:.0f} ms)")
+            applied.append((version, name))
+    finally:
+        conn.isolation_level = previous_isolation
+    return applied
+
+
+def history(conn):
+    if not _has_table(conn, 'schema_migrations'):
+        return []
+    return conn.execute('SELECT version, name, applied_on, duration_ms FROM schema_migrations ORDER BY version').fetchall()
+
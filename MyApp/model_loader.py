@@ -0,0 +1,101 @@
+"""Background model loading with warm-up and readiness reporting.
+
+Loading TensorFlow and the Keras model takes several seconds, so the app
+starts a `ModelLoader` instead of loading at import time. Routes that need
+the model call `get()`, which waits (up to a timeout) for loading to finish;
+every other route is unaffected.
+"""
+import threading
+import time
+
+
+class ModelLoader:
+    """Loads a model once, off the request path, and reports its state.
+
+    States: idle -> loading -> warming -> ready, or failed / unavailable.
+    """
+
+    def __init__(self, load_fn, warmup_fn=None, warmup_runs=0):
+        self.load_fn = load_fn
+        self.warmup_fn = warmup_fn
+        self.warmup_runs = max(0, int(warmup_runs))
+        self.model = None
+        self.backend = None  # set by load_fn when it knows which runtime it loaded
+        self.state = 'idle'
+        self.error = None
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._started_at = None
+        self._load_seconds = None
+        self._warmup_seconds = None
+
+    def start(self):
+        """Begin loading in a daemon thread (no-op if already started)."""
+        with self._lock:
+            if self.state != 'idle':
+                return
+            self.state = 'loading'
+            self._thread = threading.Thread(target=self._run, name='model-loader', daemon=True)
+            self._thread.start()
+
+    def load(self):
+        """Load synchronously in the calling thread (no-op if already started)."""
+        with self._lock:
+            if self.state != 'idle':
+                return
+            self.state = 'loading'
+        self._run()
+
+    def disable(self, reason):
+        """Mark the model as unavailable (e.g. TensorFlow is not installed)."""
+        with self._lock:
+            self.state = 'unavailable'
+            self.error = reason
+        self._ready.set()
+
+    def _run(self):
+        self._started_at = time.time()
+        try:
+            t0 = time.perf_counter()
+            model = self.load_fn()
+            self._load_seconds = time.perf_counter() - t0
+
+            if self.warmup_fn is not None and self.warmup_runs:
+                self.state = 'warming'
+                t0 = time.perf_counter()
+                for _ in range(self.warmup_runs):
+                    self.warmup_fn(model)
+                self._warmup_seconds = time.perf_counter() - t0
+
+            self.model = model
+            self.state = 'ready'
+            print(f"✓ Model ready (load {self._load_seconds:.2f}s, warm-up {self._warmup_seconds or 0:.2f}s)")
+        except Exception as e:
+            self.error = str(e)
+            self.state = 'failed'
+            print(f"⚠️  Could not load model: {e}")
+        finally:
+            self._ready.set()
+
+    def get(self, timeout=None):
+        """Return the loaded model, waiting up to `timeout` seconds; None if unavailable."""
+        if self.state == 'idle':
+            self.start()
+        self._ready.wait(timeout)
+        return self.model
+
+    @property
+    def ready(self):
+        return self.state == 'ready'
+
+    def status(self):
+        return {
+            'state': self.state,
+            'backend': self.backend,
+            'error': self.error,
+            'started_at': self._started_at,
+            'load_seconds': self._load_seconds,
+            'warmup_runs': self.warmup_runs,
+            'warmup_seconds': self._warmup_seconds,
+        }
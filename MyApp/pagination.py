@@ -0,0 +1,99 @@
+"""Paged and streamed query results.
+
+Page requests return at most `limit` rows plus an opaque `next_cursor` token
+that the client sends back for the following page. Rows are read from the
+sqlite cursor with fetchmany, so only one page (or one stream chunk) is held
+in memory at a time. Streaming responses write rows as they are read:
+
+- ndjson: one JSON object per row per line
+- columnar: one line per chunk, {"column": [values, ...], ...}
+"""
+import base64
+import binascii
+import json
+
+
+class CursorError(ValueError):
+    """The cursor token is malformed or belongs to a different query."""
+
+
+def encode_cursor(state):
+    raw = json.dumps(state, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """Decode a token from encode_cursor; None/'' means the first page."""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(str(token) + '=' * (-len(str(token)) % 4))
+        state = json.loads(raw)
+    except (binascii.Error, ValueError, UnicodeDecodeError):
+        raise CursorError('invalid cursor')
+    if not isinstance(state, dict):
+        raise CursorError('invalid cursor')
+    return state
+
+
+def page_size(value, default, maximum):
+    """Requested page size clamped to [1, maximum]; raises ValueError for non-integers."""
+    if value in (None, ''):
+        return default
+    size = int(value)
+    if size < 1:
+        raise ValueError('limit must be a positive integer')
+    return min(size, maximum)
+
+
+def fetch_page(cursor, limit):
+    """Read up to `limit` rows plus one lookahead row; returns (rows, has_more)."""
+    rows = cursor.fetchmany(limit + 1)
+    return rows[:limit], len(rows) > limit
+
+
+def skip_rows(cursor, count, chunk_rows=1000):
+    """Advance `cursor` past `count` rows without building result objects."""
+    while count > 0:
+        skipped = len(cursor.fetchmany(min(count, chunk_rows)))
+        if not skipped:
+            break
+        count -= skipped
+
+
+def _chunks(cursor, chunk_rows, max_rows=None):
+    remaining = max_rows
+    while remaining is None or remaining > 0:
+        rows = cursor.fetchmany(chunk_rows if remaining is None else min(chunk_rows, remaining))
+        if not rows:
+            return
+        if remaining is not None:
+            remaining -= len(rows)
+        yield rows
+
+
+def stream_rows(cursor, columns, fmt='ndjson', chunk_rows=500, transform=None, max_rows=None):
+    """Generate response text for the remaining rows of `cursor`.
+
+    `transform(record)` may add fields to each row dict (ndjson only). At most
+    `max_rows` rows are sent, followed by a {"truncated": true, ...} line if
+    more were available. An error raised while reading is written as a final
+    {"error": ...} line, since the status code has already been sent.
+    """
+    try:
+        for rows in _chunks(cursor, chunk_rows, max_rows):
+            if fmt == 'columnar':
+                data = {col: [row[i] for row in rows] for i, col in enumerate(columns)}
+                yield json.dumps(data, default=str) + '\n'
+            else:
+                lines = []
+                for row in rows:
+                    record = dict(zip(columns, row))
+                    if transform is not None:
+                        transform(record)
+                    lines.append(json.dumps(record, default=str))
+                yield '\n'.join(lines) + '\n'
+        if max_rows is not None and cursor.fetchmany(1):
+            yield json.dumps({'truncated': True, 'max_rows': max_rows}) + '\n'
+    except Exception as e:
+        yield json.dumps({'error': str(e)}) + '\n'
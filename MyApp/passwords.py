@@ -0,0 +1,184 @@
+"""PBKDF2 password hashing on a bounded executor.
+
+Each hash or verification is deliberately expensive (`iterations` rounds of
+PBKDF2-SHA256). Running them on request threads lets a burst of logins take
+every worker, so they run on a small dedicated pool instead: at most
+`workers` derivations run at once, at most `max_pending` wait, and callers
+beyond that get HasherBusy straight away (the route answers 503) instead of
+queueing without bound. hashlib releases the GIL while deriving, so the
+pool's threads run in parallel with request threads.
+
+Accounts hashed with a different iteration count than the configured one are
+re-hashed in the background after their next successful login.
+
+Patient accounts created on upload start with a *pending* credential
+(iterations = 0, no hash): the default password is hashed later in batches
+by `fill_pending_credentials`, so uploads never wait on the KDF. A pending
+account accepts only the default password.
+"""
+import binascii
+import hashlib
+import hmac
+import secrets
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+PENDING_ITERATIONS = 0
+
+
+class HasherBusy(RuntimeError):
+    """The hashing queue is full."""
+
+
+def hash_password(password, salt=None, iterations=100_000):
+    """(hash hex, salt hex, iterations) for `password`."""
+    if salt is None:
+        salt = secrets.token_bytes(16)
+    dk = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations)
+    return binascii.hexlify(dk).decode('ascii'), binascii.hexlify(salt).decode('ascii'), iterations
+
+
+def verify_password(stored_hash_hex, stored_salt_hex, iterations, candidate_password, pending_password=None):
+    """True if `candidate_password` matches; a pending credential matches only `pending_password`."""
+    try:
+        if iterations == PENDING_ITERATIONS:
+            return pending_password is not None and hmac.compare_digest(
+                candidate_password.encode('utf-8'), pending_password.encode('utf-8'))
+        salt = binascii.unhexlify(stored_salt_hex)
+        dk = hashlib.pbkdf2_hmac('sha256', candidate_password.encode('utf-8'), salt, iterations)
+        return hmac.compare_digest(binascii.hexlify(dk).decode('ascii'), stored_hash_hex)
+    except Exception:
+        return False
+
+
+class PasswordHasher:
+    """Runs hash_password / verify_password on `workers` threads with a bounded queue."""
+
+    def __init__(self, iterations=100_000, workers=2, max_pending=64, timeout=10.0, stats_window=1000):
+        self.iterations = int(iterations)
+        self.workers = max(1, int(workers))
+        self.max_pending = max(1, int(max_pending))
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password-hasher')
+        self._lock = threading.Lock()
+        self._outstanding = 0  # running + queued
+        self._queue_waits = deque(maxlen=stats_window)
+        self._hash_times = deque(maxlen=stats_window)
+        self.submitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.rehashed = 0
+        self.peak_outstanding = 0
+        self._rehashing = set()
+
+    def needs_rehash(self, iterations):
+        """True for pending credentials and hashes made with other parameters."""
+        return iterations != self.iterations
+
+    def submit(self, fn, *args):
+        """Queue `fn(*args)`; returns a Future or raises HasherBusy when the queue is full."""
+        with self._lock:
+            if self._outstanding >= self.workers + self.max_pending:
+                self.rejected += 1
+                raise HasherBusy(f'password hashing queue is full ({self.max_pending} waiting)')
+            self._outstanding += 1
+            self.submitted += 1
+            self.peak_outstanding = max(self.peak_outstanding, self._outstanding)
+        return self._executor.submit(self._timed, time.perf_counter(), fn, *args)
+
+    def _timed(self, queued_at, fn, *args):
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            finished = time.perf_counter()
+            with self._lock:
+                self._outstanding -= 1
+                self.completed += 1
+                self._queue_waits.append(started - queued_at)
+                self._hash_times.append(finished - started)
+
+    def hash(self, password):
+        """Hash with the configured iterations on the executor; blocks the caller until done."""
+        return self.submit(hash_password, password, None, self.iterations).result(timeout=self.timeout)
+
+    def verify(self, stored_hash_hex, stored_salt_hex, iterations, candidate_password, pending_password=None):
+        if iterations == PENDING_ITERATIONS:
+            # nothing to derive
+            return verify_password(stored_hash_hex, stored_salt_hex, iterations, candidate_password, pending_password)
+        return self.submit(verify_password, stored_hash_hex, stored_salt_hex, iterations,
+                           candidate_password).result(timeout=self.timeout)
+
+    def rehash_later(self, key, password, store):
+        """Hash `password` with the current parameters in the background and pass the result to
+        `store(hash_hex, salt_hex, iterations)`. At most one rehash per `key` (account) is
+        queued; skipped silently when the queue is full."""
+        with self._lock:
+            if key in self._rehashing:
+                return
+            self._rehashing.add(key)
+
+        def run():
+            try:
+                store(*hash_password(password, None, self.iterations))
+                with self._lock:
+                    self.rehashed += 1
+            finally:
+                with self._lock:
+                    self._rehashing.discard(key)
+        try:
+            self.submit(run)
+        except HasherBusy:
+            with self._lock:
+                self._rehashing.discard(key)
+
+    @staticmethod
+    def _percentiles(values):
+        if not values:
+            return None
+        values = sorted(values)
+        return {
+            'mean': 1000.0 * sum(values) / len(values),
+            'p50': 1000.0 * values[len(values) // 2],
+            'p95': 1000.0 * values[min(len(values) - 1, int(len(values) * 0.95))],
+            'max': 1000.0 * values[-1],
+        }
+
+    def stats(self):
+        with self._lock:
+            return {
+                'iterations': self.iterations,
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'outstanding': self._outstanding,
+                'peak_outstanding': self.peak_outstanding,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'rehashed': self.rehashed,
+                'queue_wait_ms': self._percentiles(self._queue_waits),
+                'hash_ms': self._percentiles(self._hash_times),
+            }
+
+
+def fill_pending_credentials(conn, password, iterations, batch_size=50):
+    """Hash `password` for up to `batch_size` pending accounts in one transaction.
+
+    Returns the number of accounts filled (0 once none are pending). Each
+    account gets its own salt. Call it repeatedly from the hasher's executor,
+    one batch per job, so logins queued meanwhile are not held up for long.
+    """
+    usernames = [row[0] for row in conn.execute(
+        'SELECT username FROM users WHERE iterations = 0 LIMIT ?', (batch_size,))]
+    rows = []
+    for username in usernames:
+        pwd_hash, salt_hex, iters = hash_password(password, None, iterations)
+        rows.append((pwd_hash, salt_hex, iters, username))
+    if rows:
+        with conn:
+            # an account that logged in (and was hashed) meanwhile keeps that credential
+            conn.executemany('UPDATE users SET password_hash = ?, password_salt = ?, iterations = ? '
+                             'WHERE username = ? AND iterations = 0', rows)
+    return len(rows)
@@ -0,0 +1,356 @@
+"""Perceptual hashes of scans and a Hamming-radius index over them.
+
+SHA-256 keys (the prediction cache, content_sha256) only match identical
+bytes or pixels; the same MRI re-exported, re-compressed or resized gets a
+new digest. Two 64-bit perceptual hashes survive that:
+
+- pHash: DCT of a 32x32 grayscale thumbnail, the lowest 8x8 frequencies
+  compared against their median;
+- dHash: sign of the horizontal gradient on a 9x8 grayscale thumbnail.
+
+Near-identical images differ in a few bits. Hashes are stored per scan in
+scans.phash / scans.dhash as signed 64-bit integers (SQLite's INTEGER).
+NearDuplicateIndex holds them in a BK-tree keyed on pHash; a scan matches
+when its pHash is within `phash_radius` bits and its dHash within
+`dhash_radius` bits, the second test filtering pHash collisions between
+unrelated images.
+"""
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+HASH_BITS = 64
+_MASK = (1 << HASH_BITS) - 1
+_WEIGHTS = 1 << np.arange(HASH_BITS - 1, -1, -1, dtype=np.uint64)
+
+
+def _pack(bits):
+    """64 booleans -> signed 64-bit integer, first bit most significant."""
+    value = int((bits.ravel().astype(np.uint64) * _WEIGHTS).sum())
+    return value - (1 << HASH_BITS) if value >> (HASH_BITS - 1) else value
+
+
+def _gray(rgb):
+    return rgb if rgb.ndim == 2 else cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+
+
+def phash(rgb):
+    small = cv2.resize(_gray(rgb), (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8]
+    return _pack(low > np.median(low))
+
+
+def dhash(rgb):
+    small = cv2.resize(_gray(rgb), (9, 8), interpolation=cv2.INTER_AREA).astype(np.int16)
+    return _pack(small[:, 1:] > small[:, :-1])
+
+
+def image_hashes(rgb):
+    """(phash, dhash) of a decoded RGB or grayscale image."""
+    gray = _gray(rgb)
+    return phash(gray), dhash(gray)
+
+
+def hamming(a, b):
+    return ((a ^ b) & _MASK).bit_count()
+
+
+class BKTree:
+    """Burkhard-Keller tree over 64-bit hashes under Hamming distance.
+
+    Each node is [hash, items, {distance: child}]; items sharing a hash share
+    the node. A radius search only descends into children whose edge
+    distance is within the radius of the query's distance to the node.
+    """
+
+    def __init__(self):
+        self._root = None
+        self.size = 0
+
+    def add(self, value, item):
+        if self._root is None:
+            self._root = [value, {item}, {}]
+            self.size += 1
+            return
+        node = self._root
+        while True:
+            d = hamming(value, node[0])
+            if d == 0:
+                if item not in node[1]:
+                    node[1].add(item)
+                    self.size += 1
+                return
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [value, {item}, {}]
+                self.size += 1
+                return
+            node = child
+
+    def remove(self, value, item):
+        """Drop `item` from the node for `value` (the node stays as a routing point)."""
+        node = self._root
+        while node is not None:
+            d = hamming(value, node[0])
+            if d == 0:
+                if item in node[1]:
+                    node[1].discard(item)
+                    self.size -= 1
+                    return True
+                return False
+            node = node[2].get(d)
+        return False
+
+    def search(self, value, radius):
+        """[(distance, item)] for every item whose hash is within `radius` bits of `value`."""
+        found = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node = stack.pop()
+            d = hamming(value, node[0])
+            if d <= radius:
+                found.extend((d, item) for item in node[1])
+            for edge, child in node[2].items():
+                if d - radius <= edge <= d + radius:
+                    stack.append(child)
+        return found
+
+
+class NearDuplicateIndex:
+    """Thread-safe near-duplicate lookup over the hashes stored in scans.
+
+    The index is loaded from the database on first use and kept current by
+    `refresh`: rows with a higher scan_id are added, and if the number of
+    hashed rows then differs (a backfill, or scans deleted by another
+    process) the index is rebuilt. Scans added or deleted by this process
+    are applied directly with `add` / `remove`.
+    """
+
+    def __init__(self, phash_radius=4, dhash_radius=8, check_interval=5.0):
+        self.phash_radius = phash_radius
+        self.dhash_radius = dhash_radius
+        self.check_interval = check_interval
+        self._tree = BKTree()
+        self._hashes = {}  # scan_id -> (phash, dhash)
+        self._last_scan_id = 0
+        self._loaded = False
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.matches = 0
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def add(self, scan_id, phash_value, dhash_value):
+        if phash_value is None or dhash_value is None:
+            return
+        scan_id = int(scan_id)
+        with self._lock:
+            old = self._hashes.get(scan_id)
+            if old is not None:
+                self._tree.remove(old[0], scan_id)
+            self._hashes[scan_id] = (phash_value, dhash_value)
+            self._tree.add(phash_value, scan_id)
+            self._last_scan_id = max(self._last_scan_id, scan_id)
+
+    def remove(self, scan_ids):
+        with self._lock:
+            for scan_id in scan_ids:
+                old = self._hashes.pop(int(scan_id), None)
+                if old is not None:
+                    self._tree.remove(old[0], int(scan_id))
+
+    def load(self, conn):
+        """Rebuild from every hashed scan."""
+        tree, hashes, last = BKTree(), {}, 0
+        for scan_id, p, d in conn.execute('SELECT scan_id, phash, dhash FROM scans WHERE phash IS NOT NULL'):
+            hashes[scan_id] = (p, d)
+            tree.add(p, scan_id)
+            last = max(last, scan_id)
+        with self._lock:
+            self._tree, self._hashes, self._last_scan_id = tree, hashes, last
+            self._loaded = True
+            self._checked_at = time.monotonic()
+
+    def refresh(self, conn, force=False):
+        """Pick up scans hashed by other processes, at most once per check_interval."""
+        now = time.monotonic()
+        with self._lock:
+            if self._loaded and not force and now - self._checked_at < self.check_interval:
+                return
+            self._checked_at = now
+            loaded, last = self._loaded, self._last_scan_id
+        if not loaded:
+            self.load(conn)
+            return
+        for scan_id, p, d in conn.execute('SELECT scan_id, phash, dhash FROM scans WHERE scan_id > ? AND phash IS NOT NULL',
+                                          (last,)).fetchall():
+            self.add(scan_id, p, d)
+        hashed = conn.execute('SELECT COUNT(*) FROM scans WHERE phash IS NOT NULL').fetchone()[0]
+        if hashed != len(self._hashes):
+            self.load(conn)
+
+    def _matches(self, phash_value, dhash_value, exclude):
+        found = []
+        for p_dist, scan_id in self._tree.search(phash_value, self.phash_radius):
+            if scan_id == exclude:
+                continue
+            d_dist = hamming(dhash_value, self._hashes[scan_id][1])
+            if d_dist <= self.dhash_radius:
+                found.append({'scan_id': scan_id, 'phash_distance': p_dist, 'dhash_distance': d_dist})
+        return found
+
+    def lookup(self, phash_value, dhash_value, exclude=None, limit=None):
+        """Near duplicates as [{'scan_id', 'phash_distance', 'dhash_distance'}], closest first."""
+        if phash_value is None or dhash_value is None:
+            return []
+        with self._lock:
+            found = self._matches(phash_value, dhash_value, exclude)
+            self.lookups += 1
+            if found:
+                self.matches += 1
+        found.sort(key=lambda m: (m['phash_distance'] + m['dhash_distance'], m['scan_id']))
+        return found[:limit] if limit else found
+
+    def clusters(self):
+        """Groups of scan ids linked by near-duplicate matches (transitively), largest first."""
+        parent = {}
+
+        def find(x):
+            root = x
+            while parent[root] != root:
+                root = parent[root]
+            while parent[x] != root:
+                parent[x], x = root, parent[x]
+            return root
+
+        with self._lock:
+            for scan_id, (p, d) in self._hashes.items():
+                for match in self._matches(p, d, scan_id):
+                    parent.setdefault(scan_id, scan_id)
+                    parent.setdefault(match['scan_id'], match['scan_id'])
+                    a, b = find(scan_id), find(match['scan_id'])
+                    if a != b:
+                        parent[max(a, b)] = min(a, b)
+        groups = {}
+        for scan_id in parent:
+            groups.setdefault(find(scan_id), []).append(scan_id)
+        return sorted((sorted(group) for group in groups.values()), key=lambda g: (-len(g), g[0]))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'scans': len(self._hashes),
+                'phash_radius': self.phash_radius,
+                'dhash_radius': self.dhash_radius,
+                'lookups': self.lookups,
+                'matches': self.matches,
+            }
+
+
+def hash_scans(conn, resolve_path, rehash=False, workers=None, commit_every=1000, progress=None):
+    """Compute and store phash/dhash for scans that have none (every scan with `rehash`).
+
+    `resolve_path(original_path, processed_path)` returns the local image file
+    or None. Files are decoded in a process pool; updates are committed
+    `commit_every` rows at a time. Returns counts, errors and images/sec.
+    """
+    from preprocessing import hash_image_worker  # preprocessing imports this module
+
+    started = time.perf_counter()
+    sql = 'SELECT scan_id, original_path, processed_path FROM scans'
+    if not rehash:
+        sql += ' WHERE phash IS NULL'
+    rows = conn.execute(sql + ' ORDER BY scan_id').fetchall()
+    summary = {'total': len(rows), 'hashed': 0, 'failed': 0, 'errors': []}
+
+    jobs = []
+    for scan_id, original, processed in rows:
+        path = resolve_path(original, processed)
+        if path is None:
+            summary['failed'] += 1
+            summary['errors'].append({'scan_id': scan_id, 'error': 'image file not found'})
+        else:
+            jobs.append((scan_id, path))
+
+    pending = []
+
+    def flush():
+        conn.executemany('UPDATE scans SET phash = ?, dhash = ? WHERE scan_id = ?', pending)
+        conn.commit()
+        pending.clear()
+
+    if jobs:
+        workers = max(1, min(workers or os.cpu_count() or 1, len(jobs)))
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            for done, (scan_id, p, d, error) in enumerate(pool.map(hash_image_worker, jobs, chunksize=16), 1):
+                if error is not None:
+                    summary['failed'] += 1
+                    summary['errors'].append({'scan_id': scan_id, 'error': error})
+                else:
+                    pending.append((p, d, scan_id))
+                    summary['hashed'] += 1
+                    if len(pending) >= commit_every:
+                        flush()
+                if progress:
+                    progress(done, len(jobs), time.perf_counter() - started)
+    flush()
+
+    elapsed = time.perf_counter() - started
+    summary['seconds'] = round(elapsed, 3)
+    summary['images_per_sec'] = round(summary['hashed'] / elapsed, 1) if summary['hashed'] and elapsed > 0 else None
+    return summary
+
+
+def cluster_report(conn, index):
+    """Near-duplicate clusters with each member's patient, label, source and latest prediction.
+
+    A cluster is `mixed` when it holds both training images (source_key set)
+    and other scans, and `label_conflict` when its members carry different
+    labels; both distort accuracy numbers measured on uploads.
+    """
+    started = time.perf_counter()
+    groups = index.clusters()
+    members = {}
+    ids = [scan_id for group in groups for scan_id in group]
+    for i in range(0, len(ids), 500):
+        part = ids[i:i + 500]
+        placeholders = ','.join('?' for _ in part)
+        for scan_id, patient_id, label, source_key, original_path in conn.execute(
+                f'SELECT scan_id, patient_id, label, source_key, original_path FROM scans WHERE scan_id IN ({placeholders})',
+                part):
+            members[scan_id] = {'scan_id': scan_id, 'patient_id': patient_id, 'label': label,
+                                'source_key': source_key, 'original_path': original_path}
+
+    clusters = []
+    for group in groups:
+        rows = [members[scan_id] for scan_id in group if scan_id in members]
+        if len(rows) < 2:
+            continue
+        labels = {row['label'] for row in rows if row['label']}
+        training = sum(1 for row in rows if row['source_key'])
+        clusters.append({
+            'size': len(rows),
+            'mixed': 0 < training < len(rows),
+            'label_conflict': len(labels) > 1,
+            'patients': len({row['patient_id'] for row in rows}),
+            'scans': rows,
+        })
+    return {
+        'hashed_scans': len(index),
+        'phash_radius': index.phash_radius,
+        'dhash_radius': index.dhash_radius,
+        'clusters': len(clusters),
+        'duplicate_scans': sum(c['size'] for c in clusters),
+        'redundant_scans': sum(c['size'] - 1 for c in clusters),
+        'mixed_clusters': sum(1 for c in clusters if c['mixed']),
+        'label_conflicts': sum(1 for c in clusters if c['label_conflict']),
+        'seconds': round(time.perf_counter() - started, 3),
+        'cluster_list': clusters,
+    }
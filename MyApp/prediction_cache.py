@@ -0,0 +1,96 @@
+"""Content-addressed cache of tumor predictions.
+
+Entries are keyed on (SHA-256 of the decoded image pixels, model version).
+An in-memory LRU sits in front of the `tumor_classification` table, whose
+rows carry the image hash and model version of every stored prediction, so
+re-classifying the same image (or a re-upload of it) never touches the model.
+Bumping the model version makes every older entry unreachable.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def image_digest(pixels):
+    """SHA-256 over the decoded pixel buffer (shape included so crops don't collide)."""
+    h = hashlib.sha256()
+    h.update(repr(pixels.shape).encode('ascii'))
+    h.update(pixels.tobytes())
+    return h.hexdigest()
+
+
+class PredictionCache:
+    """In-memory LRU layered over the persistent `tumor_classification` table."""
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self.model_version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.table_hits = 0
+        self.misses = 0
+
+    def set_model_version(self, version):
+        """Switch model version; in-memory entries for the old version are dropped."""
+        with self._lock:
+            if version != self.model_version:
+                self._entries.clear()
+                self.model_version = version
+
+    def get(self, db, image_sha256):
+        """Return a cached {'predicted_label', 'confidence', ...} dict or None."""
+        version = self.model_version
+        if version is None:
+            return None
+        key = (image_sha256, version)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return entry
+
+        row = db.execute('SELECT classification_id, scan_id, processed_path, predicted_label, confidence '
+                         'FROM tumor_classification WHERE image_sha256 = ? AND model_version = ? '
+                         'ORDER BY classification_id DESC LIMIT 1', key).fetchone()
+        if row is None:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        entry = {
+            'classification_id': row[0],
+            'scan_id': row[1],
+            'processed_path': row[2],
+            'predicted_label': row[3],
+            'confidence': row[4],
+        }
+        with self._lock:
+            self.table_hits += 1
+            self._store(key, entry)
+        return entry
+
+    def put(self, image_sha256, version, entry):
+        with self._lock:
+            if version == self.model_version:
+                self._store((image_sha256, version), entry)
+
+    def _store(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'model_version': self.model_version,
+                'hits': self.memory_hits + self.table_hits,
+                'memory_hits': self.memory_hits,
+                'table_hits': self.table_hits,
+                'misses': self.misses,
+                'memory_entries': len(self._entries),
+                'max_entries': self.max_entries,
+            }
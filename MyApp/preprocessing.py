@@ -0,0 +1,112 @@
+"""Image decoding and Xception preprocessing.
+
+Shared by the web app and by process-pool workers; it deliberately imports
+neither Flask nor TensorFlow so workers start quickly.
+"""
+from collections import namedtuple
+from io import BytesIO
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from perceptual_hash import image_hashes
+from prediction_cache import image_digest
+
+MODEL_INPUT_SIZE = (299, 299)
+THUMBNAIL_SIZE = 256
+
+# Everything derived from one decode of an uploaded image
+PreparedImage = namedtuple('PreparedImage', 'width height mean_pixel std_pixel thumbnail pixels image_sha256 phash dhash')
+
+
+def preprocess_input(x):
+    """Xception preprocessing (keras mode='tf'): scale pixels to [-1, 1]."""
+    return x / 127.5 - 1.0
+
+
+def decode_for_model(image_path):
+    """Decode an image to RGB and resize it for the model.
+
+    Returns (uint8 array of MODEL_INPUT_SIZE x 3, SHA-256 of the decoded pixels).
+    """
+    img = cv2.imread(image_path)
+    if img is None:
+        raise ValueError(f"could not read image {image_path}")
+    img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    image_sha256 = image_digest(img)
+    img = cv2.resize(img, MODEL_INPUT_SIZE)
+    return img, image_sha256
+
+
+def load_image_tensor(image_path):
+    """Decode an MRI image into a model-ready tensor plus the SHA-256 of its decoded pixels"""
+    img, image_sha256 = decode_for_model(image_path)
+    return preprocess_input(img.astype('float32')), image_sha256
+
+
+def decode_for_model_worker(item):
+    """Process-pool entry point: (key, path) -> (key, pixels, sha256, error)."""
+    key, image_path = item
+    try:
+        img, image_sha256 = decode_for_model(image_path)
+        return key, img, image_sha256, None
+    except Exception as e:
+        return key, None, None, str(e)
+
+
+def hash_image_worker(item):
+    """Process-pool entry point: (key, path) -> (key, phash, dhash, error)."""
+    key, image_path = item
+    try:
+        with open(image_path, 'rb') as f:
+            data = f.read()
+        return (key,) + image_hashes(decode_bytes(data)) + (None,)
+    except Exception as e:
+        return key, None, None, str(e) or 'not a readable image'
+
+
+def preprocess_batch(images):
+    """Stack uint8 images (a list or an already stacked array) into one float32 model batch.
+
+    Writes straight into the output array: same values as preprocess_input
+    on a float32 copy, without the intermediate arrays.
+    """
+    batch = images if isinstance(images, np.ndarray) else np.stack(images)
+    out = np.empty(batch.shape, dtype=np.float32)
+    np.divide(batch, np.float32(127.5), out=out)
+    out -= np.float32(1.0)
+    return out
+
+
+def decode_bytes(data):
+    """Decode encoded image bytes to an RGB uint8 array (cv2 first, PIL for formats like GIF)."""
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is not None:
+        return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    with Image.open(BytesIO(data)) as pil_img:
+        return np.asarray(pil_img.convert('RGB'))
+
+
+def prepare_upload(data, thumbnail_size=THUMBNAIL_SIZE):
+    """Decode an upload once and derive its stats, display thumbnail and model input.
+
+    `pixels` is the MODEL_INPUT_SIZE uint8 image (apply preprocess_input to feed the
+    model); `thumbnail` is JPEG bytes no larger than thumbnail_size on either side;
+    `phash`/`dhash` are the perceptual hashes (perceptual_hash.py).
+    """
+    rgb = decode_bytes(data)
+    height, width = rgb.shape[:2]
+
+    # per-channel mean/stddev averaged over channels (same as PIL ImageStat)
+    channels = rgb.reshape(-1, 3).astype(np.float64)
+    mean_pixel = float(channels.mean(axis=0).mean())
+    std_pixel = float(channels.std(axis=0).mean())
+
+    scale = min(1.0, thumbnail_size / max(width, height))
+    thumb = cv2.resize(rgb, (max(1, round(width * scale)), max(1, round(height * scale))), interpolation=cv2.INTER_AREA)
+    ok, encoded = cv2.imencode('.jpg', cv2.cvtColor(thumb, cv2.COLOR_RGB2BGR), [cv2.IMWRITE_JPEG_QUALITY, 85])
+    thumbnail = encoded.tobytes() if ok else None
+
+    pixels = cv2.resize(rgb, MODEL_INPUT_SIZE)
+    return PreparedImage(width, height, mean_pixel, std_pixel, thumbnail, pixels, image_digest(rgb), *image_hashes(rgb))
@@ -0,0 +1,140 @@
+"""Result cache for the database console's SELECTs.
+
+Admins rerun the same analytical queries over data that rarely changes
+between runs. Pages of results are kept in an LRU keyed on the normalized
+query text (whitespace collapsed and keywords lower-cased outside string
+literals), its parameters and the page position, and bounded by total rows.
+
+Every entry is tagged with the database's `PRAGMA data_version` as seen by a
+dedicated connection that never writes. SQLite changes that value whenever
+any other connection commits, in this process or another one (CLI commands,
+other gunicorn workers, triggers included), so an entry is served only if
+nothing has been committed since it was computed.
+"""
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# string literals and quoted identifiers are kept verbatim; everything else is case-folded
+_TOKENS = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\])|(\s+)|([^'"`\[\s]+|.)""")
+
+
+def normalize_sql(sql):
+    """Canonical form of `sql` for cache keys: `select  *\nFROM t;` -> `select * from t`."""
+    parts = []
+    for quoted, space, other in _TOKENS.findall(sql.strip().rstrip(';').strip()):
+        if quoted:
+            parts.append(quoted)
+        elif space:
+            parts.append(' ')
+        else:
+            parts.append(other.lower())
+    return ''.join(parts)
+
+
+class QueryCache:
+    def __init__(self, db_path, max_entries=256, max_rows=200000, max_tracked_queries=500):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self.max_tracked_queries = max_tracked_queries
+        self._entries = OrderedDict()
+        self._rows = 0
+        self._lock = threading.Lock()
+        self._version_conn = None
+        self._version_lock = threading.Lock()
+        self._queries = OrderedDict()  # normalized sql -> per-query counters
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.uncacheable = 0
+
+    def data_version(self):
+        """Current PRAGMA data_version of the sentinel connection (changes on every foreign commit)."""
+        with self._version_lock:
+            if self._version_conn is None:
+                self._version_conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+            return self._version_conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def _query_stats(self, sql):
+        entry = self._queries.get(sql)
+        if entry is None:
+            entry = self._queries[sql] = {'hits': 0, 'misses': 0, 'exec_ms': 0.0, 'saved_ms': 0.0}
+            while len(self._queries) > self.max_tracked_queries:
+                self._queries.popitem(last=False)
+        else:
+            self._queries.move_to_end(sql)
+        return entry
+
+    def get(self, key, version):
+        """Cached value for `key` computed at `version`, with its metadata; None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            stats = self._query_stats(key[0])
+            if entry is not None and entry['version'] != version:
+                self._drop(key)
+                self.invalidations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            stats['hits'] += 1
+            stats['saved_ms'] += entry['exec_ms']
+            return entry['value'], {
+                'hit': True,
+                'age_seconds': round(time.time() - entry['stored_at'], 3),
+                'exec_ms': round(entry['exec_ms'], 3),
+            }
+
+    def put(self, key, version, value, rows, exec_ms):
+        """Store `value` (holding `rows` rows) computed at `version`; oversized results are skipped."""
+        with self._lock:
+            self._query_stats(key[0])['exec_ms'] += exec_ms
+            if rows > self.max_rows:
+                self.uncacheable += 1
+                return
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = {'value': value, 'rows': rows, 'version': version,
+                                  'stored_at': time.time(), 'exec_ms': exec_ms}
+            self._rows += rows
+            while len(self._entries) > self.max_entries or self._rows > self.max_rows:
+                self._drop(next(iter(self._entries)))
+
+    def _drop(self, key):
+        self._rows -= self._entries.pop(key)['rows']
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._rows = 0
+
+    def stats(self, top=20):
+        with self._lock:
+            lookups = self.hits + self.misses
+            queries = sorted(self._queries.items(), key=lambda item: -item[1]['saved_ms'])[:top]
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'rows': self._rows,
+                'max_rows': self.max_rows,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else None,
+                'invalidations': self.invalidations,
+                'uncacheable': self.uncacheable,
+                'time_saved_ms': round(sum(q['saved_ms'] for q in self._queries.values()), 3),
+                'queries': [{
+                    'query': sql,
+                    'hits': q['hits'],
+                    'misses': q['misses'],
+                    'hit_rate': q['hits'] / (q['hits'] + q['misses']) if q['hits'] + q['misses'] else None,
+                    'avg_exec_ms': round(q['exec_ms'] / q['misses'], 3) if q['misses'] else None,
+                    'time_saved_ms': round(q['saved_ms'], 3),
+                } for sql, q in queries],
+            }
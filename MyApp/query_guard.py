@@ -0,0 +1,155 @@
+"""Execution budgets and slow-query logging for the database console.
+
+A QueryBudget installs an SQLite progress handler on the connection running
+an ad-hoc SELECT. The handler is called every `interval` virtual-machine
+instructions and aborts the statement once it has used more than `max_steps`
+instructions or `max_ms` of running time, so an accidental cross join gives the
+connection (and the request worker) back instead of holding them until it
+finishes. SQLite reports the abort as OperationalError('interrupted'); the
+budget turns that into BudgetExceeded naming the limit that was hit.
+
+SlowQueryLog keeps the most recent slow or aborted queries with their
+EXPLAIN QUERY PLAN output and plan warnings.
+"""
+import sqlite3
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from query_plans import explain, plan_warnings
+
+
+class BudgetExceeded(Exception):
+    def __init__(self, kind, limit, elapsed_ms, steps):
+        self.kind = kind
+        self.limit = limit
+        self.elapsed_ms = elapsed_ms
+        self.steps = steps
+        unit = 'ms' if kind == 'time' else 'VM steps'
+        super().__init__(f'query exceeded its {kind} budget ({limit} {unit}); '
+                         f'add a WHERE clause or LIMIT, or check the plan with "explain": true')
+
+
+class QueryBudget:
+    """Progress-handler limits for one statement: start() before executing, stop() when done.
+
+    Time counts only while the statement is running: a streamed result is
+    paused between fetches, so a slow client does not use up the budget.
+    """
+
+    def __init__(self, conn, max_ms=None, max_steps=None, interval=1000):
+        self.conn = conn
+        self.max_ms = max_ms or None
+        self.max_steps = max_steps or None
+        self.interval = interval
+        self.steps = 0
+        self.exceeded = None
+        self._spent = 0.0
+        self._resumed = None
+
+    @property
+    def elapsed_ms(self):
+        running = time.perf_counter() - self._resumed if self._resumed is not None else 0.0
+        return (self._spent + running) * 1000.0
+
+    def _check(self):
+        self.steps += self.interval
+        if self.max_steps and self.steps > self.max_steps:
+            self.exceeded = ('steps', self.max_steps)
+        elif self.max_ms and self.elapsed_ms > self.max_ms:
+            self.exceeded = ('time', self.max_ms)
+        return 1 if self.exceeded else 0
+
+    def start(self):
+        if self.max_ms or self.max_steps:
+            self.conn.set_progress_handler(self._check, self.interval)
+        self.resume()
+        return self
+
+    def pause(self):
+        if self._resumed is not None:
+            self._spent += time.perf_counter() - self._resumed
+            self._resumed = None
+
+    def resume(self):
+        if self._resumed is None:
+            self._resumed = time.perf_counter()
+
+    def stop(self):
+        """Remove the handler; the connection goes back to the pool unrestricted."""
+        self.pause()
+        self.conn.set_progress_handler(None, 0)
+
+    def error(self):
+        kind, limit = self.exceeded
+        return BudgetExceeded(kind, limit, self.elapsed_ms, self.steps)
+
+    def cursor(self, cursor):
+        """Wrap `cursor` for streaming: the clock runs only inside fetches, and an abort raises BudgetExceeded."""
+        return _BudgetedCursor(self, cursor)
+
+
+class _BudgetedCursor:
+    def __init__(self, budget, cursor):
+        self._budget = budget
+        self._cursor = cursor
+        self.description = cursor.description
+
+    def fetchmany(self, size):
+        self._budget.resume()
+        try:
+            return self._cursor.fetchmany(size)
+        except sqlite3.OperationalError as e:
+            if self._budget.exceeded:
+                raise self._budget.error() from e
+            raise
+        finally:
+            self._budget.pause()
+
+
+class SlowQueryLog:
+    def __init__(self, threshold_ms=500, max_entries=100):
+        self.threshold_ms = threshold_ms
+        self._entries = deque(maxlen=max_entries)
+        self._lock = threading.Lock()
+        self.logged = 0
+
+    def is_slow(self, elapsed_ms):
+        return self.threshold_ms is not None and elapsed_ms >= self.threshold_ms
+
+    def record(self, conn, sql, params, elapsed_ms, steps=None, rows=None, outcome='ok'):
+        """Log a slow or aborted query together with its current plan."""
+        try:
+            plan = explain(conn, sql, params)
+            warnings = plan_warnings(plan)
+        except sqlite3.Error as e:
+            plan, warnings = [], [f'cannot explain: {e}']
+        entry = {
+            'logged_on': datetime.utcnow().isoformat(),
+            'query': sql,
+            'params': list(params),
+            'elapsed_ms': round(elapsed_ms, 3),
+            'vm_steps': steps,
+            'rows': rows,
+            'outcome': outcome,
+            'plan': plan,
+            'warnings': warnings,
+        }
+        with self._lock:
+            self._entries.append(entry)
+            self.logged += 1
+        print(f"⚠️  Slow query ({elapsed_ms:.0f} ms, {outcome}): {' '.join(sql.split())}")
+        for detail in plan:
+            print(f"     {detail}")
+        for warning in warnings:
+            print(f"     ⚠️  {warning}")
+        return entry
+
+    def recent(self):
+        with self._lock:
+            return list(reversed(self._entries))
+
+    def stats(self):
+        with self._lock:
+            return {'threshold_ms': self.threshold_ms, 'logged': self.logged, 'kept': len(self._entries)}
@@ -0,0 +1,160 @@
+"""EXPLAIN QUERY PLAN checks for the SQL the app issues.
+
+APP_QUERIES lists every statement the routes, the prediction cache, bulk
+prediction, bulk ingest, the scan loader and the near-duplicate index run
+against brain_etl.db, with
+representative parameters. `check` explains each one and reports plans that
+scan a table without an index or build a temporary B-tree for ORDER BY /
+DISTINCT / GROUP BY. Statements that are expected to read the whole table
+(e.g. re-scoring every scan) are marked `full_scan_ok`. Keep this list in
+step with the queries in app.py.
+"""
+from collections import namedtuple
+
+AppQuery = namedtuple('AppQuery', 'name sql params full_scan_ok')
+
+
+def _q(name, sql, params=(), full_scan_ok=False):
+    return AppQuery(name, ' '.join(sql.split()), params, full_scan_ok)
+
+
+APP_QUERIES = [
+    _q('login', 'SELECT password_hash, password_salt, iterations, role, patient_id FROM users WHERE username = ?', ('admin',)),
+    _q('rehash_password', 'UPDATE users SET password_hash = ?, password_salt = ?, iterations = ? '
+       'WHERE username = ? AND password_hash = ?', ('h', 's', 1, 'admin', 'h')),
+    _q('pending_credentials', 'SELECT username FROM users WHERE iterations = 0 LIMIT ?', (50,)),
+    _q('fill_pending_credential', 'UPDATE users SET password_hash = ?, password_salt = ?, iterations = ? '
+       'WHERE username = ? AND iterations = 0', ('h', 's', 1, 'patient_1')),
+    _q('pending_credentials_count', 'SELECT COUNT(*) FROM users WHERE iterations = 0'),
+    _q('patient_login_legacy', 'SELECT patient_id FROM scans WHERE patient_id = ? LIMIT 1', (1,)),
+    # /patient_records and /find_scans_by_patient: first page, then keyset pages after (scan_date, scan_id)
+    _q('patient_scans_first_page', 'SELECT scan_id AS rowid, * FROM mri_scans WHERE patient_id = ? '
+       'ORDER BY scan_date DESC, scan_id', (1,)),
+    _q('patient_scans_next_page', 'SELECT scan_id AS rowid, * FROM mri_scans WHERE patient_id = ? '
+       'AND (scan_date < ? OR scan_date IS NULL OR (scan_date = ? AND scan_id > ?)) '
+       'ORDER BY scan_date DESC, scan_id', (1, '2024-01-01', '2024-01-01', 1)),
+    _q('patient_scans_next_page_undated', 'SELECT scan_id AS rowid, * FROM mri_scans WHERE patient_id = ? '
+       'AND scan_date IS NULL AND scan_id > ? ORDER BY scan_date DESC, scan_id', (1, 1)),
+    _q('delete_select_scans', 'SELECT scan_id, original_path, processed_path FROM scans WHERE patient_id = ?', (1,)),
+    _q('delete_scans', 'DELETE FROM scans WHERE patient_id = ?', (1,)),
+    # run by the ON DELETE CASCADE for every deleted scan
+    _q('cascade_classifications', 'DELETE FROM tumor_classification WHERE scan_id = ?', (1,)),
+    _q('upsert_patient', 'INSERT INTO patients (patient_id, gender, created_on) VALUES (?, ?, ?) '
+       'ON CONFLICT (patient_id) DO UPDATE SET gender = COALESCE(excluded.gender, patients.gender)', (1, 'F', '')),
+    _q('get_image', 'SELECT original_path, processed_path, label FROM scans WHERE scan_id = ?', (1,)),
+    _q('classify_select', 'SELECT processed_path, original_path, phash, dhash FROM scans WHERE scan_id = ?', (1,)),
+    _q('classify_update_label', 'UPDATE scans SET label = ? WHERE scan_id = ?', ('no_tumor', 1)),
+    _q('classification_history', 'SELECT * FROM tumor_classification WHERE scan_id = ? ORDER BY classification_id DESC', (1,)),
+    _q('prediction_cache_lookup', 'SELECT classification_id, scan_id, processed_path, predicted_label, confidence '
+       'FROM tumor_classification WHERE image_sha256 = ? AND model_version = ? '
+       'ORDER BY classification_id DESC LIMIT 1', ('0' * 64, 'v')),
+    _q('bulk_select_ids', 'SELECT scan_id, original_path, processed_path, content_sha256 FROM scans WHERE scan_id IN (?, ?)', (1, 2)),
+    _q('bulk_select_unlabeled', 'SELECT scan_id, original_path, processed_path, content_sha256 FROM scans WHERE label IS NULL ORDER BY scan_id'),
+    _q('bulk_select_all', 'SELECT scan_id, original_path, processed_path, content_sha256 FROM scans ORDER BY scan_id', full_scan_ok=True),
+    # bulk ingest: patient id allocation, account check and the chunk's new scan ids
+    _q('allocate_patient_ids', 'SELECT MAX(patient_id) FROM patients'),
+    _q('allocate_patient_ids_users', 'SELECT MAX(patient_id) FROM users'),
+    _q('bulk_ingest_patient_account', 'SELECT 1 FROM users WHERE patient_id = ? LIMIT 1', (1,)),
+    # one row per AUTOINCREMENT table
+    _q('bulk_ingest_last_scan_id', "SELECT seq FROM sqlite_sequence WHERE name = 'scans'", full_scan_ok=True),
+    # load-scans (scan_loader.py): existing keys of a chunk, changed rows, checkpoints
+    _q('load_existing_keys', 'SELECT source_key, content_sha256, original_path, processed_path FROM scans '
+       'WHERE source_key IN (?, ?)', ('a/1.jpg', 'a/2.jpg')),
+    _q('load_update_scan', 'UPDATE scans SET original_path = ?, processed_path = ?, label = ?, orig_width = ?, '
+       'orig_height = ?, proc_width = ?, proc_height = ?, mean_pixel = ?, std_pixel = ?, ingest_timestamp = ?, '
+       'content_sha256 = ?, phash = NULL, dhash = NULL WHERE source_key = ?',
+       ('', '', '', 1, 1, 1, 1, 0.0, 0.0, '', '', 'a/1.jpg')),
+    _q('load_checkpoint', 'SELECT fingerprint, records_done FROM load_checkpoints WHERE source = ?', ('m.csv',)),
+    _q('load_checkpoint_delete', 'DELETE FROM load_checkpoints WHERE source = ?', ('m.csv',)),
+    # near-duplicate index (perceptual_hash.py): load, refresh, reuse of a duplicate's prediction
+    _q('near_duplicate_load', 'SELECT scan_id, phash, dhash FROM scans WHERE phash IS NOT NULL'),
+    _q('near_duplicate_new', 'SELECT scan_id, phash, dhash FROM scans WHERE scan_id > ? AND phash IS NOT NULL', (1,)),
+    _q('near_duplicate_count', 'SELECT COUNT(*) FROM scans WHERE phash IS NOT NULL'),
+    _q('near_duplicate_own_classification', 'SELECT 1 FROM tumor_classification WHERE scan_id = ? AND model_version = ? '
+       'LIMIT 1', (1, 'v')),
+    _q('near_duplicate_scan_patient', 'SELECT patient_id, processed_path FROM scans WHERE scan_id = ?', (1,)),
+    _q('near_duplicate_classification', 'SELECT c.classification_id, c.predicted_label, c.confidence, '
+       'COALESCE(c.source_classification_id, c.classification_id) '
+       'FROM tumor_classification c JOIN scans s ON s.scan_id = c.scan_id '
+       'WHERE c.scan_id = ? AND c.model_version = ? AND s.patient_id = ? '
+       'ORDER BY c.classification_id DESC LIMIT 1', (1, 'v', 1)),
+    _q('near_duplicate_members', 'SELECT scan_id, patient_id, label, source_key, original_path FROM scans '
+       'WHERE scan_id IN (?, ?)', (1, 2)),
+    # hash-scans: rows without hashes (or all of them with --rehash), then one update per scan
+    _q('hash_scans_missing', 'SELECT scan_id, original_path, processed_path FROM scans WHERE phash IS NULL '
+       'ORDER BY scan_id', full_scan_ok=True),
+    _q('hash_scans_all', 'SELECT scan_id, original_path, processed_path FROM scans ORDER BY scan_id', full_scan_ok=True),
+    _q('hash_scans_update', 'UPDATE scans SET phash = ?, dhash = ? WHERE scan_id = ?', (1, 1, 1)),
+    # every bucket row; bounded by the number of distinct buckets, not scans
+    _q('dashboard_stats', 'SELECT dimension, bucket, label, scans, area_sum, area_count FROM scan_stats WHERE scans > 0',
+       full_scan_ok=True),
+    # database console presets (through the mri_scans view); ordering the handful of groups by count afterwards is cheap
+    _q('dashboard_by_label', 'SELECT label, COUNT(*) AS total_cases FROM mri_scans GROUP BY label'),
+    _q('dashboard_by_unit', 'SELECT hospital_unit, COUNT(*) AS count FROM mri_scans GROUP BY hospital_unit'),
+    _q('console_glioma_over_50', "SELECT processed_path, age, gender, hospital_unit FROM mri_scans "
+       "WHERE label = 'glioma_tumor' AND age > 50 LIMIT 100"),
+    # no index orders these groups; the dashboard reads the same counts from scan_stats
+    _q('console_by_age_group', "SELECT CASE WHEN age BETWEEN 20 AND 29 THEN '20s' WHEN age BETWEEN 30 AND 39 THEN '30s' "
+       "WHEN age BETWEEN 40 AND 49 THEN '40s' WHEN age BETWEEN 50 AND 59 THEN '50s' WHEN age BETWEEN 60 AND 69 "
+       "THEN '60s' ELSE '70s+' END AS age_group, label, AVG(orig_width * orig_height) AS avg_area, COUNT(*) AS cases "
+       "FROM mri_scans GROUP BY age_group, label ORDER BY age_group", full_scan_ok=True),
+    _q('console_by_gender', 'SELECT gender, label AS tumor_type, COUNT(*) AS total FROM mri_scans '
+       'GROUP BY gender, tumor_type ORDER BY gender', full_scan_ok=True),
+    _q('console_by_week', "SELECT STRFTIME('%Y-%W', scan_date) AS week, label AS tumor_type, COUNT(*) AS cases "
+       "FROM mri_scans GROUP BY week, tumor_type ORDER BY week", full_scan_ok=True),
+]
+
+_TEMP_BTREE = 'USE TEMP B-TREE'
+
+
+def explain(conn, sql, params=()):
+    """Return the EXPLAIN QUERY PLAN detail strings for `sql`."""
+    return [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()]
+
+
+def plan_problems(details, full_scan_ok=False):
+    """Problems in one plan: full table scans and temp B-trees.
+
+    `SCAN t USING INDEX` / `USING COVERING INDEX` walk an index and are fine;
+    a bare `SCAN t` reads the table itself.
+    """
+    problems = []
+    for detail in details:
+        if detail.startswith('SCAN ') and ' USING ' not in detail and not full_scan_ok:
+            problems.append(f'full table scan: {detail}')
+        elif detail.startswith(_TEMP_BTREE) and not full_scan_ok:
+            problems.append(f'sort without index: {detail}')
+    return problems
+
+
+def plan_warnings(details):
+    """Warnings for an ad-hoc query's plan: every table or index scan and every temp B-tree.
+
+    Stricter than plan_problems, where walking a whole covering index is fine
+    for the app's aggregate queries; in a console query it usually means a
+    missing WHERE clause or join condition.
+    """
+    warnings = []
+    for detail in details:
+        if detail.startswith('SCAN '):
+            kind = 'full index scan' if ' USING ' in detail else 'full table scan'
+            warnings.append(f'{kind}: {detail}')
+        elif detail.startswith(_TEMP_BTREE):
+            warnings.append(f'sort without index: {detail}')
+        elif 'AUTOMATIC' in detail:
+            warnings.append(f'temporary index built for this query: {detail}')
+    return warnings
+
+
+def check(conn, queries=None):
+    """Explain every query; return [(AppQuery, plan details, problems)]."""
+    results = []
+    for query in queries or APP_QUERIES:
+        try:
+            details = explain(conn, query.sql, query.params)
+        except Exception as e:
+            # tables the query needs are missing (e.g. a fresh database)
+            results.append((query, [], [f'cannot explain: {e}']))
+            continue
+        results.append((query, details, plan_problems(details, query.full_scan_ok)))
+    return results
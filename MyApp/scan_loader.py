@@ -0,0 +1,190 @@
+"""Streaming load of ETL output into the scans table.
+
+The notebook collected every metadata row in a DataFrame, replaced mri_scans
+with to_sql, read the table back to add synthetic demographics and replaced
+it again: memory grew with the dataset and a crash lost the whole load.
+Here records come from a generator (metadata.csv is read row by row) and are
+written `chunk_size` at a time, one transaction per chunk, so memory stays
+flat and readers keep seeing a complete table while a reload runs.
+
+Rows are keyed on source_key, the image's path below the image root, with
+content_sha256 recording what was loaded for it:
+
+- a new key inserts a scan, with synthetic demographics derived from the key
+  and the seed, so a resumed or repeated load assigns the same values;
+- a key whose content or paths changed gets its ETL columns updated (and
+  its perceptual hashes cleared) and keeps its patient, age, unit and date;
+- an unchanged key is not written at all.
+
+The number of records done is saved in load_checkpoints in the same
+transaction as each chunk, so an interrupted load resumes after the last
+committed chunk.
+"""
+import csv
+import os
+import random
+import time
+from datetime import datetime, timedelta
+from itertools import islice
+
+HOSPITAL_UNITS = (('Neuro', 0.5), ('Radiology', 0.3), ('Oncology', 0.2))
+ETL_COLUMNS = ('original_path', 'processed_path', 'label', 'orig_width', 'orig_height', 'proc_width',
+               'proc_height', 'mean_pixel', 'std_pixel', 'ingest_timestamp', 'content_sha256')
+_INTEGER_COLUMNS = ('orig_width', 'orig_height', 'proc_width', 'proc_height')
+_REAL_COLUMNS = ('mean_pixel', 'std_pixel')
+
+
+class LoadError(ValueError):
+    """A record cannot be loaded."""
+
+
+def file_fingerprint(path):
+    """Cheap identity of an input file: a checkpoint is only resumed against the same file."""
+    st = os.stat(path)
+    return f'{st.st_size}:{st.st_mtime_ns}'
+
+
+def iter_metadata(path):
+    """Records of an etl.py metadata.csv, one at a time."""
+    with open(path, newline='') as f:
+        yield from csv.DictReader(f)
+
+
+def synthetic_demographics(source_key, seed, today):
+    """The notebook's synthetic patient fields, reproducible per (seed, source_key)."""
+    rng = random.Random(f'{seed}:{source_key}')
+    units, weights = zip(*HOSPITAL_UNITS)
+    return {
+        'patient_id': rng.randint(1000, 9999),
+        'age': rng.randint(20, 79),
+        'gender': rng.choice('MF'),
+        'hospital_unit': rng.choices(units, weights)[0],
+        'scan_date': (today - timedelta(days=rng.randint(0, 730))).strftime('%Y-%m-%d'),
+    }
+
+
+def _portable(path, base_dir):
+    """Paths below base_dir are stored relative to it, like the app's own upload paths."""
+    if path and base_dir and os.path.isabs(path):
+        rel = os.path.relpath(path, base_dir)
+        if not rel.startswith('..'):
+            return rel.replace(os.sep, '/')
+    return path
+
+
+def _record(row, number, base_dir):
+    key = (row.get('source_key') or '').strip()
+    if not key:
+        raise LoadError(f'record {number} has no source_key')
+    record = {'source_key': key}
+    for column in ETL_COLUMNS:
+        value = row.get(column)
+        value = None if value in (None, '') else value
+        try:
+            if value is not None and column in _INTEGER_COLUMNS:
+                value = int(value)
+            elif value is not None and column in _REAL_COLUMNS:
+                value = float(value)
+        except ValueError:
+            raise LoadError(f'record {number}: {column} must be a number')
+        record[column] = value
+    record['original_path'] = _portable(record['original_path'], base_dir)
+    record['processed_path'] = _portable(record['processed_path'], base_dir)
+    return record
+
+
+def _write_chunk(conn, chunk, demographics, seed, today):
+    """Insert new keys and update changed ones; returns (inserted, updated, unchanged)."""
+    chunk = list({record['source_key']: record for record in chunk}.values())  # last record per key wins
+    existing = {}
+    keys = [record['source_key'] for record in chunk]
+    for i in range(0, len(keys), 500):
+        part = keys[i:i + 500]
+        placeholders = ','.join('?' for _ in part)
+        for key, sha256, original_path, processed_path in conn.execute(
+                f'SELECT source_key, content_sha256, original_path, processed_path FROM scans '
+                f'WHERE source_key IN ({placeholders})', part):
+            existing[key] = (sha256, original_path, processed_path)
+
+    new, changed = [], []
+    for record in chunk:
+        old = existing.get(record['source_key'])
+        if old is None:
+            new.append(record)
+        elif old != (record['content_sha256'], record['original_path'], record['processed_path']):
+            changed.append(record)
+
+    if new:
+        created_on = today.isoformat()
+        for record in new:
+            if demographics:
+                record.update(synthetic_demographics(record['source_key'], seed, today))
+            else:
+                record.update(patient_id=None, age=None, gender=None, hospital_unit=None, scan_date=None)
+        # each scan keeps its own synthetic gender; the patient's derived one is the first scan's
+        conn.executemany('INSERT INTO patients (patient_id, gender, created_on) VALUES (?, ?, ?) '
+                         'ON CONFLICT (patient_id) DO NOTHING',
+                         [(r['patient_id'], r['gender'], created_on) for r in new if r['patient_id'] is not None])
+        columns = ('patient_id', 'age', 'gender', 'hospital_unit', 'scan_date', 'source_key') + ETL_COLUMNS
+        conn.executemany(f"INSERT INTO scans ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})",
+                         [tuple(r[c] for c in columns) for r in new])
+    if changed:
+        # new content: the perceptual hashes are recomputed by hash-scans
+        conn.executemany(f"UPDATE scans SET {', '.join(c + ' = ?' for c in ETL_COLUMNS)}, phash = NULL, dhash = NULL "
+                         f"WHERE source_key = ?",
+                         [tuple(r[c] for c in ETL_COLUMNS) + (r['source_key'],) for r in changed])
+    return len(new), len(changed), len(chunk) - len(new) - len(changed)
+
+
+def load(conn, records, source, fingerprint, chunk_size=1000, seed=42, demographics=True, restart=False,
+         base_dir=None, progress=None):
+    """Stream `records` (dicts with source_key and the ETL columns) into scans.
+
+    `source` names the input in load_checkpoints and `fingerprint` identifies
+    its contents; a checkpoint left by an interrupted load of the same input
+    is resumed unless `restart`. Returns counts, the record the load resumed
+    from and rows/second.
+    """
+    started = time.perf_counter()
+    today = datetime.utcnow()
+    previous_isolation = conn.isolation_level
+    conn.isolation_level = None  # explicit BEGIN/COMMIT per chunk
+    counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+    try:
+        done = 0
+        if not restart:
+            row = conn.execute('SELECT fingerprint, records_done FROM load_checkpoints WHERE source = ?',
+                               (source,)).fetchone()
+            if row and row[0] == fingerprint:
+                done = row[1]
+        resumed_from = done
+        records = islice(records, done, None)
+        while True:
+            chunk = [_record(row, done + i + 1, base_dir) for i, row in enumerate(islice(records, chunk_size))]
+            if not chunk:
+                break
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                inserted, updated, unchanged = _write_chunk(conn, chunk, demographics, seed, today)
+                done += len(chunk)
+                conn.execute('INSERT INTO load_checkpoints (source, fingerprint, records_done, updated_on) '
+                             'VALUES (?, ?, ?, ?) ON CONFLICT (source) DO UPDATE SET fingerprint = excluded.fingerprint, '
+                             'records_done = excluded.records_done, updated_on = excluded.updated_on',
+                             (source, fingerprint, done, datetime.utcnow().isoformat()))
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            counts['inserted'] += inserted
+            counts['updated'] += updated
+            counts['unchanged'] += unchanged
+            if progress:
+                progress(done, time.perf_counter() - started)
+        conn.execute('DELETE FROM load_checkpoints WHERE source = ?', (source,))
+    finally:
+        conn.isolation_level = previous_isolation
+
+    elapsed = time.perf_counter() - started
+    loaded = done - resumed_from
+    return dict(counts, records=done, resumed_from=resumed_from, seconds=round(elapsed, 3),
+                rows_per_sec=round(loaded / elapsed, 1) if elapsed > 0 else None)
@@ -3,6 +3,10 @@ const executeBtn = document.getElementById('execute-btn');
 const resultsContainer = document.getElementById('results-container');
 const sampleQueryBtns = document.querySelectorAll('.sample-query-btn');
 
+// Endpoint and body of the last search/query, re-posted with next_cursor by "Load more"
+let lastRequest = null;
+let shownRows = 0;
+
 // Handle sample query buttons
 sampleQueryBtns.forEach(btn => {
   btn.addEventListener('click', function() {
@@ -34,6 +38,7 @@ if (findPatientSubmit && findPatientInput) {
 
       const result = await resp.json();
       if (resp.ok && result.success) {
+        lastRequest = { url: '/find_scans_by_patient', body: { patient_id: pid } };
         displayResults(result);
       } else {
         displayError(result.error || 'No results returned');
@@ -118,6 +123,7 @@ executeBtn.addEventListener('click', async function() {
     const result = await response.json();
     
     if (result.success) {
+      lastRequest = { url: '/execute_query', body: { query: query } };
       displayResults(result);
     } else {
       displayError(result.error);
@@ -130,16 +136,48 @@ executeBtn.addEventListener('click', async function() {
   }
 });
 
+// Show the query plan and index warnings without running the query
+const explainBtn = document.getElementById('explain-btn');
+if (explainBtn) {
+  explainBtn.addEventListener('click', async function() {
+    const query = queryInput.value.trim();
+    if (!query) {
+      alert('Please enter a query');
+      return;
+    }
+
+    try {
+      const resp = await fetch('/execute_query', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ query: query, explain: true })
+      });
+      const result = await resp.json();
+      if (!result.success) {
+        displayError(result.error);
+        return;
+      }
+      let html = '<div class="results-info">Query plan</div><pre class="query-plan">' +
+        result.plan.map(escapeHtml).join('\n') + '</pre>';
+      if (result.warnings.length > 0) {
+        html += '<div class="error-message">' + result.warnings.map(escapeHtml).join('<br>') + '</div>';
+      }
+      resultsContainer.innerHTML = html;
+    } catch (err) {
+      displayError('Network error: ' + err.message);
+    }
+  });
+}
+
 function displayResults(result) {
   if (result.count === 0) {
     resultsContainer.innerHTML = '<p class="no-results">Query executed successfully but returned no results.</p>';
     return;
   }
   
+  shownRows = 0;
   let html = `
-    <div class="results-info">
-      Query executed successfully. Returned ${result.count} row${result.count !== 1 ? 's' : ''}.
-    </div>
+    <div class="results-info"></div>
     <div style="overflow-x: auto;">
       <table class="results-table">
         <thead>
@@ -147,9 +185,19 @@ function displayResults(result) {
             ${result.columns.map(col => `<th>${escapeHtml(col)}</th>`).join('')}
           </tr>
         </thead>
-        <tbody>
+        <tbody></tbody>
+      </table>
+    </div>
+    <div class="load-more" style="margin-top:8px;"></div>
   `;
   
+  resultsContainer.innerHTML = html;
+  appendResults(result);
+}
+
+// Add one page of rows to the table shown by displayResults
+function appendResults(result) {
+  let html = '';
   result.data.forEach(row => {
     html += '<tr>';
     result.columns.forEach(col => {
@@ -158,14 +206,43 @@ function displayResults(result) {
     });
     html += '</tr>';
   });
-  
-  html += `
-        </tbody>
-      </table>
-    </div>
-  `;
-  
-  resultsContainer.innerHTML = html;
+  resultsContainer.querySelector('.results-table tbody').insertAdjacentHTML('beforeend', html);
+  shownRows += result.count;
+
+  const more = result.has_more ? ' More rows are available.' : (result.truncated ? ' Row limit reached; add a LIMIT or WHERE clause.' : '');
+  const cached = result.cache && result.cache.hit ? ` (cached result, ${Math.round(result.cache.age_seconds)}s old)` : '';
+  resultsContainer.querySelector('.results-info').textContent =
+    `Query executed successfully. Showing ${shownRows} row${shownRows !== 1 ? 's' : ''}.${more}${cached}`;
+
+  const loadMore = resultsContainer.querySelector('.load-more');
+  loadMore.innerHTML = '';
+  if (result.has_more && lastRequest) {
+    const btn = document.createElement('button');
+    btn.className = 'secondary-button';
+    btn.textContent = 'Load more';
+    btn.addEventListener('click', () => loadMoreResults(btn, result.next_cursor));
+    loadMore.appendChild(btn);
+  }
+}
+
+async function loadMoreResults(btn, cursor) {
+  btn.disabled = true;
+  btn.textContent = 'Loading...';
+  try {
+    const resp = await fetch(lastRequest.url, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ ...lastRequest.body, cursor: cursor })
+    });
+    const result = await resp.json();
+    if (result.success) {
+      appendResults(result);
+    } else {
+      displayError(result.error || 'Failed to load more rows');
+    }
+  } catch (err) {
+    displayError('Network error: ' + err.message);
+  }
 }
 
 function displayError(errorMessage) {
@@ -230,12 +307,23 @@ if (submitPatientBtn) {
           this.disabled = true;
           this.textContent = 'Predicting...';
           try {
-            const presp = await fetch('/predict_scan', {
+            // Queue the prediction and poll for the result so the server never holds a request open for inference
+            const jresp = await fetch('/predict_jobs', {
               method: 'POST',
               headers: { 'Content-Type': 'application/json' },
               body: JSON.stringify({ scan_id: data.scan_id })
             });
-            const pres = await presp.json();
+            const job = await jresp.json();
+            if (jresp.status === 429) {
+              patientResponse.innerHTML += `<div class="error-message">The model is busy, please try again shortly.</div>`;
+              return;
+            }
+            if (!job.success) {
+              patientResponse.innerHTML += `<div class="error-message">Prediction failed: ${job.error}</div>`;
+              return;
+            }
+
+            const pres = await pollPredictionJob(job.status_url);
             if (pres.success) {
               patientResponse.innerHTML += `<div class="results-info" style="margin-top:8px;">Prediction: <strong>${pres.predicted_label}</strong> (confidence: ${pres.confidence})</div>`;
             } else {
@@ -260,3 +348,15 @@ if (submitPatientBtn) {
     }
   });
 }
+
+// Poll a /predict_jobs/<id> status URL until the job finishes
+async function pollPredictionJob(statusUrl) {
+  while (true) {
+    await new Promise(resolve => setTimeout(resolve, 500));
+    const resp = await fetch(statusUrl);
+    const job = await resp.json();
+    if (!job.success) return job;
+    if (job.status === 'done') return job.result;
+    if (job.status === 'failed') return { success: false, error: job.error };
+  }
+}
@@ -1,29 +1,53 @@
 const recordsContainer = document.getElementById('records-container');
+const loadMoreContainer = document.getElementById('records-load-more');
 
-// Load patient records on page load
-document.addEventListener('DOMContentLoaded', async function() {
+// Load the first page of patient records on page load
+document.addEventListener('DOMContentLoaded', function() {
+  loadRecords(null);
+});
+
+// Records come in pages; each page is shown as it arrives and "Load more" fetches the next one
+async function loadRecords(cursor) {
+  const btn = loadMoreContainer.querySelector('button');
+  if (btn) {
+    btn.disabled = true;
+    btn.textContent = 'Loading...';
+  }
   try {
-    const response = await fetch('/patient_records');
+    const url = cursor ? `/patient_records?cursor=${encodeURIComponent(cursor)}` : '/patient_records';
+    const response = await fetch(url);
     const result = await response.json();
     
-    if (result.success) {
-      displayRecords(result.records);
-    } else {
+    if (!result.success) {
       displayError(result.error || 'Failed to load records');
+      return;
     }
+    displayRecords(result.records, cursor !== null);
+    showLoadMore(result.next_cursor);
   } catch (error) {
     displayError('Network error: ' + error.message);
   }
-});
+}
+
+function showLoadMore(cursor) {
+  loadMoreContainer.innerHTML = '';
+  if (!cursor) return;
+  const btn = document.createElement('button');
+  btn.className = 'load-more-btn';
+  btn.textContent = 'Load more';
+  btn.addEventListener('click', () => loadRecords(cursor));
+  loadMoreContainer.appendChild(btn);
+}
 
-function displayRecords(records) {
-  if (records.length === 0) {
-    recordsContainer.innerHTML = '<p class="no-records">No MRI scan records found for your patient ID.</p>';
-    return;
+function displayRecords(records, append) {
+  if (!append) {
+    if (records.length === 0) {
+      recordsContainer.innerHTML = '<p class="no-records">No MRI scan records found for your patient ID.</p>';
+      return;
+    }
+    recordsContainer.innerHTML = '';
   }
   
-  recordsContainer.innerHTML = '';
-  
   records.forEach(record => {
     const card = document.createElement('div');
     card.className = 'record-card';
@@ -33,7 +57,7 @@ function displayRecords(records) {
     
     card.innerHTML = `
       <div class="record-image">
-        <img src="${record.image_url}" alt="${escapeHtml(displayLabel)}" class="mri-thumbnail" />
+        <img src="${record.image_url}?size=thumb" data-full-src="${record.image_url}" alt="${escapeHtml(displayLabel)}" class="mri-thumbnail" loading="lazy" />
       </div>
       <div class="record-header">
         <span class="record-label ${labelClass}">${escapeHtml(displayLabel)}</span>
@@ -57,16 +81,13 @@ function displayRecords(records) {
       
     `;
     
+    // Open the full-size image from the thumbnail
+    card.querySelector('.mri-thumbnail').addEventListener('click', function(e) {
+      showImageModal(this.dataset.fullSrc || this.src, this.alt);
+    });
+    
     recordsContainer.appendChild(card);
   });
-
-    // Attach click handlers to thumbnails (delegation alternative)
-    const thumbnails = recordsContainer.querySelectorAll('.mri-thumbnail');
-    thumbnails.forEach(img => {
-      img.addEventListener('click', function(e) {
-        showImageModal(this.src, this.alt);
-      });
-    });
 }
 
 function displayError(errorMessage) {
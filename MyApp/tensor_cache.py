@@ -0,0 +1,118 @@
+"""Cache of model-ready image tensors keyed by scan id.
+
+`submit_patient_scan` decodes each upload once and stores the resized uint8
+model input here, so a later `predict_scan` for the same scan skips the disk
+read, decode and resize. Entries are held in a byte-bounded LRU and, when a
+cache directory is configured, also written as .npz files that survive
+restarts and are shared between worker processes.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class TensorCache:
+    """Byte-bounded in-memory LRU with an optional on-disk layer."""
+
+    def __init__(self, max_bytes=256 * 2 ** 20, cache_dir=None):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir or None
+        self._entries = OrderedDict()  # scan_id -> (pixels, image_sha256)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _disk_path(self, scan_id):
+        return os.path.join(self.cache_dir, f"{int(scan_id)}.npz")
+
+    def put(self, scan_id, pixels, image_sha256):
+        scan_id = int(scan_id)
+        with self._lock:
+            self._store(scan_id, (pixels, image_sha256))
+        if self.cache_dir:
+            try:
+                tmp = self._disk_path(scan_id) + '.tmp'
+                with open(tmp, 'wb') as f:
+                    np.savez(f, pixels=pixels, image_sha256=np.array(image_sha256))
+                os.replace(tmp, self._disk_path(scan_id))
+            except OSError as e:
+                print(f"⚠️  Could not write tensor cache entry for scan {scan_id}: {e}")
+
+    def get(self, scan_id):
+        """Return (uint8 pixels, image_sha256) or None."""
+        scan_id = int(scan_id)
+        with self._lock:
+            entry = self._entries.get(scan_id)
+            if entry is not None:
+                self._entries.move_to_end(scan_id)
+                self.hits += 1
+                return entry
+
+        if self.cache_dir:
+            try:
+                with np.load(self._disk_path(scan_id)) as data:
+                    entry = (data['pixels'], str(data['image_sha256']))
+                with self._lock:
+                    self.disk_hits += 1
+                    self._store(scan_id, entry)
+                return entry
+            except (OSError, KeyError, ValueError):
+                pass
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def evict(self, scan_ids):
+        for scan_id in scan_ids:
+            scan_id = int(scan_id)
+            with self._lock:
+                entry = self._entries.pop(scan_id, None)
+                if entry is not None:
+                    self._bytes -= entry[0].nbytes
+            if self.cache_dir:
+                try:
+                    os.remove(self._disk_path(scan_id))
+                except OSError:
+                    pass
+
+    def clear(self):
+        """Drop every entry, on disk too (scan ids no longer match their images after a restore)."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        if self.cache_dir:
+            for name in os.listdir(self.cache_dir):
+                if name.endswith('.npz'):
+                    try:
+                        os.remove(os.path.join(self.cache_dir, name))
+                    except OSError:
+                        pass
+
+    def _store(self, scan_id, entry):
+        old = self._entries.pop(scan_id, None)
+        if old is not None:
+            self._bytes -= old[0].nbytes
+        self._entries[scan_id] = entry
+        self._bytes += entry[0].nbytes
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            _, (pixels, _) = self._entries.popitem(last=False)
+            self._bytes -= pixels.nbytes
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'disk_dir': self.cache_dir,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+            }
@@ -0,0 +1,375 @@
+"""Memory-mapped, model-ready tensor shards of the training images.
+
+predict_tumor, bulk prediction and ImprovedTumorTrainer (model/EDS.ipynb)
+all feed Xception 299x299 RGB input, and each of them decoded and resized
+the source JPEG again. This packs every image in training_images/<class>/
+once, exactly as decode_for_model prepares it (cv2 decode, RGB, resize to
+MODEL_INPUT_SIZE), into fixed-shape uint8 arrays:
+
+    shards/shard_00000.npy   (SHARD_ROWS, 299, 299, 3) uint8, opened with numpy.memmap
+    shards/index.json        source_key -> shard, row, label, scan_id, digests
+
+ShardDataset maps the shards read-only and yields batches without decoding;
+runs of consecutive rows are views into the page cache, so a sequential
+pass copies nothing until preprocess_batch converts to float.
+
+The build is incremental like etl.py: a file whose size and mtime are
+unchanged is skipped, a touched file is re-hashed and only re-decoded if its
+bytes changed, a changed image is rewritten in its own slot and a deleted
+image frees its slot for the next new one. Shards are flushed before the
+index is checkpointed, so an interrupted build resumes without re-decoding
+what it already wrote. scan_id comes from scans.source_key when a database
+is given (-1 for images that are not loaded).
+
+Usage:
+    python tensor_shards.py
+    python tensor_shards.py --source training_images --output processed_training/shards --database brain_etl.db
+    python tensor_shards.py --force      # rebuild everything
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+from etl import DEFAULT_SOURCE, scan_sources
+from prediction_cache import image_digest
+from preprocessing import MODEL_INPUT_SIZE
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_OUTPUT = os.path.join(HERE, 'processed_training', 'shards')
+DEFAULT_DATABASE = os.path.join(HERE, 'brain_etl.db')
+CLASSES = ('glioma_tumor', 'meningioma_tumor', 'no_tumor', 'pituitary_tumor')  # model output order, as app.TUMOR_CLASSES
+SHARD_ROWS = 1024  # x ROW_BYTES = 262 MiB per shard
+ROW_SHAPE = (MODEL_INPUT_SIZE[1], MODEL_INPUT_SIZE[0], 3)
+ROW_BYTES = ROW_SHAPE[0] * ROW_SHAPE[1] * ROW_SHAPE[2]
+INDEX_VERSION = 1
+
+
+def shard_path(shard_dir, shard):
+    return os.path.join(shard_dir, f'shard_{shard:05d}.npy')
+
+
+def new_index():
+    return {'version': INDEX_VERSION, 'row_shape': list(ROW_SHAPE), 'shard_rows': SHARD_ROWS,
+            'classes': list(CLASSES), 'shards': 0, 'rows_used': 0, 'free': [], 'entries': {}}
+
+
+def load_index(shard_dir):
+    """The index.json dict; a fresh one if missing or built for another shape or shard size."""
+    try:
+        with open(os.path.join(shard_dir, 'index.json')) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return new_index()
+    if (index.get('version') != INDEX_VERSION or index.get('row_shape') != list(ROW_SHAPE)
+            or index.get('shard_rows') != SHARD_ROWS):
+        return new_index()
+    return index
+
+
+def save_index(shard_dir, index):
+    index['updated_on'] = datetime.utcnow().isoformat()
+    tmp = os.path.join(shard_dir, 'index.json.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp, os.path.join(shard_dir, 'index.json'))
+
+
+def pack_image_worker(job):
+    """Process-pool entry point: hash one source file and, unless its bytes are known, decode it for the model.
+
+    job = (relative path, source path, known file sha256 or None).
+    Returns (relative path, status, file sha256, uint8 pixels, decoded-pixel sha256, error)
+    with status 'packed', 'unchanged' or 'failed'.
+    """
+    rel_path, src_path, known_sha256 = job
+    try:
+        with open(src_path, 'rb') as f:
+            data = f.read()
+        sha256 = hashlib.sha256(data).hexdigest()
+        if sha256 == known_sha256:
+            return rel_path, 'unchanged', sha256, None, None, None
+        # same steps as preprocessing.decode_for_model, so digests match the prediction cache
+        img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            raise ValueError('not a readable image')
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        image_sha256 = image_digest(img)
+        return rel_path, 'packed', sha256, cv2.resize(img, MODEL_INPUT_SIZE), image_sha256, None
+    except Exception as e:
+        return rel_path, 'failed', None, None, None, str(e)
+
+
+class _ShardWriter:
+    """Hands out slots (free ones first) and writes rows through r+ memmaps."""
+
+    def __init__(self, shard_dir, index):
+        self.shard_dir = shard_dir
+        self.index = index
+        self._maps = {}
+
+    def _map(self, shard):
+        if shard not in self._maps:
+            path = shard_path(self.shard_dir, shard)
+            if shard >= self.index['shards'] or not os.path.exists(path):
+                self._maps[shard] = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8,
+                                                              shape=(SHARD_ROWS,) + ROW_SHAPE)
+                self.index['shards'] = max(self.index['shards'], shard + 1)
+            else:
+                self._maps[shard] = np.load(path, mmap_mode='r+')
+        return self._maps[shard]
+
+    def allocate(self):
+        if self.index['free']:
+            return tuple(self.index['free'].pop())
+        used = self.index['rows_used']
+        self.index['rows_used'] = used + 1
+        return divmod(used, SHARD_ROWS)
+
+    def write(self, slot, pixels):
+        self._map(slot[0])[slot[1]] = pixels
+
+    def flush(self):
+        for mm in self._maps.values():
+            mm.flush()
+
+    def close(self):
+        self.flush()
+        self._maps.clear()
+
+
+def attach_scan_ids(index, database):
+    """Set each entry's scan_id from scans.source_key (read-only); returns how many were found."""
+    entries = index['entries']
+    for entry in entries.values():
+        entry['scan_id'] = -1
+    if not database or not os.path.exists(database):
+        return 0
+    conn = sqlite3.connect(f'file:{database}?mode=ro', uri=True)
+    found = 0
+    try:
+        keys = list(entries)
+        for i in range(0, len(keys), 500):
+            part = keys[i:i + 500]
+            placeholders = ','.join('?' for _ in part)
+            for source_key, scan_id in conn.execute(
+                    f'SELECT source_key, scan_id FROM scans WHERE source_key IN ({placeholders})', part):
+                entries[source_key]['scan_id'] = scan_id
+                found += 1
+    except sqlite3.OperationalError as e:  # not migrated to source_key yet
+        print(f"⚠️  Could not read scan ids from {database}: {e}")
+    finally:
+        conn.close()
+    return found
+
+
+def build(source_dir=DEFAULT_SOURCE, shard_dir=DEFAULT_OUTPUT, database=None, workers=None, force=False,
+          checkpoint_every=512, progress=None):
+    """Bring the shards in shard_dir up to date with source_dir; returns counts and images/sec."""
+    started = time.perf_counter()
+    os.makedirs(shard_dir, exist_ok=True)
+    index = new_index() if force else load_index(shard_dir)
+    entries = index['entries']
+    sources = scan_sources(source_dir)
+    present = {rel for rel, *_ in sources}
+
+    removed = [rel for rel in entries if rel not in present]
+    for rel in removed:
+        entry = entries.pop(rel)
+        index['free'].append([entry['shard'], entry['row']])
+    if removed or force:
+        save_index(shard_dir, index)  # a slot is only rewritten once no saved entry points at it
+
+    jobs = []
+    stat_of = {}
+    for rel, label, size, mtime_ns in sources:
+        entry = entries.get(rel)
+        if entry and entry['size'] == size and entry['mtime_ns'] == mtime_ns and entry['label'] == label:
+            continue
+        stat_of[rel] = (label, size, mtime_ns)
+        jobs.append((rel, os.path.join(source_dir, rel), entry['sha256'] if entry else None))
+
+    counts = {'packed': 0, 'touched': 0, 'failed': 0}
+    errors = []
+    writer = _ShardWriter(shard_dir, index)
+    pool_started = time.perf_counter()
+    workers = max(1, min(workers or os.cpu_count() or 1, len(jobs) or 1))
+    try:
+        if jobs:
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            try:
+                chunksize = max(1, min(16, len(jobs) // (workers * 4)))
+                for done, (rel, status, sha256, pixels, image_sha256, error) in enumerate(
+                        pool.map(pack_image_worker, jobs, chunksize=chunksize), 1):
+                    label, size, mtime_ns = stat_of[rel]
+                    if status == 'failed':
+                        counts['failed'] += 1
+                        errors.append({'file': rel, 'error': error})
+                        entry = entries.pop(rel, None)
+                        if entry:
+                            index['free'].append([entry['shard'], entry['row']])
+                    elif status == 'unchanged':
+                        counts['touched'] += 1
+                        entries[rel].update(label=label, size=size, mtime_ns=mtime_ns)
+                    else:
+                        entry = entries.get(rel)
+                        slot = (entry['shard'], entry['row']) if entry else writer.allocate()
+                        writer.write(slot, pixels)
+                        counts['packed'] += 1
+                        entries[rel] = {'shard': slot[0], 'row': slot[1], 'label': label, 'size': size,
+                                        'mtime_ns': mtime_ns, 'sha256': sha256, 'image_sha256': image_sha256,
+                                        'scan_id': entry['scan_id'] if entry else -1}
+                    if checkpoint_every and done % checkpoint_every == 0:
+                        writer.flush()  # rows reach the files before the index points at them
+                        save_index(shard_dir, index)
+                    if progress:
+                        progress(done, len(jobs), time.perf_counter() - pool_started)
+            finally:
+                pool.shutdown()
+    finally:
+        writer.close()
+    pool_seconds = time.perf_counter() - pool_started
+
+    linked = attach_scan_ids(index, database)
+    save_index(shard_dir, index)
+    elapsed = time.perf_counter() - started
+    return {
+        'scanned': len(sources),
+        'unchanged': len(sources) - len(jobs) + counts['touched'],
+        'touched': counts['touched'],
+        'packed': counts['packed'],
+        'failed': counts['failed'],
+        'removed': len(removed),
+        'errors': errors,
+        'rows': len(entries),
+        'free_rows': len(index['free']),
+        'shards': index['shards'],
+        'with_scan_id': linked,
+        'workers': workers,
+        'seconds': round(elapsed, 3),
+        'images_per_sec': round(counts['packed'] / pool_seconds, 1) if counts['packed'] else None,
+    }
+
+
+class ShardDataset:
+    """Read-only view of a shard directory.
+
+    Rows are ordered by (shard, row). `pixels[i]`, `labels[i]` (index into
+    `classes`, -1 if unknown), `scan_ids[i]` (-1 if not loaded), `keys[i]`,
+    `sha256[i]` (of the source file, as scans.content_sha256) and
+    `image_sha256[i]` describe the same image.
+    """
+
+    def __init__(self, shard_dir=DEFAULT_OUTPUT):
+        with open(os.path.join(shard_dir, 'index.json')) as f:
+            index = json.load(f)
+        if index.get('version') != INDEX_VERSION or index.get('row_shape') != list(ROW_SHAPE):
+            raise ValueError(f'{shard_dir} was built for a different format; rebuild it with tensor_shards.py')
+        self.shard_dir = shard_dir
+        self.classes = tuple(index['classes'])
+        items = sorted(index['entries'].items(), key=lambda kv: (kv[1]['shard'], kv[1]['row']))
+        self.keys = [key for key, _ in items]
+        self.sha256 = [entry['sha256'] for _, entry in items]
+        self.image_sha256 = [entry['image_sha256'] for _, entry in items]
+        self.shards = np.array([entry['shard'] for _, entry in items], dtype=np.int32)
+        self.rows = np.array([entry['row'] for _, entry in items], dtype=np.int32)
+        class_index = {name: i for i, name in enumerate(self.classes)}
+        self.labels = np.array([class_index.get(entry['label'], -1) for _, entry in items], dtype=np.int64)
+        self.scan_ids = np.array([entry.get('scan_id', -1) for _, entry in items], dtype=np.int64)
+        self._maps = [np.load(shard_path(shard_dir, shard), mmap_mode='r') for shard in range(index['shards'])]
+        self._by_scan_id = {int(s): i for i, s in enumerate(self.scan_ids) if s >= 0}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def pixels(self, i):
+        """uint8 ROW_SHAPE view of row i."""
+        return self._maps[self.shards[i]][self.rows[i]]
+
+    def position(self, scan_id):
+        """Row index of a scan, or None."""
+        return self._by_scan_id.get(int(scan_id))
+
+    def take(self, positions):
+        """uint8 batch of the given rows: a view when they are consecutive in one shard, else one copy."""
+        positions = np.asarray(positions)
+        if len(positions) == 0:
+            return np.empty((0,) + ROW_SHAPE, dtype=np.uint8)
+        shards, rows = self.shards[positions], self.rows[positions]
+        if (shards == shards[0]).all() and (np.diff(rows) == 1).all():
+            return self._maps[shards[0]][rows[0]:rows[-1] + 1]
+        out = np.empty((len(positions),) + ROW_SHAPE, dtype=np.uint8)
+        order = np.lexsort((rows, shards))  # read each shard front to back
+        for j in order:
+            out[j] = self._maps[shards[j]][rows[j]]
+        return out
+
+    def batches(self, batch_size=32, shuffle=False, seed=None, labeled_only=False):
+        """Yield (uint8 pixels, labels, scan_ids) batches; feed pixels through preprocess_batch for the model.
+
+        Without `shuffle` batches follow shard order and are views whenever
+        the rows are contiguous (always, unless deletions left gaps).
+        """
+        positions = np.arange(len(self))
+        if labeled_only:
+            positions = positions[self.labels[positions] >= 0]
+        if shuffle:
+            np.random.default_rng(seed).shuffle(positions)
+        for i in range(0, len(positions), batch_size):
+            part = positions[i:i + batch_size]
+            yield self.take(part), self.labels[part], self.scan_ids[part]
+
+
+def open_dataset(shard_dir):
+    """ShardDataset for shard_dir, or None if no usable shards are there."""
+    if not shard_dir or not os.path.exists(os.path.join(shard_dir, 'index.json')):
+        return None
+    try:
+        return ShardDataset(shard_dir)
+    except (OSError, ValueError) as e:
+        print(f"⚠️  Tensor shards in {shard_dir} unusable: {e}")
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--source', default=DEFAULT_SOURCE, help='class-per-directory image root')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help='shard directory')
+    parser.add_argument('--database', default=os.environ.get('DATABASE_PATH') or DEFAULT_DATABASE,
+                        help='read scan ids from this database by source_key (read-only)')
+    parser.add_argument('--workers', type=int, default=None, help='processes (default: one per core)')
+    parser.add_argument('--force', action='store_true', help='ignore the index and rebuild everything')
+    parser.add_argument('--checkpoint-every', type=int, default=512, help='images between index checkpoints')
+    parser.add_argument('--report', default=None, help='write the summary to this JSON file')
+    args = parser.parse_args()
+
+    def progress(done, total, elapsed):
+        if done == total or done % 500 == 0:
+            print(f"  {done}/{total} images ({done / elapsed if elapsed > 0 else 0.0:.1f} images/sec)")
+
+    summary = build(args.source, args.output, database=args.database, workers=args.workers, force=args.force,
+                    checkpoint_every=args.checkpoint_every, progress=progress)
+
+    print(f"✓ {summary['scanned']} images: {summary['packed']} packed, {summary['unchanged']} unchanged "
+          f"({summary['touched']} re-hashed), {summary['removed']} removed, {summary['failed']} failed "
+          f"in {summary['seconds']:.1f}s ({summary['images_per_sec'] or 0:.1f} images/sec, {summary['workers']} workers)")
+    print(f"  {summary['rows']} rows in {summary['shards']} shards ({summary['free_rows']} free), "
+          f"{summary['with_scan_id']} linked to scans")
+    for err in summary['errors'][:20]:
+        print(f"⚠️  {err['file']}: {err['error']}")
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(summary, f, indent=2)
+        print(f"Report written to {args.report}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+"""Tests import the app's flat modules the way the app does (run: python -m pytest MyApp/tests)."""
+import os
+import sqlite3
+import sys
+
+import pytest
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    """app.py imported against an empty database, with uploads, caches and backups in a temp dir."""
+    root = tmp_path_factory.mktemp('app')
+    db_path = str(root / 'brain_etl.db')
+    sqlite3.connect(db_path).close()  # the app only migrates an existing file
+    os.environ.update({
+        'DATABASE_PATH': db_path,
+        'BACKUP_INTERVAL_HOURS': '0',
+        'BACKUP_DIR': str(root / 'backups'),
+        'DERIVATIVE_CACHE_DIR': str(root / 'derivative_cache'),
+        'BULK_INGEST_WORKERS': '1',
+        'BULK_PREDICT_WORKERS': '1',
+    })
+    cwd = os.getcwd()
+    os.chdir(root)  # UPLOAD_FOLDER is relative to the working directory
+    try:
+        import app
+    finally:
+        os.chdir(cwd)
+    app.app.config['UPLOAD_FOLDER'] = str(root / 'static' / 'uploads')
+    app.app.config['TESTING'] = True
+    return app
+
+
+@pytest.fixture
+def admin_client(app_module):
+    client = app_module.app.test_client()
+    with client.session_transaction() as session:
+        session['logged_in'] = True
+        session['user_type'] = 'admin'
+    return client
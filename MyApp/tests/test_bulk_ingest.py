@@ -0,0 +1,37 @@
+"""/bulk_ingest: large batches and the thumbnails it hands to the derivative cache."""
+import io
+
+import numpy as np
+from PIL import Image
+
+
+def tiny_png(seed):
+    pixels = np.random.default_rng(seed).integers(0, 255, (8, 8, 3), dtype=np.uint8)
+    out = io.BytesIO()
+    Image.fromarray(pixels).save(out, 'PNG')
+    return out.getvalue()
+
+
+def test_more_files_than_the_default_form_part_limit(app_module, admin_client):
+    count = app_module.app.config.get('MAX_FORM_PARTS', 1000) + 5
+    files = [(io.BytesIO(tiny_png(seed)), f'many_{seed}.png') for seed in range(count)]
+    resp = admin_client.post('/bulk_ingest', data={'mri_files': files}, content_type='multipart/form-data')
+    assert resp.status_code == 200, resp.status_code
+    body = resp.get_json()
+    assert body['summary']['ingested'] == count
+    assert all(item['success'] for item in body['items'])
+
+
+def test_thumbnails_are_seeded_into_the_derivative_cache(app_module, admin_client):
+    pixels = np.random.default_rng(7).integers(0, 255, (600, 400, 3), dtype=np.uint8)
+    data = io.BytesIO()
+    Image.fromarray(pixels).save(data, 'PNG')
+    data.seek(0)
+    resp = admin_client.post('/bulk_ingest', data={'mri_files': [(data, 'large.png')]}, content_type='multipart/form-data')
+    scan_id = resp.get_json()['items'][0]['scan_id']
+
+    renders = app_module.derivative_cache.renders
+    thumb = admin_client.get(f'/image/{scan_id}?size=thumb')
+    assert Image.open(io.BytesIO(thumb.data)).size == (171, 256)
+    thumb.close()
+    assert app_module.derivative_cache.renders == renders
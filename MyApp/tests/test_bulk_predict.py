@@ -0,0 +1,97 @@
+"""Bulk prediction stores one classification per scan and model version."""
+import sqlite3
+
+import numpy as np
+import pytest
+
+import bulk_predict
+from prediction_cache import PredictionCache
+
+CLASSES = ['glioma_tumor', 'meningioma_tumor', 'no_tumor', 'pituitary_tumor']
+
+
+class FakeModel:
+    def __init__(self):
+        self.images = 0
+
+    def predict(self, batch, verbose=0):
+        self.images += len(batch)
+        return np.tile(np.array([0.1, 0.7, 0.1, 0.1], dtype=np.float32), (len(batch), 1))
+
+
+class FakeShards:
+    """Stands in for tensor_shards.ShardDataset: every scan is packed, one sha per scan."""
+
+    def __init__(self, scan_ids):
+        self.index = {scan_id: i for i, scan_id in enumerate(scan_ids)}
+        self.sha256 = [f'file-{scan_id}' for scan_id in scan_ids]
+        self.image_sha256 = [f'sha-{scan_id}' for scan_id in scan_ids]
+
+    def position(self, scan_id):
+        return self.index.get(scan_id)
+
+    def pixels(self, position):
+        return np.full((299, 299, 3), position, dtype=np.uint8)
+
+
+def make_db(scan_ids):
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE scans (scan_id INTEGER PRIMARY KEY, original_path TEXT, processed_path TEXT, label TEXT, '
+                 'content_sha256 TEXT)')
+    conn.execute('CREATE TABLE tumor_classification (classification_id INTEGER PRIMARY KEY, scan_id INTEGER, '
+                 'processed_path TEXT, predicted_label TEXT, confidence REAL, model_name TEXT, classified_on TEXT, '
+                 'image_sha256 TEXT, model_version TEXT)')
+    conn.executemany('INSERT INTO scans (scan_id, original_path, processed_path, content_sha256) VALUES (?, ?, ?, ?)',
+                     [(s, f'{s}.jpg', f'{s}.jpg', f'file-{s}') for s in scan_ids])
+    return conn
+
+
+def run(conn, scan_ids, cache, model):
+    return bulk_predict.predict_scans(conn, bulk_predict.select_scans(conn), model, CLASSES, cache, 'test-model',
+                                      batch_size=4, shards=FakeShards(scan_ids), resolve_path=lambda *paths: None)
+
+
+def test_rerun_does_not_duplicate_classifications():
+    scan_ids = list(range(1, 11))
+    conn = make_db(scan_ids)
+    cache = PredictionCache()
+    cache.set_model_version('v1')
+    model = FakeModel()
+
+    first = run(conn, scan_ids, cache, model)
+    second = run(conn, scan_ids, cache, model)
+
+    assert first['predicted'] == 10 and second['cached'] == 10
+    assert model.images == 10
+    counts = conn.execute('SELECT scan_id, COUNT(*) FROM tumor_classification GROUP BY scan_id').fetchall()
+    assert counts == [(s, 1) for s in scan_ids]
+    assert conn.execute('SELECT COUNT(*) FROM scans WHERE label = ?', ('meningioma_tumor',)).fetchone()[0] == 10
+
+
+def test_replaced_images_are_not_read_from_stale_shards():
+    scan_ids = [1, 2, 3]
+    conn = make_db(scan_ids)
+    # scan 2's image changed after the shards were built; scan 3 was never hashed
+    conn.execute("UPDATE scans SET content_sha256 = 'file-2-new' WHERE scan_id = 2")
+    conn.execute('UPDATE scans SET content_sha256 = NULL WHERE scan_id = 3')
+    cache = PredictionCache()
+    cache.set_model_version('v1')
+
+    summary = run(conn, scan_ids, cache, FakeModel())
+
+    assert summary['from_shards'] == 1 and summary['stale_shard_rows'] == 2
+    # no local file for them here, so they fail instead of taking the old pixels
+    assert sorted(e['scan_id'] for e in summary['errors']) == [2, 3]
+    assert conn.execute('SELECT scan_id FROM tumor_classification').fetchall() == [(1,)]
+
+
+@pytest.mark.parametrize('body', [{'filter': 'all'}, {'filter': 'unlabeled'}, 'long_list'])
+def test_large_requests_are_queued(app_module, admin_client, body):
+    if body == 'long_list':
+        body = {'scan_ids': list(range(1, app_module.PREDICT_SCANS_INLINE_MAX + 2))}
+    resp = admin_client.post('/predict_scans', json=body)
+    assert resp.status_code == 202
+    body = resp.get_json()
+    assert body['success'] and body['status'] == 'queued'
+    job = admin_client.get(body['status_url']).get_json()
+    assert job['success'] and job['kind'] == 'predict_scans'
@@ -0,0 +1,15 @@
+"""Background credential fills keep running after a failed batch."""
+import pytest
+
+import passwords
+
+
+def test_failed_batch_does_not_block_later_fills(app_module, monkeypatch):
+    def locked(*args, **kwargs):
+        raise app_module.sqlite3.OperationalError('database is locked')
+
+    monkeypatch.setattr(passwords, 'fill_pending_credentials', locked)
+    app_module._credential_fill_scheduled = True
+    with pytest.raises(app_module.sqlite3.OperationalError):
+        app_module._fill_credentials_batch()
+    assert app_module._credential_fill_scheduled is False
@@ -0,0 +1,74 @@
+"""Upload files and their resized variants: served from the derivative cache, removed with the patient."""
+import io
+import os
+
+import numpy as np
+from PIL import Image
+
+
+def png(seed, size=32):
+    pixels = np.random.default_rng(seed).integers(0, 255, (size, size, 3), dtype=np.uint8)
+    out = io.BytesIO()
+    Image.fromarray(pixels).save(out, 'PNG')
+    return out.getvalue()
+
+
+def upload(client, seed, size=32):
+    resp = client.post('/submit_patient_scan', data={'mri_file': (io.BytesIO(png(seed, size)), f'delete_{seed}.png')},
+                       content_type='multipart/form-data')
+    assert resp.status_code == 200, resp.get_json()
+    return resp.get_json()
+
+
+def test_training_images_survive_patient_delete(app_module, admin_client, tmp_path):
+    patient_id = upload(admin_client, 1)['patient_id']
+    training_image = tmp_path / 'training_images' / 'glioma_tumor' / 'gg (1).jpg'
+    training_image.parent.mkdir(parents=True)
+    training_image.write_bytes(png(2))
+    with app_module.app.app_context():
+        db = app_module.get_db()
+        # a row rewritten by load-scans to resolve to a shared training image
+        db.execute('INSERT INTO scans (patient_id, original_path, processed_path, label) VALUES (?, ?, ?, ?)',
+                   (patient_id, str(training_image), str(training_image), 'glioma_tumor'))
+        db.commit()
+        uploaded = db.execute('SELECT original_path FROM scans WHERE patient_id = ? AND label IS NULL',
+                              (patient_id,)).fetchone()[0]
+    assert os.path.exists(uploaded)
+
+    resp = admin_client.post('/delete_scans_by_patient', json={'patient_id': patient_id})
+    body = resp.get_json()
+    assert body['success'] and body['deleted_count'] == 2
+    assert uploaded in body['removed_files']
+    assert str(training_image) not in body['removed_files']
+    assert not os.path.exists(uploaded)
+    assert training_image.exists()
+
+
+def test_upload_thumbnail_is_served_from_the_derivative_cache(app_module, admin_client):
+    cache = app_module.derivative_cache
+    scan = upload(admin_client, 3, size=1024)
+    assert scan['thumbnail_url'] == f"/image/{scan['scan_id']}?size=thumb"
+    renders = cache.renders
+    resp = admin_client.get(scan['thumbnail_url'])
+    assert resp.status_code == 200 and max(Image.open(io.BytesIO(resp.data)).size) == 256
+    resp.close()
+    assert cache.renders == renders  # seeded at upload, not rendered again
+    assert not os.path.exists(os.path.join(app_module.app.config['UPLOAD_FOLDER'], 'thumbnails'))
+
+
+def test_resized_variants_are_removed(app_module, admin_client):
+    cache = app_module.derivative_cache
+    scan = upload(admin_client, 4, size=1024)
+    for size in ('thumb', 'preview'):
+        resp = admin_client.get(f"/image/{scan['scan_id']}?size={size}")
+        assert resp.status_code == 200
+        resp.close()
+    with app_module.app.app_context():
+        uploaded = app_module.get_db().execute('SELECT original_path FROM scans WHERE scan_id = ?',
+                                               (scan['scan_id'],)).fetchone()[0]
+    variants = {os.path.basename(cache.variant_path(uploaded, size)) for size in ('thumb', 'preview')}
+    assert variants <= set(os.listdir(cache.cache_dir))
+
+    resp = admin_client.post('/delete_scans_by_patient', json={'patient_id': scan['patient_id']})
+    assert resp.get_json()['success']
+    assert not variants & set(os.listdir(cache.cache_dir))
@@ -0,0 +1,76 @@
+"""Migrating a copy of the shipped brain_etl.db must not change what the console's queries return."""
+import html
+import os
+import re
+import shutil
+import sqlite3
+
+import pytest
+
+import dashboard_stats
+import migrations
+from conftest import APP_DIR
+
+SHIPPED_DB = os.path.join(APP_DIR, 'brain_etl.db')
+
+
+def preset_queries():
+    """The sample queries offered by the database console."""
+    with open(os.path.join(APP_DIR, 'templates', 'database.html')) as f:
+        return [html.unescape(q) for q in re.findall(r'class="sample-query-btn" data-query="([^"]*)"', f.read())]
+
+
+@pytest.fixture
+def legacy_db(tmp_path):
+    if not os.path.exists(SHIPPED_DB):
+        pytest.skip('brain_etl.db not present')
+    path = str(tmp_path / 'brain_etl.db')
+    shutil.copyfile(SHIPPED_DB, path)
+    conn = sqlite3.connect(path)
+    if migrations.current_version(conn):
+        conn.close()
+        pytest.skip('brain_etl.db is already migrated')
+    yield conn
+    conn.close()
+
+
+def test_presets_return_the_same_rows(legacy_db):
+    queries = preset_queries()
+    assert queries
+    before = [legacy_db.execute(q).fetchall() for q in queries]
+    migrations.migrate(legacy_db)
+    after = [legacy_db.execute(q).fetchall() for q in queries]
+    for query, old, new in zip(queries, before, after):
+        assert new == old, query
+
+
+def test_view_keeps_every_legacy_column(legacy_db):
+    columns = ', '.join(migrations.MRI_SCANS_COLUMNS)
+    before = legacy_db.execute(f'SELECT rowid, {columns} FROM mri_scans ORDER BY rowid').fetchall()
+    migrations.migrate(legacy_db)
+    after = legacy_db.execute(f'SELECT scan_id, {columns} FROM mri_scans ORDER BY scan_id').fetchall()
+    assert after == before
+
+
+def test_patient_gender_is_latest_scan_value(legacy_db):
+    migrations.migrate(legacy_db)
+    rows = legacy_db.execute('''
+        SELECT p.patient_id, p.gender,
+               (SELECT s.gender FROM scans s WHERE s.patient_id = p.patient_id AND s.gender IS NOT NULL
+                ORDER BY s.scan_date DESC, s.scan_id DESC LIMIT 1)
+        FROM patients p''').fetchall()
+    assert rows
+    assert all(derived == latest for _, derived, latest in rows)
+
+
+def test_dashboard_stats_match_after_writes(legacy_db):
+    migrations.migrate(legacy_db)
+    assert dashboard_stats.verify(legacy_db) == []
+    patient_id = legacy_db.execute('SELECT patient_id FROM scans WHERE gender = ? LIMIT 1', ('F',)).fetchone()[0]
+    # a legacy insert through the view with a different gender counts under its own gender
+    legacy_db.execute('INSERT INTO mri_scans (patient_id, gender, label, age) VALUES (?, ?, ?, ?)',
+                      (patient_id, 'M', 'glioma_tumor', 60))
+    legacy_db.execute("UPDATE scans SET gender = 'F' WHERE scan_id = (SELECT MAX(scan_id) FROM scans)")
+    legacy_db.execute('DELETE FROM patients WHERE patient_id = ?', (patient_id,))
+    legacy_db.commit()
+    assert dashboard_stats.verify(legacy_db) == []
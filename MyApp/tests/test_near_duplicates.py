@@ -0,0 +1,52 @@
+"""Near-duplicate reuse: off by default, same patient only, and reused rows point at their source."""
+import io
+
+import numpy as np
+from PIL import Image
+
+
+def png(seed, size=64):
+    pixels = np.random.default_rng(seed).integers(0, 255, (size, size, 3), dtype=np.uint8)
+    out = io.BytesIO()
+    Image.fromarray(pixels).save(out, 'PNG')
+    return out.getvalue()
+
+
+def upload(client, data):
+    resp = client.post('/submit_patient_scan', data={'mri_file': (io.BytesIO(data), 'near_duplicate.png')},
+                       content_type='multipart/form-data')
+    assert resp.status_code == 200, resp.get_json()
+    return resp.get_json()
+
+
+def test_reuse_is_opt_in(app_module):
+    assert app_module.NEAR_DUPLICATE_REUSE is False
+
+
+def test_reuse_stays_within_the_patient(app_module, admin_client, monkeypatch):
+    monkeypatch.setattr(app_module.prediction_cache, 'model_version', 'near-duplicate-test')
+    image = png(20)
+    first = upload(admin_client, image)
+    other_patient = upload(admin_client, image)
+    assert other_patient['patient_id'] != first['patient_id']
+    with app_module.app.app_context():
+        db = app_module.get_db()
+        db.execute("INSERT INTO tumor_classification (scan_id, predicted_label, confidence, model_version) "
+                   "VALUES (?, 'glioma_tumor', 0.9, 'near-duplicate-test')", (first['scan_id'],))
+        source_id = db.execute('SELECT MAX(classification_id) FROM tumor_classification').fetchone()[0]
+        phash, dhash = db.execute('SELECT phash, dhash FROM scans WHERE scan_id = ?',
+                                  (other_patient['scan_id'],)).fetchone()
+        db.commit()
+
+        assert app_module.reuse_near_duplicate(db, other_patient['scan_id'], phash, dhash) is None
+
+        cur = db.execute('INSERT INTO scans (patient_id, processed_path, phash, dhash) VALUES (?, ?, ?, ?)',
+                         (first['patient_id'], 'same_patient.png', phash, dhash))
+        same_patient = cur.lastrowid
+        db.commit()
+        reused = app_module.reuse_near_duplicate(db, same_patient, phash, dhash)
+        assert reused['predicted_label'] == 'glioma_tumor'
+        assert reused['near_duplicate_of']['classification_id'] == source_id
+        row = db.execute('SELECT source_classification_id FROM tumor_classification WHERE classification_id = ?',
+                         (reused['classification_id'],)).fetchone()
+        assert row[0] == source_id
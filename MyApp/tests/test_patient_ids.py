@@ -0,0 +1,100 @@
+"""Single uploads and bulk ingest allocate patient ids from the same sequence."""
+import io
+
+import numpy as np
+from PIL import Image
+
+import bulk_ingest
+
+
+def png(seed):
+    pixels = np.random.default_rng(seed).integers(0, 255, (32, 32, 3), dtype=np.uint8)
+    out = io.BytesIO()
+    Image.fromarray(pixels).save(out, 'PNG')
+    return out.getvalue()
+
+
+def upload(client, seed):
+    resp = client.post('/submit_patient_scan', data={'mri_file': (io.BytesIO(png(seed)), f'single_{seed}.png'),
+                                                     'age': '40', 'gender': 'F'},
+                       content_type='multipart/form-data')
+    assert resp.status_code == 200, resp.get_json()
+    return resp.get_json()
+
+
+def bulk(client, seeds):
+    files = [(io.BytesIO(png(seed)), f'bulk_{seed}.png') for seed in seeds]
+    resp = client.post('/bulk_ingest', data={'mri_files': files}, content_type='multipart/form-data')
+    assert resp.status_code == 200, resp.get_json()
+    items = resp.get_json()['items']
+    assert all(item['success'] for item in items), items
+    return items
+
+
+def test_single_and_bulk_uploads_get_distinct_patients(app_module, admin_client):
+    first = upload(admin_client, 1)
+    items = bulk(admin_client, range(100, 130))
+    after_bulk = upload(admin_client, 2)
+    more = bulk(admin_client, range(200, 205))
+    last = upload(admin_client, 3)
+
+    uploads = [first, after_bulk, last] + items + more
+    patient_ids = [u['patient_id'] for u in uploads]
+    assert len(set(patient_ids)) == len(uploads)
+    assert all(u['username'] == f"patient_{u['patient_id']}" for u in uploads)
+
+    with app_module.app.app_context():
+        db = app_module.get_db()
+        placeholders = ','.join('?' for _ in patient_ids)
+        accounts = db.execute(f'SELECT patient_id, COUNT(*) FROM users WHERE patient_id IN ({placeholders}) '
+                              f'GROUP BY patient_id', patient_ids).fetchall()
+        scans = db.execute(f'SELECT patient_id, COUNT(*) FROM scans WHERE patient_id IN ({placeholders}) '
+                           f'GROUP BY patient_id', patient_ids).fetchall()
+    assert sorted(map(tuple, accounts)) == sorted((pid, 1) for pid in patient_ids)
+    assert sorted(map(tuple, scans)) == sorted((pid, 1) for pid in patient_ids)
+
+
+def test_allocation_skips_ids_held_by_accounts_only(app_module):
+    with app_module.app.app_context():
+        db = app_module.get_db()
+        largest = db.execute('SELECT MAX(patient_id) FROM patients').fetchone()[0] or 0
+        db.execute("INSERT INTO users (username, password_hash, password_salt, iterations, role, patient_id, created_on) "
+                   "VALUES (?, '', '', 0, 'patient', ?, '')", (f'orphan_{largest + 10 ** 9}', largest + 10 ** 9))
+        db.commit()
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            ids = bulk_ingest.allocate_patient_ids(db, 3)
+            db.rollback()
+            assert ids[0] > largest + 10 ** 9
+            assert ids == list(range(ids[0], ids[0] + 3))
+        finally:
+            db.execute("DELETE FROM users WHERE username LIKE 'orphan_%'")
+            db.commit()
+
+
+def test_taken_username_fails_instead_of_sharing_the_id(app_module, admin_client):
+    with app_module.app.app_context():
+        db = app_module.get_db()
+        # ids above the clock are allocated as largest + 1, so the next one is known
+        largest = db.execute('SELECT MAX(patient_id) FROM patients').fetchone()[0] + 10 ** 9
+        db.execute("INSERT INTO patients (patient_id, created_on) VALUES (?, '')", (largest,))
+        # an account named like the next patient but not linked to it
+        db.execute("INSERT INTO users (username, password_hash, password_salt, iterations, role, patient_id, created_on) "
+                   "VALUES (?, '', '', 0, 'patient', NULL, '')", (f'patient_{largest + 1}',))
+        db.commit()
+    try:
+        resp = admin_client.post('/submit_patient_scan',
+                                 data={'mri_file': (io.BytesIO(png(9)), 'clash.png')},
+                                 content_type='multipart/form-data')
+        assert resp.status_code == 409
+        with app_module.app.app_context():
+            db = app_module.get_db()
+            assert db.execute('SELECT COUNT(*) FROM users WHERE username LIKE ?',
+                              (f'patient_{largest + 1}%',)).fetchone()[0] == 1
+            assert db.execute('SELECT COUNT(*) FROM patients WHERE patient_id = ?', (largest + 1,)).fetchone()[0] == 0
+    finally:
+        with app_module.app.app_context():
+            db = app_module.get_db()
+            db.execute('DELETE FROM users WHERE username = ?', (f'patient_{largest + 1}',))
+            db.execute('DELETE FROM patients WHERE patient_id = ?', (largest,))
+            db.commit()
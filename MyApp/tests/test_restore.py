@@ -0,0 +1,52 @@
+"""A restore must not run under a live app, whose caches would outlive the replaced data."""
+import os
+import sqlite3
+
+import numpy as np
+import pytest
+
+import backups
+from tensor_cache import TensorCache
+
+
+def make_db(path, rows):
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE t (x INTEGER)')
+    conn.executemany('INSERT INTO t VALUES (?)', [(i,) for i in range(rows)])
+    conn.commit()
+    conn.close()
+
+
+def test_restore_refuses_while_serving(app_module, admin_client, tmp_path):
+    admin_client.get('/model_status')  # the first request marks this process as serving
+    db_path = app_module.app.config['DATABASE']
+    snapshot = backups.backup(db_path, str(tmp_path), compress=False, step_sleep=0)
+    with pytest.raises(backups.BackupError, match='serving'):
+        backups.restore(snapshot['path'], db_path, str(tmp_path))
+
+
+def test_restore_runs_once_servers_are_gone(tmp_path):
+    db_path = str(tmp_path / 'brain_etl.db')
+    make_db(db_path, 3)
+    snapshot = backups.backup(db_path, str(tmp_path / 'backups'), step_sleep=0)
+    conn = sqlite3.connect(db_path)
+    conn.execute('DELETE FROM t')
+    conn.commit()
+    conn.close()
+
+    server = backups.hold_serving_lock(db_path)
+    with pytest.raises(backups.BackupError):
+        backups.restore(snapshot['path'], db_path, str(tmp_path / 'backups'))
+    server.close()  # the server stopped
+
+    backups.restore(snapshot['path'], db_path, str(tmp_path / 'backups'))
+    assert sqlite3.connect(db_path).execute('SELECT COUNT(*) FROM t').fetchone()[0] == 3
+
+
+def test_tensor_cache_clear_removes_disk_entries(tmp_path):
+    cache = TensorCache(cache_dir=str(tmp_path))
+    cache.put(1, np.zeros((299, 299, 3), dtype=np.uint8), 'sha')
+    assert os.listdir(tmp_path)
+    cache.clear()
+    assert cache.get(1) is None
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.npz')]
@@ -0,0 +1,36 @@
+"""Spawn workers re-import app.py as __mp_main__ under `python app.py`; only the serving process starts services."""
+import multiprocessing
+import os
+import sqlite3
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+
+def import_app_in_worker(root):
+    os.environ.update({
+        'DATABASE_PATH': os.path.join(root, 'brain_etl.db'),
+        'BACKUP_INTERVAL_HOURS': '24',
+        'BACKUP_DIR': os.path.join(root, 'backups'),
+        'DERIVATIVE_CACHE_DIR': os.path.join(root, 'derivative_cache'),
+        'MODEL_LOAD_MODE': 'background',
+    })
+    os.chdir(root)
+    sys.modules.pop('app', None)
+    import app
+    tables = [r[0] for r in sqlite3.connect(app.app.config['DATABASE']).execute('SELECT name FROM sqlite_master')]
+    return {
+        'tables': tables,
+        'backup_thread': app.backup_scheduler._thread is not None,
+        'model_state': app.model_loader.state,
+        'upload_folder': os.path.exists(app.app.config['UPLOAD_FOLDER']),
+    }
+
+
+def test_spawn_worker_import_starts_nothing(tmp_path):
+    sqlite3.connect(str(tmp_path / 'brain_etl.db')).close()
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+        state = pool.submit(import_app_in_worker, str(tmp_path)).result(timeout=120)
+    assert state['tables'] == []
+    assert not state['backup_thread']
+    assert state['model_state'] in ('idle', 'unavailable')
+    assert not state['upload_folder']
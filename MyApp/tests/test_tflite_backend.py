@@ -0,0 +1,60 @@
+"""TFLiteModel pads batches to fixed sizes instead of reallocating the interpreter per batch."""
+import numpy as np
+
+import tflite_backend
+
+
+class FakeInterpreter:
+    """Sums each input row; counts tensor allocations across all instances."""
+    allocations = 0
+
+    def __init__(self, model_path, num_threads=None):
+        self.shape = np.array([1, 4])
+
+    def allocate_tensors(self):
+        FakeInterpreter.allocations += 1
+
+    def resize_tensor_input(self, index, shape):
+        self.shape = np.array(shape)
+
+    def get_input_details(self):
+        return [{'index': 0, 'shape': self.shape, 'dtype': np.float32, 'quantization': (0.0, 0)}]
+
+    def get_output_details(self):
+        return [{'index': 1, 'shape': np.array([self.shape[0], 1]), 'dtype': np.float32, 'quantization': (0.0, 0)}]
+
+    def set_tensor(self, index, value):
+        assert value.shape == tuple(self.shape)
+        self.value = value
+
+    def invoke(self):
+        self.out = self.value.sum(axis=1, keepdims=True)
+
+    def get_tensor(self, index):
+        return self.out
+
+
+def test_batches_reuse_bucket_interpreters(monkeypatch):
+    monkeypatch.setattr(tflite_backend, '_interpreter_class', lambda: FakeInterpreter)
+    FakeInterpreter.allocations = 0
+    model = tflite_backend.TFLiteModel('model.tflite', max_batch=16)
+    assert model.buckets == [1, 2, 4, 8, 16]
+
+    rng = np.random.default_rng(0)
+    for size in [3, 5, 1, 16, 7, 40, 3, 5, 2, 9, 12, 1]:
+        batch = rng.random((size, 4), dtype=np.float32)
+        out = model.predict(batch)
+        assert out.shape == (size, 1)
+        np.testing.assert_allclose(out, batch.sum(axis=1, keepdims=True), rtol=1e-6)
+    assert FakeInterpreter.allocations == len(model.buckets)
+
+
+def test_warm_up_allocates_every_bucket(monkeypatch):
+    monkeypatch.setattr(tflite_backend, '_interpreter_class', lambda: FakeInterpreter)
+    FakeInterpreter.allocations = 0
+    model = tflite_backend.TFLiteModel('model.tflite', max_batch=32)
+    model.warm_up()
+    assert sorted(model._interpreters) == model.buckets == [1, 2, 4, 8, 16, 32]
+    allocations = FakeInterpreter.allocations
+    model.predict(np.ones((20, 4), dtype=np.float32))
+    assert FakeInterpreter.allocations == allocations
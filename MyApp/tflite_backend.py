@@ -0,0 +1,101 @@
+"""TFLite inference backend.
+
+Wraps a TFLite interpreter behind the `predict(batch, verbose=0)` interface of
+a Keras model, so the micro-batcher, bulk prediction and warm-up code work
+unchanged whichever backend is served.
+"""
+import os
+import threading
+
+import numpy as np
+
+# serving backend name -> model file suffix produced by export_model.py
+TFLITE_BACKENDS = {
+    'tflite_fp16': '_fp16.tflite',
+    'tflite_dynamic': '_dynamic.tflite',
+    'tflite_int8': '_int8.tflite',
+}
+
+
+def backend_path(keras_path, backend):
+    """Path of the exported file for `backend` next to the Keras model."""
+    return os.path.splitext(keras_path)[0] + TFLITE_BACKENDS[backend]
+
+
+def _interpreter_class():
+    try:
+        from tflite_runtime.interpreter import Interpreter
+        return Interpreter
+    except ImportError:
+        import tensorflow as tf
+        return tf.lite.Interpreter
+
+
+class TFLiteModel:
+    """Keras-style `predict` over TFLite interpreters, one per batch-size bucket.
+
+    Buckets are the powers of two up to `max_batch` (plus `max_batch`). A batch
+    is zero-padded to the next bucket, so each interpreter allocates its tensors
+    once instead of on every change of batch size; larger batches run in
+    `max_batch` slices. Every bucket holds its own tensor arena, so memory
+    grows with the number of buckets in use; `warm_up` allocates them all.
+    """
+
+    def __init__(self, model_path, num_threads=None, max_batch=32):
+        self.model_path = model_path
+        self.num_threads = num_threads
+        self.max_batch = max(1, int(max_batch))
+        self.buckets = sorted({min(2 ** i, self.max_batch) for i in range(self.max_batch.bit_length() + 1)})
+        self._interpreters = {}  # bucket -> (interpreter, input details, output details)
+        self._lock = threading.Lock()  # an interpreter is not safe for concurrent invoke()
+        interpreter = _interpreter_class()(model_path=model_path, num_threads=num_threads)
+        interpreter.allocate_tensors()
+        inp, out = interpreter.get_input_details()[0], interpreter.get_output_details()[0]
+        if int(inp['shape'][0]) in self.buckets:
+            self._interpreters[int(inp['shape'][0])] = (interpreter, inp, out)
+        self.input_shape = tuple(int(d) for d in inp['shape'])
+        self.output_shape = tuple(int(d) for d in out['shape'])
+
+    def _interpreter(self, batch_size):
+        entry = self._interpreters.get(batch_size)
+        if entry is None:
+            interpreter = _interpreter_class()(model_path=self.model_path, num_threads=self.num_threads)
+            inp = interpreter.get_input_details()[0]
+            shape = list(inp['shape'])
+            shape[0] = batch_size
+            interpreter.resize_tensor_input(inp['index'], shape)
+            interpreter.allocate_tensors()
+            entry = (interpreter, interpreter.get_input_details()[0], interpreter.get_output_details()[0])
+            self._interpreters[batch_size] = entry
+        return entry
+
+    def warm_up(self):
+        """Run a zero batch through every bucket, so memory is at its serving size up front."""
+        for bucket in self.buckets:
+            self.predict(np.zeros((bucket,) + self.input_shape[1:], dtype=np.float32))
+
+    def predict(self, batch, verbose=0):
+        batch = np.asarray(batch, dtype=np.float32)
+        if len(batch) > self.max_batch:
+            return np.concatenate([self.predict(batch[i:i + self.max_batch])
+                                   for i in range(0, len(batch), self.max_batch)])
+        count = len(batch)
+        bucket = next(size for size in self.buckets if size >= count)
+        if bucket != count:
+            padded = np.zeros((bucket,) + batch.shape[1:], dtype=np.float32)
+            padded[:count] = batch
+            batch = padded
+
+        with self._lock:
+            interpreter, inp, out_details = self._interpreter(bucket)
+            scale, zero_point = inp['quantization']
+            if inp['dtype'] != np.float32 and scale:
+                batch = np.round(batch / scale + zero_point).astype(inp['dtype'])
+            interpreter.set_tensor(inp['index'], batch)
+            interpreter.invoke()
+            out = interpreter.get_tensor(out_details['index'])[:count]
+
+            scale, zero_point = out_details['quantization']
+            if out_details['dtype'] != np.float32 and scale:
+                out = (out.astype(np.float32) - zero_point) * scale
+            return np.array(out, dtype=np.float32)